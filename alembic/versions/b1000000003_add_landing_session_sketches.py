@@ -0,0 +1,68 @@
+"""add landing_session_sketches (HyperLogLog unique-session counters) + backfill
+
+Revision ID: b1000000003
+Revises: b1000000002
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b1000000003'
+down_revision = 'b1000000002'
+branch_labels = None
+depends_on = None
+
+# (landing key used by services/landing_sketch.py, raw events table)
+_SOURCES = [
+    ('quiz', 'quiz_events'),
+    ('course', 'course_landing_events'),
+    ('agency', 'agency_events'),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'landing_session_sketches',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('landing', sa.String(length=20), nullable=False),
+        sa.Column('event_type', sa.String(length=60), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('utm_source', sa.String(length=100), nullable=False, server_default=''),
+        sa.Column('registers', sa.LargeBinary(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('landing', 'event_type', 'day', 'utm_source', name='uq_landing_sketch_key'),
+    )
+    op.create_index('ix_landing_sketch_landing_day', 'landing_session_sketches', ['landing', 'day'], unique=False)
+
+    # Backfill from the raw event tables so existing funnels keep their history.
+    from services.hll import HyperLogLog
+
+    bind = op.get_bind()
+    sketches_t = sa.table(
+        'landing_session_sketches',
+        sa.column('landing'), sa.column('event_type'), sa.column('day'),
+        sa.column('utm_source'), sa.column('registers'),
+    )
+    for landing, table in _SOURCES:
+        sketches = defaultdict(HyperLogLog)
+        rows = bind.execute(sa.text(
+            f"SELECT DISTINCT event_type, CAST(created_at AS DATE), COALESCE(utm_source, ''), session_id "
+            f"FROM {table} WHERE created_at IS NOT NULL"
+        ))
+        for event_type, day, utm_source, session_id in rows:
+            sketches[(event_type, day, utm_source[:100])].add(session_id)
+        if sketches:
+            op.bulk_insert(sketches_t, [
+                {'landing': landing, 'event_type': evt, 'day': day, 'utm_source': src, 'registers': hll.to_bytes()}
+                for (evt, day, src), hll in sketches.items()
+            ])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_landing_sketch_landing_day', table_name='landing_session_sketches')
+    op.drop_table('landing_session_sketches')
@@ -0,0 +1,52 @@
+"""add daily_event_rollups, retention_runs + created_at indexes for retention
+
+Revision ID: b1000000004
+Revises: b1000000003
+Create Date: 2026-10-18 00:00:01.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b1000000004'
+down_revision = 'b1000000003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'daily_event_rollups',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('source', sa.String(length=30), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('event_type', sa.String(length=60), nullable=False),
+        sa.Column('dimension', sa.String(length=100), nullable=False, server_default=''),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source', 'day', 'event_type', 'dimension', name='uq_daily_event_rollup_key'),
+    )
+    op.create_index('ix_daily_event_rollups_source_type', 'daily_event_rollups', ['source', 'event_type'], unique=False)
+
+    op.create_table(
+        'retention_runs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('started_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('report', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+    # Batches select `WHERE created_at < cutoff ORDER BY created_at LIMIT n`.
+    op.create_index('ix_events_created_at', 'events', ['created_at'], unique=False)
+    op.create_index(op.f('ix_group_warnings_created_at'), 'group_warnings', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_group_warnings_created_at'), table_name='group_warnings')
+    op.drop_index('ix_events_created_at', table_name='events')
+    op.drop_table('retention_runs')
+    op.drop_index('ix_daily_event_rollups_source_type', table_name='daily_event_rollups')
+    op.drop_table('daily_event_rollups')
@@ -0,0 +1,43 @@
+"""add users keyset indexes + pg_trgm search indexes for the admin users list
+
+Revision ID: b1000000005
+Revises: b1000000004
+Create Date: 2026-10-18 00:00:02.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b1000000005'
+down_revision = 'b1000000004'
+branch_labels = None
+depends_on = None
+
+_TRGM_COLUMNS = ('name', 'username', 'phone')
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_created_at_id', 'users', ['created_at', 'id'], unique=False)
+    op.create_index('ix_users_lead_score_id', 'users', ['lead_score', 'id'], unique=False)
+    # Same directions as the "source" sort (source ASC NULLS LAST, created_at DESC, id DESC);
+    # a plain (source, created_at, id) index can't serve that order in either scan direction.
+    op.create_index(
+        'ix_users_source_created_at_id', 'users',
+        ['source', sa.text('created_at DESC'), sa.text('id DESC')], unique=False,
+    )
+
+    # ILIKE '%q%' can only use an index through trigrams.
+    op.execute(sa.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for col in _TRGM_COLUMNS:
+        op.execute(sa.text(
+            f"CREATE INDEX IF NOT EXISTS ix_users_{col}_trgm ON users USING gin ({col} gin_trgm_ops)"
+        ))
+
+
+def downgrade() -> None:
+    for col in _TRGM_COLUMNS:
+        op.execute(sa.text(f"DROP INDEX IF EXISTS ix_users_{col}_trgm"))
+    op.drop_index('ix_users_source_created_at_id', table_name='users')
+    op.drop_index('ix_users_lead_score_id', table_name='users')
+    op.drop_index('ix_users_created_at_id', table_name='users')
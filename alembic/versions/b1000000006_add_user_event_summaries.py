@@ -0,0 +1,43 @@
+"""add user_event_summaries (per-user event aggregates for audience segments) + backfill
+
+Revision ID: b1000000006
+Revises: b1000000005
+Create Date: 2026-10-18 00:00:03.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b1000000006'
+down_revision = 'b1000000005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_event_summaries',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('event_type', sa.String(length=50), nullable=False),
+        sa.Column('first_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('last_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'event_type', name='uq_user_event_summary'),
+    )
+    op.create_index('ix_user_event_summaries_type_last', 'user_event_summaries', ['event_type', 'last_at'], unique=False)
+
+    # One pass over the raw table; from here on AnalyticsService.track() keeps it current.
+    op.execute(sa.text(
+        "INSERT INTO user_event_summaries (user_id, event_type, first_at, last_at, count) "
+        "SELECT user_id, event_type, MIN(COALESCE(created_at, now())), MAX(COALESCE(created_at, now())), COUNT(*) "
+        "FROM events GROUP BY user_id, event_type"
+    ))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_event_summaries_type_last', table_name='user_event_summaries')
+    op.drop_table('user_event_summaries')
@@ -0,0 +1,25 @@
+"""add broadcast_messages.source_chat_id / source_message_ids (copyMessage fan-out)
+
+Revision ID: b1000000007
+Revises: b1000000006
+Create Date: 2026-10-18 00:00:04.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b1000000007'
+down_revision = 'b1000000006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('broadcast_messages', sa.Column('source_chat_id', sa.BigInteger(), nullable=True))
+    op.add_column('broadcast_messages', sa.Column('source_message_ids', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('broadcast_messages', 'source_message_ids')
+    op.drop_column('broadcast_messages', 'source_chat_id')
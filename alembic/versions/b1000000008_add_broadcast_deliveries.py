@@ -0,0 +1,37 @@
+"""add broadcast_deliveries (per-recipient broadcast outcomes)
+
+Revision ID: b1000000008
+Revises: b1000000007
+Create Date: 2026-10-18 00:00:05.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b1000000008'
+down_revision = 'b1000000007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'broadcast_deliveries',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('broadcast_id', sa.Integer(), nullable=False),
+        sa.Column('telegram_id', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('error_class', sa.String(length=60), nullable=True),
+        sa.Column('message_id', sa.BigInteger(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['broadcast_id'], ['broadcast_messages.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('broadcast_id', 'telegram_id', name='uq_broadcast_delivery'),
+    )
+    op.create_index('ix_broadcast_deliveries_broadcast_status', 'broadcast_deliveries', ['broadcast_id', 'status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_broadcast_deliveries_broadcast_status', table_name='broadcast_deliveries')
+    op.drop_table('broadcast_deliveries')
@@ -0,0 +1,29 @@
+"""daily_reports: one row per AmoCRM user per day (bulk upsert key)
+
+Revision ID: b1000000009
+Revises: b1000000008
+Create Date: 2026-10-18 00:00:06.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b1000000009'
+down_revision = 'b1000000008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keep the latest report per user and day, then truncate report_date to the day
+    op.execute(
+        "DELETE FROM daily_reports WHERE id NOT IN ("
+        "  SELECT MAX(id) FROM daily_reports GROUP BY amocrm_user_id, date_trunc('day', report_date)"
+        ")"
+    )
+    op.execute("UPDATE daily_reports SET report_date = date_trunc('day', report_date)")
+    op.create_unique_constraint('uq_daily_report_user_day', 'daily_reports', ['amocrm_user_id', 'report_date'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_daily_report_user_day', 'daily_reports', type_='unique')
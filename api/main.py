@@ -17,7 +17,6 @@ from fastapi.middleware.cors import CORSMiddleware
 
 
 from aiogram import Bot, Dispatcher, types
-from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from bot.config import settings
 
@@ -61,20 +60,34 @@ async def lifespan(app: FastAPI):
 
     service_name = os.getenv("RAILWAY_SERVICE_NAME", "web")
 
-    # Start AmoCRM daily cron (ONLY on web service)
+    # Start AmoCRM daily cron + nightly retention / warehouse export (ONLY on web service)
     if service_name == "web":
         from services.daily_cron import start_cron
         start_cron()
 
+        from services.retention import start_cron as start_retention_cron
+        start_retention_cron()
+
+        from services.warehouse_export import start_cron as start_warehouse_cron
+        start_warehouse_cron()
+
+        from services.scratch import start_sweeper
+        start_sweeper()
+
+    # Landing beacons are buffered per process — every service that serves them flushes
+    from services.landing_sketch import flush as flush_landing_sketches, start_flusher
+    start_flusher()
+
     # (No redundant DB backfills)
 
     global bot, dp
     storage = await make_storage()
-    bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    from bot.utils.bot_registry import close_bots, get_bot
+    bot = get_bot(parse_mode=ParseMode.HTML)  # shares the process-wide HTTP pool
     dp = Dispatcher(storage=storage)
 
     # Register bot routers
-    from bot.handlers import registration, segmentation, lead_magnet, funnel, subscription, referral as bot_referral, admin as bot_admin, moderation, menu, lifecycle, jobs, hr_interview, superapp, moderator, moderator_group, wallet, videonote, mediadown, fileconvert, bg_remover, scanner, voicer, compressor, tripwire, application
+    from bot.handlers import registration, segmentation, lead_magnet, funnel, subscription, referral as bot_referral, admin as bot_admin, moderation, menu, lifecycle, jobs, hr_interview, superapp, moderator, moderator_group, wallet, videonote, mediadown, fileconvert, bg_remover, scanner, voicer, compressor, media_jobs, tripwire, application
     dp.include_routers(
         lifecycle.router,       # Bot block/unblock tracking — must be first
         moderator_group.router, # Group moderation — must be before menu
@@ -99,6 +112,7 @@ async def lifespan(app: FastAPI):
         scanner.router,
         voicer.router,          # free edge-tts
         compressor.router,
+        media_jobs.router,      # ❌ cancel on queued/running media jobs
         moderation.router,
         menu.router,
     )
@@ -147,8 +161,8 @@ async def lifespan(app: FastAPI):
             logger.info("✅ Webhook saqlab qolindi (zero-downtime)")
         except Exception as e:
             logger.error(f"❌ Webhook o'chirishda xatolik: {e}")
-    if bot:
-        await bot.session.close()
+    await flush_landing_sketches()
+    await close_bots()
 
 
 app = FastAPI(
@@ -107,6 +107,34 @@ async def debug_endpoint(admin_id: int = Depends(check_admin), db: AsyncSession
         return {"db_ok": False, "error": str(e)}
 
 
+@router.get("/bot-http")
+async def get_bot_http_stats(admin_id: int = Depends(check_admin)):
+    """Bot API client pool of this process: connection reuse and request latency."""
+    from bot.utils.bot_registry import stats
+    return stats()
+
+
+@router.get("/media-cache")
+async def get_media_cache_stats(admin_id: int = Depends(check_admin)):
+    """Conversion result cache: hit rate and bytes saved per media tool."""
+    from services.media_cache import stats
+    return await stats()
+
+
+@router.get("/media-ffmpeg")
+async def get_media_ffmpeg_stats(admin_id: int = Depends(check_admin)):
+    """ffmpeg runs per tool: failures, encode fps, realtime factor, CPU per media second."""
+    from services.ffmpeg_runner import stats
+    return await stats()
+
+
+@router.get("/scratch")
+async def get_scratch_usage(admin_id: int = Depends(check_admin)):
+    """Media scratch space: used / reserved / quota per root, free disk, sweeper totals."""
+    from services.scratch import usage
+    return await usage()
+
+
 @router.get("/stats")
 async def get_dashboard_stats(admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
     """High-level KPIs for Dashboard Home."""
@@ -260,6 +288,92 @@ async def get_dashboard_stats(admin_id: int = Depends(check_admin), db: AsyncSes
     }
 
 
+# ── Users list: keyset pagination + cached totals ──
+# Searches on name/username/phone are ILIKE '%q%' backed by pg_trgm GIN
+# indexes (migration b1000000005); totals are cached per (status, q) for
+# USERS_TOTAL_TTL seconds and capped for searches instead of recounting the
+# full join on every page.
+import base64
+import json
+import time as _time
+from sqlalchemy import and_, or_, tuple_
+
+USERS_TOTAL_TTL = 60
+USERS_SEARCH_COUNT_CAP = 1000
+_users_total_cache: Dict[tuple, tuple] = {}
+
+
+def _users_order_by(sort: str) -> list:
+    if sort == "date_asc":
+        return [User.created_at.asc(), User.id.asc()]
+    if sort == "score_desc":
+        return [User.lead_score.desc(), User.id.desc()]
+    if sort == "source":
+        return [User.source.asc().nullslast(), User.created_at.desc(), User.id.desc()]
+    return [User.created_at.desc(), User.id.desc()]  # date_desc (default)
+
+
+def _users_cursor_values(sort: str, user: User) -> list:
+    created = user.created_at.isoformat() if user.created_at else None
+    if sort == "score_desc":
+        return [user.lead_score or 0, user.id]
+    if sort == "source":
+        return [user.source, created, user.id]
+    return [created, user.id]
+
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            raise ValueError
+        return values
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _users_after_cursor(sort: str, values: list):
+    """WHERE clause selecting rows strictly after the cursor in `sort` order."""
+    def _dt(v):
+        return datetime.fromisoformat(v) if v else None
+
+    try:
+        if sort == "score_desc":
+            score, last_id = values
+            return tuple_(User.lead_score, User.id) < (int(score), int(last_id))
+        if sort == "source":
+            source, created, last_id = values
+            tail = tuple_(User.created_at, User.id) < (_dt(created), int(last_id))
+            if source is None:  # already inside the NULLS LAST block
+                return and_(User.source.is_(None), tail)
+            return or_(User.source > source, User.source.is_(None), and_(User.source == source, tail))
+        created, last_id = values
+        if sort == "date_asc":
+            return tuple_(User.created_at, User.id) > (_dt(created), int(last_id))
+        return tuple_(User.created_at, User.id) < (_dt(created), int(last_id))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _users_total(db: AsyncSession, conds: list, cache_key: tuple, capped: bool) -> int:
+    cached = _users_total_cache.get(cache_key)
+    if cached and cached[0] > _time.monotonic():
+        return cached[1]
+    inner = select(User.id).where(*conds)
+    if capped:
+        inner = inner.limit(USERS_SEARCH_COUNT_CAP)
+    total = (await db.execute(select(func.count()).select_from(inner.subquery()))).scalar() or 0
+    _users_total_cache[cache_key] = (_time.monotonic() + USERS_TOTAL_TTL, total)
+    if len(_users_total_cache) > 500:  # searches are free-form — keep the cache bounded
+        _users_total_cache.clear()
+    return total
+
+
 @router.get("/users")
 async def get_users_list(
     status: str = "all",  # all | active | inactive
@@ -267,52 +381,64 @@ async def get_users_list(
     sort: str = "date_desc",  # date_desc | date_asc | score_desc | source
     page: int = 1,
     limit: int = 50,
+    cursor: Optional[str] = None,  # keyset cursor from a previous response's nextCursor
     admin_id: int = Depends(check_admin),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get CRM users list with pagination."""
+    """Get CRM users list.
+
+    Pass `cursor` (the previous response's `nextCursor`) for O(limit) keyset
+    paging at any depth; `page` still works via OFFSET for direct page jumps.
+    """
     limit = min(limit, 100)
     offset = (max(page, 1) - 1) * limit
 
-    query = select(User, Subscription).outerjoin(Subscription, Subscription.user_id == User.id)
-
+    conds = []
     # Filter by status (is_active definition)
     if status == "active":
-        query = query.where(User.is_active.isnot(False))
+        conds.append(User.is_active.isnot(False))
     elif status == "inactive":
-        query = query.where(User.is_active == False)
+        conds.append(User.is_active == False)
     elif status == "registered":
-        query = query.where(User.user_status == "registered")
+        conds.append(User.user_status == "registered")
 
-    # Server-side search logic
-    if q:
-        q_clean = q.strip()
+    # Server-side search logic (trigram-indexed ILIKE)
+    q_clean = q.strip()
+    if q_clean:
         if q_clean.isdigit():
-            query = query.where(
-                (User.telegram_id == int(q_clean)) | 
+            conds.append(
+                (User.telegram_id == int(q_clean)) |
                 (User.phone.contains(q_clean))
             )
         elif q_clean.startswith("@"):
-            query = query.where(User.username.ilike(f"%{q_clean[1:]}%"))
+            q_user_escaped = q_clean[1:].replace("%", "\\%").replace("_", "\\_")
+            conds.append(User.username.ilike(f"%{q_user_escaped}%"))
         else:
             q_clean_escaped = q_clean.replace("%", "\\%").replace("_", "\\_")
-            query = query.where(User.name.ilike(f"%{q_clean_escaped}%"))
+            conds.append(User.name.ilike(f"%{q_clean_escaped}%"))
 
-    # Sorting
-    if sort == "date_asc":
-        query = query.order_by(User.created_at.asc())
-    elif sort == "score_desc":
-        query = query.order_by(User.lead_score.desc())
-    elif sort == "source":
-        query = query.order_by(User.source.asc().nullslast(), User.created_at.desc())
-    else:  # date_desc (default)
-        query = query.order_by(User.created_at.desc())
-
-    count_q = select(func.count()).select_from(query.subquery())
-    total = (await db.execute(count_q)).scalar() or 0
-
-    result = await db.execute(query.offset(offset).limit(limit))
+    if sort not in ("date_desc", "date_asc", "score_desc", "source"):
+        sort = "date_desc"
+
+    total = await _users_total(db, conds, (status, q_clean), capped=bool(q_clean))
+
+    query = (
+        select(User, Subscription)
+        .outerjoin(Subscription, Subscription.user_id == User.id)
+        .where(*conds)
+        .order_by(*_users_order_by(sort))
+    )
+    if cursor:
+        query = query.where(_users_after_cursor(sort, _decode_cursor(cursor)))
+    else:
+        query = query.offset(offset)
+
+    # Fetch one extra row to know whether another page exists without counting
+    result = await db.execute(query.limit(limit + 1))
     rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(_users_cursor_values(sort, rows[-1][0])) if has_more and rows else None
 
     res = []
     for user, sub in rows:
@@ -347,7 +473,7 @@ async def get_users_list(
             "createdAt": user.created_at.strftime("%d.%m.%Y %H:%M") if user.created_at else "—",
             "events": []
         })
-    return {"users": res, "total": total, "page": page, "hasMore": (offset + limit) < total}
+    return {"users": res, "total": total, "page": page, "hasMore": has_more, "nextCursor": next_cursor}
 
 
 class BalanceAdjustment(BaseModel):
@@ -486,17 +612,25 @@ async def get_funnel_stats(admin_id: int = Depends(check_admin), db: AsyncSessio
 async def get_events_stats(admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
     """Get interaction and traffic data from real DB events."""
 
-    # Top button clicks — aggregate event_type counts for click events
+    # Top button clicks — raw click events + counts already compacted into
+    # daily_event_rollups by the retention job (services/retention.py)
+    from db.models import DailyEventRollup
     click_Q = await db.execute(
         select(Event.event_type, func.count(Event.id).label("cnt"))
         .where(Event.event_type.like("%_click%"))
         .group_by(Event.event_type)
-        .order_by(func.count(Event.id).desc())
-        .limit(5)
     )
+    clicks = {row.event_type: row.cnt for row in click_Q.all()}
+    rolled_Q = await db.execute(
+        select(DailyEventRollup.event_type, func.sum(DailyEventRollup.count).label("cnt"))
+        .where(DailyEventRollup.source == "events", DailyEventRollup.event_type.like("%_click%"))
+        .group_by(DailyEventRollup.event_type)
+    )
+    for row in rolled_Q.all():
+        clicks[row.event_type] = clicks.get(row.event_type, 0) + int(row.cnt or 0)
     top_buttons = [
-        {"name": row.event_type.replace("_click", "").replace("_", " ").title(), "clicks": row.cnt, "trend": "—"}
-        for row in click_Q.all()
+        {"name": evt.replace("_click", "").replace("_", " ").title(), "clicks": cnt, "trend": "—"}
+        for evt, cnt in sorted(clicks.items(), key=lambda kv: kv[1], reverse=True)[:5]
     ]
 
     # Traffic sources — count distinct users per source
@@ -586,6 +720,12 @@ async def send_broadcast(payload: dict, admin_id: int = Depends(check_admin), db
         filters = {"lead_segment": "hot"}
     elif audience_index == 3:
         filters = {"paid": True}
+    # Optional segment spec on top of the preset (services/segments.py),
+    # e.g. {"events": [{"event": "vsl_50"}, {"event": "payment_open", "has": false, "within_days": 7}]}
+    custom_filters = payload.get("filters")
+    if custom_filters:
+        _check_segment_spec(custom_filters)
+        filters = {**filters, **custom_filters}
 
     from services.broadcast import BroadcastService
     from services.crm import CRMService
@@ -653,7 +793,52 @@ async def send_broadcast(payload: dict, admin_id: int = Depends(check_admin), db
 
 
 
+@router.get("/broadcast/{broadcast_id}/deliveries")
+async def get_broadcast_deliveries(broadcast_id: int, admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
+    """Delivery breakdown for one broadcast (status × error class)."""
+    from db.models import BroadcastDelivery
+    rows = (await db.execute(
+        select(BroadcastDelivery.status, BroadcastDelivery.error_class, func.count())
+        .where(BroadcastDelivery.broadcast_id == broadcast_id)
+        .group_by(BroadcastDelivery.status, BroadcastDelivery.error_class)
+    )).all()
+    by_status: Dict[str, int] = {}
+    errors = []
+    for status, error_class, cnt in rows:
+        by_status[status] = by_status.get(status, 0) + cnt
+        if error_class:
+            errors.append({"status": status, "errorClass": error_class, "count": cnt})
+    errors.sort(key=lambda e: -e["count"])
+    return {"broadcastId": broadcast_id, "byStatus": by_status, "errors": errors}
+
+
+@router.post("/broadcast/{broadcast_id}/retry-failed")
+async def retry_failed_broadcast(broadcast_id: int, admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
+    """Re-send only to recipients whose delivery failed (blocked users are not retried)."""
+    from services.broadcast import BroadcastService
+    from services.broadcast_delivery import count_failed
+    broadcast = await BroadcastService(db).get_broadcast(broadcast_id)
+    if not broadcast:
+        raise HTTPException(status_code=404, detail="Broadcast topilmadi")
+    if broadcast.status == "sending":
+        raise HTTPException(status_code=409, detail="Broadcast hali yuborilmoqda")
+    failed = await count_failed(db, broadcast_id)
+    if failed:
+        from taskqueue import schedule_broadcast
+        await schedule_broadcast(broadcast_id=broadcast_id, retry_failed=True)
+    return {"status": "accepted" if failed else "nothing_to_retry", "broadcast_id": broadcast_id, "recipient_count": failed}
+
+
 # ── Helpers ───────────────────────────────────────
+def _check_segment_spec(spec) -> None:
+    """400 naming the offending key for a malformed segment spec."""
+    from services.segments import SpecError, validate_spec
+    try:
+        validate_spec(spec)
+    except SpecError as e:
+        raise HTTPException(status_code=400, detail=f"Noto'g'ri segment filtri: {e}")
+
+
 def _format_time(dt: datetime) -> str:
     """Format datetime to readable 'X daqiqa' or date string."""
     if not dt:
@@ -679,31 +864,32 @@ def _format_time(dt: datetime) -> str:
 
 
 @router.get("/audience-counts")
-async def get_audience_counts(admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
+async def get_audience_counts(admin_id: int = Depends(check_admin)):
     """Return real audience segment counts for the Broadcast composer."""
-    all_q = await db.execute(select(func.count(func.distinct(User.telegram_id))))
-    all_users = all_q.scalar() or 0
-
-    active_sub_ids = select(Subscription.user_id).where(Subscription.status == "active").scalar_subquery()
-    video_not_paid_q = await db.execute(
-        select(func.count(func.distinct(User.telegram_id))).where(
-            User.lead_score >= 30,
-            User.id.not_in(active_sub_ids)
-        )
-    )
-    video_not_paid = video_not_paid_q.scalar() or 0
+    from services.segments import get_index
+    index = await get_index()
+    return {
+        "all": index.count({}),
+        "video_not_paid": index.count({"lead_score_min": 30, "not": {"paid": True}}),
+        "hot": index.count({"lead_segment": "hot"}),
+        "paid": index.count({"paid": True}),
+    }
 
-    hot_q = await db.execute(
-        select(func.count(func.distinct(User.telegram_id))).where(User.lead_segment == "hot")
-    )
-    hot = hot_q.scalar() or 0
 
-    paid_q = await db.execute(
-        select(func.count(func.distinct(Subscription.user_id))).where(Subscription.status == "active")
-    )
-    paid = paid_q.scalar() or 0
+@router.post("/segments/count")
+async def count_segment(spec: dict, admin_id: int = Depends(check_admin)):
+    """Instant count for an arbitrary segment spec (see services/segments.py).
 
-    return {"all": all_users, "video_not_paid": video_not_paid, "hot": hot, "paid": paid}
+    `recipients` applies the broadcast's implicit is_active condition.
+    """
+    from services.segments import get_index
+    _check_segment_spec(spec)
+    index = await get_index()
+    return {
+        "count": index.count(spec),
+        "recipients": index.count({"and": [spec], "is_active": True}),
+        "indexAgeSeconds": round(index.age, 1),
+    }
 
 
 @router.get("/broadcasts")
@@ -945,39 +1131,35 @@ async def upload_media_form(
     Accept a media file via multipart form, send it to the admin's Telegram chat
     to get a stable file_id, and return it.
     """
-    from aiogram import Bot
     from aiogram.types import BufferedInputFile
-    from bot.config import settings
+    from bot.utils.bot_registry import get_bot
 
     content = await file.read()
     mime = file.content_type or ""
     filename = file.filename or "file"
 
-    bot = Bot(token=settings.BOT_TOKEN)
-    try:
-        input_file = BufferedInputFile(content, filename=filename)
-        if mime.startswith("image/"):
-            msg = await bot.send_photo(chat_id=admin_id, photo=input_file)
-            file_id = msg.photo[-1].file_id
-            tg_type = "photo"
-        elif mime.startswith("video/"):
-            msg = await bot.send_video(chat_id=admin_id, video=input_file)
-            file_id = msg.video.file_id
-            tg_type = "video"
-        elif mime.startswith("audio/") or mime == "audio/mpeg":
-            msg = await bot.send_audio(chat_id=admin_id, audio=input_file)
-            file_id = msg.audio.file_id
-            tg_type = "audio"
-        elif mime == "audio/ogg":
-            msg = await bot.send_voice(chat_id=admin_id, voice=input_file)
-            file_id = msg.voice.file_id
-            tg_type = "voice"
-        else:
-            msg = await bot.send_document(chat_id=admin_id, document=input_file)
-            file_id = msg.document.file_id
-            tg_type = "document"
-    finally:
-        await bot.session.close()
+    bot = get_bot()
+    input_file = BufferedInputFile(content, filename=filename)
+    if mime.startswith("image/"):
+        msg = await bot.send_photo(chat_id=admin_id, photo=input_file)
+        file_id = msg.photo[-1].file_id
+        tg_type = "photo"
+    elif mime.startswith("video/"):
+        msg = await bot.send_video(chat_id=admin_id, video=input_file)
+        file_id = msg.video.file_id
+        tg_type = "video"
+    elif mime.startswith("audio/") or mime == "audio/mpeg":
+        msg = await bot.send_audio(chat_id=admin_id, audio=input_file)
+        file_id = msg.audio.file_id
+        tg_type = "audio"
+    elif mime == "audio/ogg":
+        msg = await bot.send_voice(chat_id=admin_id, voice=input_file)
+        file_id = msg.voice.file_id
+        tg_type = "voice"
+    else:
+        msg = await bot.send_document(chat_id=admin_id, document=input_file)
+        file_id = msg.document.file_id
+        tg_type = "document"
 
     return {"file_id": file_id, "content_type": tg_type}
 
@@ -1166,51 +1348,50 @@ async def delete_course(course_id: int, admin_id: int = Depends(check_admin), db
 
 # ── CSV Export ──────────────────────────────────
 from fastapi.responses import StreamingResponse
-import io, csv
 
 @router.get("/users/export")
-async def export_users_csv(admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
-    """Export all users as CSV for download."""
-    query = select(User, Subscription).outerjoin(Subscription, Subscription.user_id == User.id)
-    result = await db.execute(query.order_by(User.created_at.desc()))
-    rows = result.all()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "ID", "Telegram ID", "Ism", "Username", "Telefon",
-        "Status", "Manba", "Kampaniya", "Lead Score",
-        "Aktiv", "Ro'yxatdan o'tgan sana", "Qo'shilgan sana"
-    ])
+async def export_users_csv(
+    format: str = "csv",       # csv | csv.gz | parquet
+    columns: Optional[str] = None,  # comma-separated keys from services.user_export.COLUMNS
+    active_only: bool = False,
+    # Broadcast segment filters (same semantics as CRMService._apply_filters)
+    source: Optional[str] = None,
+    campaign: Optional[str] = None,
+    level_tag: Optional[str] = None,
+    lead_score_min: Optional[int] = None,
+    lead_score_max: Optional[int] = None,
+    user_status: Optional[str] = None,
+    lead_segment: Optional[str] = None,
+    paid: bool = False,
+    admin_id: int = Depends(check_admin),
+):
+    """Export users for download, streamed straight from a server-side cursor."""
+    from services.user_export import FORMATS, FORMAT_PARQUET, MEDIA_TYPES, UserExporter, parse_columns, parquet_available
 
-    for user, sub in rows:
-        if sub and sub.status == "active":
-            status = "To'lagan"
-        elif user.user_status == "registered":
-            status = "Ro'yxatdan o'tgan"
-        else:
-            status = "Ro'yxatdan o'tmagan"
-
-        writer.writerow([
-            user.id,
-            user.telegram_id,
-            user.name or "",
-            user.username or "",
-            user.phone or "",
-            status,
-            user.source or "organik",
-            user.campaign or "",
-            user.lead_score or 0,
-            "Ha" if user.is_active else "Yo'q",
-            user.registered_at.strftime("%d.%m.%Y %H:%M") if user.registered_at else "",
-            user.created_at.strftime("%d.%m.%Y %H:%M") if user.created_at else "",
-        ])
-
-    output.seek(0)
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    if format == FORMAT_PARQUET and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow on the server")
+    try:
+        cols = parse_columns(columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    exporter = UserExporter(
+        filters={
+            "source": source, "campaign": campaign, "level_tag": level_tag,
+            "lead_score_min": lead_score_min, "lead_score_max": lead_score_max,
+            "user_status": user_status, "lead_segment": lead_segment, "paid": paid,
+        },
+        columns=cols,
+        active_only=active_only,
+    )
+    # The exporter opens its own session: request-scoped dependencies are
+    # closed before a StreamingResponse body starts iterating.
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=users_export.csv"}
+        exporter.stream(format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=users_export.{format}"}
     )
 
 
@@ -1533,15 +1714,13 @@ async def delete_job(job_id: int, admin_id: int = Depends(check_admin), db: Asyn
     # Or simply set it to inactive? The prompt requested to delete ("o'chirish imkoni").
     # We will delete from DB. Let's try to delete the message in the channel first if possible.
     if job.channel_msg_id and job.status == "posted" and job.is_active:
-        from aiogram import Bot
-        from aiogram.client.default import DefaultBotProperties
         from aiogram.enums import ParseMode
-        from bot.config import settings
         from bot.handlers.jobs import _get_jobs_channel_id
+        from bot.utils.bot_registry import get_bot
 
         channel_id = await _get_jobs_channel_id()
         if channel_id:
-            bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+            bot = get_bot(parse_mode=ParseMode.HTML)
             try:
                 # Try to edit the message to [🔴 YOPILGAN] instead of deleting
                 # to avoid 48 hours deletion limit issues.
@@ -1557,8 +1736,6 @@ async def delete_job(job_id: int, admin_id: int = Depends(check_admin), db: Asyn
             except Exception as e:
                 import logging
                 logging.getLogger("admin.jobs").warning(f"Failed to edit channel msg {job.channel_msg_id}: {e}")
-            finally:
-                await bot.session.close()
                 
     await db.delete(job)
     await db.commit()
@@ -1567,22 +1744,28 @@ async def delete_job(job_id: int, admin_id: int = Depends(check_admin), db: Asyn
 
 # ── Quiz (AI knowledge test / Instagram bio landing) Analytics ──
 from db.models import QuizEvent, QuizSubmission
+from services.landing_sketch import LANDING_AGENCY, LANDING_COURSE, LANDING_QUIZ, LandingSketchService
 
 QUIZ_FUNNEL_STAGES = ["page_view", "profession_selected", "quiz_started", "quiz_completed", "contact_view", "submitted"]
 
 
 @router.get("/quiz/stats")
-async def get_quiz_stats(days: int = 30, admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
-    """Funnel breakdown (unique sessions per stage) + submission summary for the quiz landing."""
+async def get_quiz_stats(
+    days: int = 30,
+    utm_source: Optional[str] = None,
+    admin_id: int = Depends(check_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """Funnel breakdown (unique sessions per stage) + submission summary for the quiz landing.
+
+    Funnel counts are merged from per-day HyperLogLog sketches (≈1.6% error)
+    over the last `days` calendar days, optionally for a single utm_source.
+    """
     since = datetime.utcnow() - timedelta(days=days)
 
-    funnel = {}
-    for stage in QUIZ_FUNNEL_STAGES:
-        res = await db.execute(
-            select(func.count(func.distinct(QuizEvent.session_id)))
-            .where(QuizEvent.event_type == stage, QuizEvent.created_at >= since)
-        )
-        funnel[stage] = res.scalar() or 0
+    funnel = await LandingSketchService(db).unique_counts(
+        LANDING_QUIZ, QUIZ_FUNNEL_STAGES, since.date(), utm_source=utm_source,
+    )
 
     total_submissions_res = await db.execute(
         select(func.count()).select_from(QuizSubmission).where(QuizSubmission.created_at >= since)
@@ -1713,17 +1896,18 @@ async def update_course_landing_lead_status(
 
 
 @router.get("/course-landing/stats")
-async def get_course_landing_stats(days: int = 30, admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
-    """Funnel breakdown (unique sessions per stage) + lead/tariff summary."""
+async def get_course_landing_stats(
+    days: int = 30,
+    utm_source: Optional[str] = None,
+    admin_id: int = Depends(check_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """Funnel breakdown (unique sessions per stage, from HLL sketches) + lead/tariff summary."""
     since = datetime.utcnow() - timedelta(days=days)
 
-    funnel = {}
-    for stage in COURSE_LANDING_FUNNEL_STAGES:
-        res = await db.execute(
-            select(func.count(func.distinct(CourseLandingEvent.session_id)))
-            .where(CourseLandingEvent.event_type == stage, CourseLandingEvent.created_at >= since)
-        )
-        funnel[stage] = res.scalar() or 0
+    funnel = await LandingSketchService(db).unique_counts(
+        LANDING_COURSE, COURSE_LANDING_FUNNEL_STAGES, since.date(), utm_source=utm_source,
+    )
 
     total_leads_res = await db.execute(
         select(func.count()).select_from(CourseLandingLead).where(CourseLandingLead.created_at >= since)
@@ -1749,3 +1933,70 @@ async def get_course_landing_stats(days: int = 30, admin_id: int = Depends(check
     }
 
 
+# ── NUVI AI Agency site (funnel) ──
+from db.models import AgencyLead
+
+AGENCY_FUNNEL_STAGES = ["page_view", "pricing_viewed", "lead_form_started", "lead_form_submitted"]
+
+
+@router.get("/agency/stats")
+async def get_agency_stats(
+    days: int = 30,
+    utm_source: Optional[str] = None,
+    admin_id: int = Depends(check_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """Funnel breakdown (unique sessions per stage, from HLL sketches) + lead summary."""
+    since = datetime.utcnow() - timedelta(days=days)
+
+    funnel = await LandingSketchService(db).unique_counts(
+        LANDING_AGENCY, AGENCY_FUNNEL_STAGES, since.date(), utm_source=utm_source,
+    )
+
+    total_leads_res = await db.execute(
+        select(func.count()).select_from(AgencyLead).where(AgencyLead.created_at >= since)
+    )
+    total_leads = total_leads_res.scalar() or 0
+
+    service_res = await db.execute(
+        select(AgencyLead.service, func.count()).where(AgencyLead.created_at >= since).group_by(AgencyLead.service)
+    )
+    service_breakdown = {(row[0] or "tanlanmagan"): row[1] for row in service_res.all()}
+
+    return {
+        "days": days,
+        "funnel": funnel,
+        "total_leads": total_leads,
+        "service_breakdown": service_breakdown,
+    }
+
+
+# ── Retention / compaction runs ──
+@router.get("/retention/runs")
+async def get_retention_runs(limit: int = 20, admin_id: int = Depends(check_admin), db: AsyncSession = Depends(get_db)):
+    """Recent nightly retention runs with their per-table reports."""
+    from db.models import RetentionRun
+    result = await db.execute(
+        select(RetentionRun).order_by(RetentionRun.started_at.desc()).limit(min(limit, 100))
+    )
+    return [
+        {
+            "id": r.id,
+            "status": r.status,
+            "started_at": r.started_at.isoformat() if r.started_at else "",
+            "finished_at": r.finished_at.isoformat() if r.finished_at else "",
+            "report": r.report or {},
+        }
+        for r in result.scalars().all()
+    ]
+
+
+@router.post("/retention/run")
+async def trigger_retention_run(dry_run: bool = True, admin_id: int = Depends(check_admin)):
+    """Run a retention pass now (dry run by default — only counts what would go)."""
+    from services.retention import run_retention
+    if dry_run:
+        return await run_retention(dry_run=True)
+    import asyncio
+    asyncio.create_task(run_retention())
+    return {"status": "started"}
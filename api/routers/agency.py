@@ -14,6 +14,7 @@ from pydantic import BaseModel, field_validator
 from bot.config import settings
 from db.database import async_session
 from db.models import AgencyEvent, AgencyLead
+from services.landing_sketch import LANDING_AGENCY, LandingSketchService
 
 router = APIRouter(prefix="/api/agency", tags=["agency"])
 
@@ -74,6 +75,9 @@ async def track_event(payload: EventRequest):
             utm_campaign=(payload.utm_campaign or None),
         ))
         await session.commit()
+        await LandingSketchService(session).record(
+            LANDING_AGENCY, payload.event_type, payload.session_id[:64], payload.utm_source,
+        )
     return {"ok": True}
 
 
@@ -100,10 +104,14 @@ async def submit_lead(payload: LeadSubmitRequest):
                 utm_campaign=(payload.utm_campaign or None),
             ))
         await session.commit()
+        if payload.session_id:
+            await LandingSketchService(session).record(
+                LANDING_AGENCY, "lead_form_submitted", payload.session_id[:64], payload.utm_source,
+            )
         lead_id = lead.id
 
     try:
-        from aiogram import Bot
+        from bot.utils.bot_registry import get_bot
         text = (
             f"🏢 <b>Yangi ariza — NUVI AI Agency</b>\n\n"
             f"👤 Ism: {payload.name}\n"
@@ -114,15 +122,12 @@ async def submit_lead(payload: LeadSubmitRequest):
             f"🌐 Til: {payload.lang}\n"
             f"🆔 Ariza #{lead_id}"
         )
-        bot = Bot(token=settings.BOT_TOKEN)
-        try:
-            for aid in settings.ADMIN_IDS:
-                try:
-                    await bot.send_message(chat_id=aid, text=text, parse_mode="HTML")
-                except Exception:
-                    pass
-        finally:
-            await bot.session.close()
+        bot = get_bot()
+        for aid in settings.ADMIN_IDS:
+            try:
+                await bot.send_message(chat_id=aid, text=text, parse_mode="HTML")
+            except Exception:
+                pass
     except Exception:
         pass
 
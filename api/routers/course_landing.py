@@ -15,6 +15,7 @@ from sqlalchemy import select
 
 from db.database import async_session
 from db.models import CourseLandingContent, CourseLandingEvent, CourseLandingLead
+from services.landing_sketch import LANDING_COURSE, LandingSketchService
 
 router = APIRouter(prefix="/api/course-landing", tags=["course-landing"])
 
@@ -296,6 +297,9 @@ async def track_event(payload: EventRequest):
             utm_campaign=(payload.utm_campaign or None),
         ))
         await session.commit()
+        await LandingSketchService(session).record(
+            LANDING_COURSE, payload.event_type, payload.session_id[:64], payload.utm_source,
+        )
     return {"ok": True}
 
 
@@ -319,10 +323,14 @@ async def submit_lead(payload: LeadSubmitRequest):
                 utm_campaign=(payload.utm_campaign or None),
             ))
         await session.commit()
+        if payload.session_id:
+            await LandingSketchService(session).record(
+                LANDING_COURSE, "lead_submitted", payload.session_id[:64], payload.utm_source,
+            )
         lead_id = lead.id
 
     try:
-        from aiogram import Bot
+        from bot.utils.bot_registry import get_bot
         from bot.config import settings
         tariff_label = {"standard": "Standard", "premium": "Premium", "vip": "VIP"}.get(payload.tariff or "", "Tanlanmagan")
         text = (
@@ -332,15 +340,12 @@ async def submit_lead(payload: LeadSubmitRequest):
             f"💳 Tarif: {tariff_label}\n"
             f"🆔 Ariza #{lead_id}"
         )
-        bot = Bot(token=settings.BOT_TOKEN)
-        try:
-            for aid in settings.ADMIN_IDS:
-                try:
-                    await bot.send_message(chat_id=aid, text=text, parse_mode="HTML")
-                except Exception:
-                    pass
-        finally:
-            await bot.session.close()
+        bot = get_bot()
+        for aid in settings.ADMIN_IDS:
+            try:
+                await bot.send_message(chat_id=aid, text=text, parse_mode="HTML")
+            except Exception:
+                pass
     except Exception:
         pass
 
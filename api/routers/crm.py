@@ -180,18 +180,14 @@ async def send_deal_invoice(deal_id: int, admin_id: int = Depends(check_admin),
         raise HTTPException(status_code=404, detail="Deal topilmadi")
     deal, user = row
 
-    from bot.config import settings
-    from aiogram import Bot
     from bot.handlers.deals import send_course_invoice
+    from bot.utils.bot_registry import get_bot
 
-    bot = Bot(token=settings.BOT_TOKEN)
     try:
-        await send_course_invoice(bot, user.telegram_id, deal_id, amount=deal.amount)
+        await send_course_invoice(get_bot(), user.telegram_id, deal_id, amount=deal.amount)
     except Exception as e:
         logger.error(f"Failed to send course invoice for deal {deal_id}: {e}")
         raise HTTPException(status_code=502, detail="Invoice yuborib bo'lmadi")
-    finally:
-        await bot.session.close()
 
     if deal.stage == "new":
         deal.stage = "offer"
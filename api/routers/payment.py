@@ -131,8 +131,8 @@ async def click_webhook(request: Request, background_tasks: BackgroundTasks):
                 
                 bot_instance = global_bot
                 if not bot_instance:
-                    from aiogram import Bot
-                    bot_instance = Bot(token=settings.BOT_TOKEN)
+                    from bot.utils.bot_registry import get_bot
+                    bot_instance = get_bot()
                 
                 try:
                     from db.models import User
@@ -160,8 +160,8 @@ async def click_webhook(request: Request, background_tasks: BackgroundTasks):
             from api.main import bot as global_bot
             bot_instance = global_bot
             if not bot_instance:
-                from aiogram import Bot
-                bot_instance = Bot(token=settings.BOT_TOKEN)
+                from bot.utils.bot_registry import get_bot
+                bot_instance = get_bot()
 
             try:
                 from db.models import User
@@ -280,8 +280,8 @@ async def payme_webhook(request: Request, background_tasks: BackgroundTasks):
             
             bot_instance = global_bot
             if not bot_instance:
-                from aiogram import Bot
-                bot_instance = Bot(token=settings.BOT_TOKEN)
+                from bot.utils.bot_registry import get_bot
+                bot_instance = get_bot()
             
             try:
                 user_result = await session.execute(
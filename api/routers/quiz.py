@@ -15,6 +15,7 @@ from pydantic import BaseModel, field_validator
 from bot.config import settings
 from db.database import async_session
 from db.models import QuizEvent, QuizSubmission
+from services.landing_sketch import LANDING_QUIZ, LandingSketchService
 
 router = APIRouter(prefix="/api/quiz", tags=["quiz"])
 
@@ -262,6 +263,9 @@ async def track_quiz_event(payload: QuizEventRequest):
             utm_campaign=(payload.utm_campaign or None),
         ))
         await session.commit()
+        await LandingSketchService(session).record(
+            LANDING_QUIZ, payload.event_type, payload.session_id[:64], payload.utm_source,
+        )
     return {"ok": True}
 
 
@@ -311,6 +315,10 @@ async def submit_quiz(payload: QuizSubmitRequest):
                 utm_campaign=payload.utm_campaign or None,
             ))
         await session.commit()
+        if payload.session_id:
+            await LandingSketchService(session).record(
+                LANDING_QUIZ, "submitted", payload.session_id[:64], payload.utm_source,
+            )
 
     redirect_url = f"https://t.me/{settings.BOT_USERNAME}?start=quiz_{token}"
     return {"token": token, "correct_count": correct, "level": level, "redirect_url": redirect_url}
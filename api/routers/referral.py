@@ -17,13 +17,9 @@ _bot_username_cache: str = ""
 async def _get_bot_username() -> str:
     global _bot_username_cache
     if not _bot_username_cache:
-        from aiogram import Bot
-        bot = Bot(token=settings.BOT_TOKEN)
-        try:
-            bot_info = await bot.get_me()
-            _bot_username_cache = bot_info.username
-        finally:
-            await bot.session.close()
+        from bot.utils.bot_registry import get_bot
+        bot_info = await get_bot().get_me()
+        _bot_username_cache = bot_info.username
     return _bot_username_cache
 
 
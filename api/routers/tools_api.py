@@ -1,26 +1,45 @@
-"""Tools API — video note converter endpoint for large files via Mini App."""
+"""Tools API — video note converter endpoint for large files via Mini App.
+
+Mobile uploads of up to 100 MB are resumable (tus-like), and conversion is
+a media job delivered by the bot — no request waits on ffmpeg:
+
+    POST  /api/tools/uploads                 {size, content_type} → {upload_id, offset, chunk_size}
+    PATCH /api/tools/uploads/{id}            raw chunk, Upload-Offset header → {offset, complete}
+    GET   /api/tools/uploads/{id}            → {offset, size}   (resume after a dropped connection)
+    POST  /api/tools/videonote/jobs          {upload_id} → {job_id}
+    GET   /api/tools/jobs/{job_id}           → {status, error}
+
+A PATCH may restart at any offset up to what the server already has, so
+a chunk whose response got lost is simply sent again. The one-shot
+multipart POST /api/tools/videonote still works and returns a job id too.
+"""
+import asyncio
+import json
 import os
+import time
 import uuid
-import asyncio
 import logging
 
-from fastapi import APIRouter, UploadFile, File, Header, HTTPException
+from fastapi import APIRouter, Body, UploadFile, File, Header, HTTPException, Request
 
-from api.auth import validate_init_data, get_telegram_id_from_init_data
+from api.auth import get_telegram_id_from_init_data
+from services import scratch
+from services.media_jobs import job_status, submit as submit_job
+from services.media_probe import ffmpeg_path
 
 logger = logging.getLogger("tools_api")
 
 router = APIRouter(prefix="/api/tools", tags=["tools"])
 
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+CHUNK_SIZE = 4 * 1024 * 1024       # suggested to clients
+MAX_CHUNK = 16 * 1024 * 1024
+UPLOAD_DIR = os.path.join(scratch.ROOT, "uploads")  # unfinished uploads go with the scratch sweeper
 
+_upload_locks: dict[str, asyncio.Lock] = {}
 
-@router.post("/videonote")
-async def convert_videonote(
-    video: UploadFile = File(...),
-    authorization: str = Header(default=""),
-):
-    """Accept a large video, convert to square video note, send back via bot."""
+
+def _telegram_id(authorization: str) -> int:
     # Auth: extract telegram_id from initData
     raw = ""
     if authorization:
@@ -36,22 +55,157 @@ async def convert_videonote(
     telegram_id = get_telegram_id_from_init_data(raw)
     if not telegram_id:
         raise HTTPException(status_code=401, detail="Noto'g'ri avtorizatsiya")
+    return telegram_id
+
+
+# ── Resumable uploads ────────────────────────────────────────────────────────
+
+def _paths(upload_id: str) -> tuple[str, str]:
+    if not upload_id.isalnum():
+        raise HTTPException(status_code=404, detail="Yuklash topilmadi")
+    return os.path.join(UPLOAD_DIR, f"{upload_id}.part"), os.path.join(UPLOAD_DIR, f"{upload_id}.json")
+
+
+def _load_upload(upload_id: str, telegram_id: int) -> tuple[str, dict]:
+    data_path, meta_path = _paths(upload_id)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise HTTPException(status_code=404, detail="Yuklash topilmadi")
+    if meta["telegram_id"] != telegram_id:
+        raise HTTPException(status_code=404, detail="Yuklash topilmadi")
+    return data_path, meta
+
+
+@router.post("/uploads")
+async def create_upload(
+    size: int = Body(..., embed=True),
+    content_type: str = Body(default="", embed=True),
+    authorization: str = Header(default=""),
+):
+    """Start a resumable upload of `size` bytes."""
+    telegram_id = _telegram_id(authorization)
+    if not content_type.startswith("video/"):
+        raise HTTPException(status_code=400, detail="Faqat video fayl qabul qilinadi")
+    if size <= 0 or size > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="Video hajmi 100 MB dan oshmasligi kerak")
+
+    if not await scratch.has_room(size):
+        raise HTTPException(status_code=507, detail="Server hozir band. Birozdan so'ng qayta urinib ko'ring")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    data_path, meta_path = _paths(upload_id)
+    open(data_path, "wb").close()
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"telegram_id": telegram_id, "size": size, "created": int(time.time())}, f)
+    return {"upload_id": upload_id, "offset": 0, "chunk_size": CHUNK_SIZE}
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, authorization: str = Header(default="")):
+    """How much of the upload the server has — where the client resumes."""
+    data_path, meta = _load_upload(upload_id, _telegram_id(authorization))
+    return {"offset": os.path.getsize(data_path), "size": meta["size"]}
+
+
+@router.patch("/uploads/{upload_id}")
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    authorization: str = Header(default=""),
+):
+    """Write the request body at `Upload-Offset` (≤ bytes already received)."""
+    data_path, meta = _load_upload(upload_id, _telegram_id(authorization))
+    async with _upload_locks.setdefault(upload_id, asyncio.Lock()):
+        have = os.path.getsize(data_path)
+        if upload_offset < 0 or upload_offset > have:
+            raise HTTPException(status_code=409, detail={"offset": have})
+        written = 0
+        with open(data_path, "r+b") as f:
+            f.seek(upload_offset)
+            f.truncate()
+            async for chunk in request.stream():
+                written += len(chunk)
+                if written > MAX_CHUNK or upload_offset + written > meta["size"]:
+                    raise HTTPException(status_code=413, detail="Bo'lak hajmi juda katta")
+                f.write(chunk)
+        offset = upload_offset + written
+    if offset >= meta["size"]:
+        _upload_locks.pop(upload_id, None)
+    return {"offset": offset, "complete": offset >= meta["size"]}
+
+
+# ── Jobs ─────────────────────────────────────────────────────────────────────
+
+async def _start_videonote_job(telegram_id: int, data_path: str) -> str:
+    from api.main import bot as api_bot
+
+    if not ffmpeg_path():
+        raise HTTPException(status_code=500, detail="Server xatoligi: ffmpeg topilmadi")
+    if not api_bot:
+        raise HTTPException(
+            status_code=500,
+            detail="Bot hozircha tayyor emas. Biroz kutib qayta urinib ko'ring"
+        )
+
+    # The converted note (and progress) is delivered in the bot chat
+    try:
+        status = await api_bot.send_message(telegram_id, "🔄 Mini App'dan yuklangan video dumaloq qilinmoqda...")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Bot sizga xabar yubora olmadi: {str(e)[:200]}")
+
+    return await submit_job("videonote", api_bot, telegram_id, status.message_id,
+                            {"upload": data_path}, local=True)
+
+
+@router.post("/videonote/jobs")
+async def create_videonote_job(
+    upload_id: str = Body(..., embed=True),
+    authorization: str = Header(default=""),
+):
+    """Convert a finished upload; the note arrives in the bot chat."""
+    telegram_id = _telegram_id(authorization)
+    data_path, meta = _load_upload(upload_id, telegram_id)
+    if os.path.getsize(data_path) < meta["size"]:
+        raise HTTPException(status_code=409, detail="Yuklash hali tugamagan")
+    os.remove(_paths(upload_id)[1])  # the job owns the data file from here on
+    job_id = await _start_videonote_job(telegram_id, data_path)
+    return {"status": "queued", "job_id": job_id}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, authorization: str = Header(default="")):
+    """queued / running / done / failed / timeout / cancelled."""
+    telegram_id = _telegram_id(authorization)
+    job = await job_status(job_id)
+    if not job or str(job.get("chat_id")) != str(telegram_id):
+        raise HTTPException(status_code=404, detail="Topilmadi")
+    return {"status": job.get("status"), "error": job.get("error") or None}
+
+
+@router.post("/videonote")
+async def convert_videonote(
+    video: UploadFile = File(...),
+    authorization: str = Header(default=""),
+):
+    """One-shot multipart upload; queues the conversion and returns its job id."""
+    telegram_id = _telegram_id(authorization)
 
     # Validate file type
     if not video.content_type or not video.content_type.startswith("video/"):
         raise HTTPException(status_code=400, detail="Faqat video fayl qabul qilinadi")
+    if not await scratch.has_room(MAX_FILE_SIZE):
+        raise HTTPException(status_code=507, detail="Server hozir band. Birozdan so'ng qayta urinib ko'ring")
 
-    # Read file with size limit
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-
-    input_path = os.path.join(temp_dir, f"{uuid.uuid4()}.mp4")
-    output_path = os.path.join(temp_dir, f"{uuid.uuid4()}_note.mp4")
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    data_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.part")
 
     try:
-        # Save uploaded file
         total = 0
-        with open(input_path, "wb") as f:
+        with open(data_path, "wb") as f:
             while True:
                 chunk = await video.read(1024 * 1024)  # 1MB chunks
                 if not chunk:
@@ -63,82 +217,10 @@ async def convert_videonote(
                         detail="Video hajmi 100 MB dan oshmasligi kerak"
                     )
                 f.write(chunk)
+        job_id = await _start_videonote_job(telegram_id, data_path)
+    except BaseException:
+        if os.path.exists(data_path):
+            os.remove(data_path)
+        raise
 
-        # Get ffmpeg binary
-        try:
-            import imageio_ffmpeg
-            ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-        except ImportError:
-            import shutil
-            ffmpeg_exe = shutil.which("ffmpeg")
-
-        if not ffmpeg_exe:
-            raise HTTPException(
-                status_code=500,
-                detail="Server xatoligi: ffmpeg topilmadi"
-            )
-
-        # Convert to square video note
-        cmd = [
-            ffmpeg_exe, "-y", "-i", input_path,
-            "-t", "60",
-            "-vf", "crop='min(iw,ih)':'min(iw,ih)',scale=640:640",
-            "-c:v", "libx264", "-crf", "26", "-preset", "veryfast",
-            "-c:a", "aac", "-b:a", "128k",
-            output_path
-        ]
-
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-
-        if process.returncode != 0:
-            logger.error(f"FFmpeg error: {stderr.decode()[:500]}")
-            raise HTTPException(
-                status_code=500,
-                detail="Videoni qayta ishlashda xatolik yuz berdi"
-            )
-
-        # Send via bot
-        from aiogram.types import FSInputFile
-        from api.main import bot as api_bot
-
-        if not api_bot:
-            raise HTTPException(
-                status_code=500,
-                detail="Bot hozircha tayyor emas. Biroz kutib qayta urinib ko'ring"
-            )
-
-        video_note_file = FSInputFile(output_path)
-
-        try:
-            await api_bot.send_video_note(
-                chat_id=telegram_id,
-                video_note=video_note_file,
-            )
-        except Exception as e:
-            err_str = str(e)
-            if "VOICE_MESSAGES_FORBIDDEN" in err_str:
-                raise HTTPException(
-                    status_code=403,
-                    detail="Telegram sozlamalaringizda botlardan Video Note qabul qilish bloklangan. "
-                           "Settings → Privacy → Voice Messages → Everyone yoki Always Allow ga o'zgartiring."
-                )
-            raise HTTPException(
-                status_code=500,
-                detail=f"Telegramga yuborishda xatolik: {err_str[:200]}"
-            )
-
-        return {"status": "ok", "message": "Dumaloq video yuborildi!"}
-
-    finally:
-        # Cleanup temp files
-        for p in (input_path, output_path):
-            if os.path.exists(p):
-                try:
-                    os.remove(p)
-                except Exception:
-                    pass
+    return {"status": "queued", "job_id": job_id}
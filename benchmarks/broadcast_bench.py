@@ -0,0 +1,333 @@
+"""Offline broadcast throughput benchmark against a simulated Bot API.
+
+Runs the real `services.broadcast.send_broadcast` end to end:
+
+  * a local fake Telegram Bot API (aiohttp) with configurable latency,
+    random 429s carrying retry_after, an optional server-side rate limit,
+    and a deterministic share of users who "blocked the bot" (403);
+  * a synthetic users table of --users rows in SQLite (default, fresh file
+    per run) or an EMPTY Postgres database (--db-url);
+  * CHUNK_SIZE / SEND_RATE overridable per run.
+
+Reports achieved msgs/sec, p50/p99 Bot API latency as seen by the client,
+the share of wall time spent inside DB statements, the progress reporter's
+own cost (ticks, DB writes, busy seconds), and memory (tracemalloc peak +
+max RSS). --json writes the report; --baseline compares against a
+previous report and exits 1 when throughput regresses past
+--max-regression, so CI can gate tuning changes.
+
+    python -m benchmarks.broadcast_bench --users 5000 --send-rate 500 --latency-ms 40
+    python -m benchmarks.broadcast_bench --users 20000 --p429 0.01 --blocked 0.08 --json out.json
+
+SQLite needs `aiosqlite` (bench-only; not in requirements.txt).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Broadcast throughput benchmark (fake Bot API)")
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--db-url", default="", help="default: fresh SQLite file; Postgres target must have an empty users table")
+    p.add_argument("--latency-ms", type=float, default=35.0, help="mean fake Bot API latency")
+    p.add_argument("--jitter-ms", type=float, default=15.0)
+    p.add_argument("--p429", type=float, default=0.0, help="probability of an injected 429 per request")
+    p.add_argument("--retry-after", type=int, default=1)
+    p.add_argument("--server-rate", type=float, default=0.0, help="server-side msgs/sec limit (0 = unlimited), excess gets 429")
+    p.add_argument("--blocked", type=float, default=0.05, help="share of users that blocked the bot")
+    p.add_argument("--chunk-size", type=int, default=None)
+    p.add_argument("--send-rate", type=float, default=None)
+    p.add_argument("--progress-interval", type=float, default=None, help="override PROGRESS_DB_INTERVAL (seconds)")
+    p.add_argument("--copy-mode", action="store_true", help="stage in a fake storage channel and fan out with copyMessage")
+    p.add_argument("--personalized", action="store_true", help="use a {name} template")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--json", dest="json_out", default="")
+    p.add_argument("--baseline", default="")
+    p.add_argument("--max-regression", type=float, default=0.10)
+    return p.parse_args(argv)
+
+
+ARGS = _parse_args() if __name__ == "__main__" else None
+_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "bench_broadcast.sqlite3")
+if ARGS is not None:
+    # Must be in place before bot.config / db.database are imported.
+    os.environ["DATABASE_URL"] = ARGS.db_url or f"sqlite+aiosqlite:///{_SQLITE_PATH}"
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    if not ARGS.db_url and os.path.exists(_SQLITE_PATH):
+        os.remove(_SQLITE_PATH)
+
+
+# ── Fake Bot API ────────────────────────────────────────────────
+class FakeBotAPI:
+    """Just enough of the Bot API for send_broadcast: every send*/copy* method."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.requests = 0
+        self.injected_429 = 0
+        self.blocked_403 = 0
+        self._msg_id = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.runner = None
+        self.base_url = ""
+
+    def _is_blocked(self, chat_id: int) -> bool:
+        return random.Random(chat_id).random() < self.args.blocked
+
+    def _over_rate(self) -> bool:
+        if not self.args.server_rate:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+        return self._window_count > self.args.server_rate
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.requests += 1
+        method = request.match_info["method"]
+        form = await request.post()
+        if not form:
+            try:
+                form = await request.json()
+            except Exception:
+                form = {}
+        chat_id = int(form.get("chat_id") or 0)
+
+        delay = max(0.0, self.rng.gauss(self.args.latency_ms, self.args.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+        if self._over_rate() or self.rng.random() < self.args.p429:
+            self.injected_429 += 1
+            ra = self.args.retry_after
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {ra}",
+                "parameters": {"retry_after": ra},
+            })
+        if chat_id > 0 and self._is_blocked(chat_id):
+            self.blocked_403 += 1
+            return web.json_response({
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user",
+            })
+
+        self._msg_id += 1
+        if method.lower() == "copymessage":
+            return web.json_response({"ok": True, "result": {"message_id": self._msg_id}})
+        if method.lower() == "copymessages":
+            ids = json.loads(form.get("message_ids") or "[]")
+            result = []
+            for _ in ids or [0]:
+                self._msg_id += 1
+                result.append({"message_id": self._msg_id})
+            return web.json_response({"ok": True, "result": result})
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._msg_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+            "text": "ok",
+        }})
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+# ── DB timing ───────────────────────────────────────────────────
+class DBTimer:
+    """Sums wall time spent inside cursor.execute across the engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.total = 0.0
+        self.statements = 0
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, params, context, executemany):
+            conn.info.setdefault("_bench_t0", []).append(time.perf_counter())
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, params, context, executemany):
+            self.total += time.perf_counter() - conn.info["_bench_t0"].pop()
+            self.statements += 1
+
+
+# ── Synthetic data ──────────────────────────────────────────────
+async def seed_users(n: int, seed: int):
+    from sqlalchemy import func, insert, select
+
+    from db.database import async_session, engine
+    from db.models import Base, User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session() as session:
+        existing = (await session.execute(select(func.count()).select_from(User))).scalar() or 0
+        if existing:
+            sys.exit(f"Refusing to benchmark against a non-empty users table ({existing} rows).")
+
+        rng = random.Random(seed)
+        sources = ["instagram", "telegram", "youtube", None]
+        batch = []
+        for i in range(n):
+            batch.append({
+                "telegram_id": 10_000_000 + i,
+                "name": f"User {i}",
+                "username": f"user{i}",
+                "source": rng.choice(sources),
+                "lead_score": rng.randint(0, 100),
+                "user_status": rng.choice(["started", "registered"]),
+                "is_active": True,
+                "tokens": 0,
+            })
+            if len(batch) >= 5000:
+                await session.execute(insert(User), batch)
+                batch = []
+        if batch:
+            await session.execute(insert(User), batch)
+        await session.commit()
+
+
+# ── Run ─────────────────────────────────────────────────────────
+def _percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+async def run(args) -> dict:
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from bot.config import settings
+    from db.database import async_session, engine
+    from services import broadcast as bc
+
+    if args.chunk_size:
+        bc.CHUNK_SIZE = args.chunk_size
+    if args.send_rate:
+        bc.SEND_RATE = args.send_rate
+    if args.progress_interval:
+        bc.PROGRESS_DB_INTERVAL = args.progress_interval
+    settings.CONTENT_CHANNEL_ID = -1001234567890 if args.copy_mode else 0
+
+    await seed_users(args.users, args.seed)
+
+    api = FakeBotAPI(args)
+    await api.start()
+
+    latencies: list[float] = []
+
+    class _TimedSession(AiohttpSession):
+        async def make_request(self, bot, method, timeout=None):
+            t0 = time.perf_counter()
+            try:
+                return await super().make_request(bot, method, timeout)
+            finally:
+                latencies.append(time.perf_counter() - t0)
+
+    bot = Bot(token=settings.BOT_TOKEN, session=_TimedSession(api=TelegramAPIServer.from_base(api.base_url)))
+
+    async with async_session() as session:
+        service = bc.BroadcastService(session)
+        broadcast = await service.create_broadcast(
+            content="Salom, {name}! Yangi dars chiqdi 🚀" if args.personalized else "Yangi dars chiqdi 🚀",
+        )
+        await session.commit()
+        broadcast_id = broadcast.id
+
+    timer = DBTimer(engine)
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = await bc.send_broadcast(broadcast_id, bot_instance=bot) or {}
+    finally:
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await bot.session.close()
+        await api.stop()
+
+    async with async_session() as session:
+        b = await bc.BroadcastService(session).get_broadcast(broadcast_id)
+        sent, failed = b.sent_count or 0, b.failed_count or 0
+    await engine.dispose()
+
+    return {
+        "params": {
+            "users": args.users, "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+            "p429": args.p429, "server_rate": args.server_rate, "blocked": args.blocked,
+            "chunk_size": bc.CHUNK_SIZE, "send_rate": bc.SEND_RATE,
+            "progress_db_interval": bc.PROGRESS_DB_INTERVAL,
+            "copy_mode": args.copy_mode, "personalized": args.personalized,
+            "db": "sqlite" if not args.db_url else "postgres",
+        },
+        "sent": sent,
+        "failed": failed,
+        "wall_s": round(wall, 3),
+        "msgs_per_sec": round((sent + failed) / wall, 2) if wall else 0.0,
+        "api_requests": api.requests,
+        "api_429": api.injected_429,
+        "api_403": api.blocked_403,
+        "latency_p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "latency_p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "db_time_s": round(timer.total, 3),
+        "db_time_share": round(timer.total / wall, 4) if wall else 0.0,
+        "db_statements": timer.statements,
+        "progress_reporter": result.get("progress", {}),
+        "py_peak_mb": round(peak / 2**20, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main(args):
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        floor = base["msgs_per_sec"] * (1 - args.max_regression)
+        if report["msgs_per_sec"] < floor:
+            print(f"❌ Throughput regression: {report['msgs_per_sec']} msg/s < {floor:.2f} "
+                  f"(baseline {base['msgs_per_sec']}, tolerance {args.max_regression:.0%})")
+            sys.exit(1)
+        print(f"✅ Throughput {report['msgs_per_sec']} msg/s vs baseline {base['msgs_per_sec']}")
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    main(ARGS)
@@ -0,0 +1,168 @@
+"""Image tools benchmark — scratch-file path vs in-memory path.
+
+Runs the real Pillow workers (compressor photo, fileconvert image → PNG /
+ICO / PDF) on synthetic images, --runs times each way:
+
+  disk    what the tools did before services/image_io.py: the download is
+          written to the scratch dir, the worker reads it and writes its
+          output there, the upload reads the output back;
+  memory  bytes in, bytes out (what the tools do up to IMAGE_INLINE_MB).
+
+Reports median milliseconds per (image, task) for both and the speedup.
+The disk path runs under --dir (default: the media scratch root), so
+point it at the filesystem production uses.
+
+    python -m benchmarks.image_bench --runs 20
+    python -m benchmarks.image_bench --images photo_1280 --json out.json
+
+--baseline compares against a previous --json report and exits 1 when
+any in-memory median got slower than --max-regression.
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# name → (width, height, Pillow format, file extension)
+IMAGES = {
+    "photo_1280":  (1280, 960, "JPEG", "jpg"),    # a typical Telegram photo
+    "photo_4000":  (4000, 3000, "JPEG", "jpg"),    # a phone camera original sent as a document
+    "png_1600":    (1600, 1200, "PNG", "png"),
+}
+
+TASKS = ("compress", "to_png", "to_ico", "to_pdf")
+
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Image tools benchmark (disk vs in-memory)")
+    p.add_argument("--runs", type=int, default=10)
+    p.add_argument("--images", default=",".join(IMAGES), help="comma-separated image classes")
+    p.add_argument("--dir", default="", help="where the disk path writes; default: the scratch root")
+    p.add_argument("--json", dest="json_out", default="")
+    p.add_argument("--baseline", default="")
+    p.add_argument("--max-regression", type=float, default=0.15)
+    return p.parse_args(argv)
+
+
+def _make_image(name: str) -> bytes:
+    from PIL import Image
+
+    width, height, fmt, _ = IMAGES[name]
+    # fractal detail compresses like a photo, unlike a flat test pattern
+    img = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 0.8, 1.2), 64)
+    img = Image.merge("RGB", (img, img.rotate(180), img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buf = io.BytesIO()
+    img.save(buf, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buf.getvalue()
+
+
+def _task(name: str):
+    from bot.handlers.compressor import _compress_photo
+    from bot.handlers.fileconvert import _convert_image, _image_to_pdf
+
+    return {
+        "compress": (_compress_photo, (), "jpg"),
+        "to_png": (_convert_image, ("png",), "png"),
+        "to_ico": (_convert_image, ("ico",), "ico"),
+        "to_pdf": (_image_to_pdf, (), "pdf"),
+    }[name]
+
+
+def _disk(workdir: str, data: bytes, ext: str, task: str) -> int:
+    fn, extra, out_ext = _task(task)
+    src, dst = os.path.join(workdir, f"in.{ext}"), os.path.join(workdir, f"out.{out_ext}")
+    with open(src, "wb") as f:          # the download
+        f.write(data)
+    if not fn(src, dst, *extra):
+        raise RuntimeError(f"{task} failed on disk")
+    with open(dst, "rb") as f:          # the upload
+        out = f.read()
+    os.remove(src)
+    os.remove(dst)
+    return len(out)
+
+
+def _memory(data: bytes, task: str) -> int:
+    fn, extra, _ = _task(task)
+    out = fn(data, None, *extra)
+    if not out:
+        raise RuntimeError(f"{task} failed in memory")
+    return len(out)
+
+
+def _median_ms(call, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - started)
+    return round(statistics.median(times) * 1000, 2)
+
+
+def run(args) -> dict:
+    from services import scratch
+
+    names = [n.strip() for n in args.images.split(",") if n.strip()]
+    unknown = set(names) - set(IMAGES)
+    if unknown:
+        raise SystemExit(f"unknown images: {', '.join(sorted(unknown))}")
+
+    root = args.dir or scratch.ROOT
+    os.makedirs(root, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="bench_image_", dir=root)
+    rows = {}
+    try:
+        for name in names:
+            data = _make_image(name)
+            ext = IMAGES[name][3]
+            for task in TASKS:
+                disk = _median_ms(lambda: _disk(workdir, data, ext, task), args.runs)
+                memory = _median_ms(lambda: _memory(data, task), args.runs)
+                rows[f"{name}:{task}"] = {
+                    "input_kb": len(data) // 1024,
+                    "output_kb": _memory(data, task) // 1024,
+                    "disk_ms": disk,
+                    "memory_ms": memory,
+                    "speedup": round(disk / max(memory, 1e-6), 2),
+                }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"dir": root, "runs": args.runs, "cases": rows}
+
+
+def _print_table(report: dict):
+    print(f"disk path under {report['dir']}")
+    print(f"{'case':<22} {'in KB':>7} {'out KB':>7} {'disk ms':>9} {'memory ms':>10} {'speedup':>8}")
+    for name, row in report["cases"].items():
+        print(f"{name:<22} {row['input_kb']:>7} {row['output_kb']:>7} {row['disk_ms']:>9} "
+              f"{row['memory_ms']:>10} {row['speedup']:>8}")
+
+
+def main(args):
+    report = run(args)
+    _print_table(report)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)["cases"]
+        slower = [
+            f"{name}: {row['memory_ms']}ms vs {base[name]['memory_ms']}ms"
+            for name, row in report["cases"].items()
+            if name in base and row["memory_ms"] > base[name]["memory_ms"] * (1 + args.max_regression)
+        ]
+        if slower:
+            print(f"❌ Median regression past {args.max_regression:.0%}: " + "; ".join(slower))
+            sys.exit(1)
+        print("✅ No case slower than the baseline")
+
+
+if __name__ == "__main__":
+    main(_parse_args())
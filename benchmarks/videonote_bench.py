@@ -0,0 +1,152 @@
+"""Video note conversion benchmark — median time per input class.
+
+Generates synthetic clips (ffmpeg lavfi test source + sine audio) for a
+handful of input classes, then converts each --runs times with the real
+planner (`services.video_note.convert`) and with the old always-transcode
+command at the same thread count, and reports per class: the plan picked,
+median wall seconds for both, the speedup and the realtime factor.
+
+    python -m benchmarks.videonote_bench --seconds 20 --runs 5
+    python -m benchmarks.videonote_bench --classes square_h264_480,h264_1080p_60fps --json out.json
+
+--baseline compares against a previous --json report and exits 1 when
+any class's median got slower than --max-regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+
+# name → (container ext, width, height, fps, video codec args)
+CLASSES = {
+    "square_h264_480":      ("mp4", 480, 480, 30, ["-c:v", "libx264", "-pix_fmt", "yuv420p"]),
+    "landscape_h264_720p":  ("mp4", 1280, 720, 30, ["-c:v", "libx264", "-pix_fmt", "yuv420p"]),
+    "portrait_h264_1080p":  ("mp4", 1080, 1920, 30, ["-c:v", "libx264", "-pix_fmt", "yuv420p"]),
+    "h264_1080p_60fps":     ("mp4", 1920, 1080, 60, ["-c:v", "libx264", "-pix_fmt", "yuv420p"]),
+    "mpeg4_720p_avi":       ("avi", 1280, 720, 25, ["-c:v", "mpeg4", "-q:v", "4"]),
+}
+
+# what videonote ran for every input before the planner
+LEGACY_ARGS = [
+    "-t", "60",
+    "-vf", "crop='min(iw,ih)':'min(iw,ih)',scale=640:640",
+    "-c:v", "libx264", "-crf", "26", "-preset", "veryfast",
+    "-c:a", "aac", "-b:a", "128k",
+]
+
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Video note conversion benchmark")
+    p.add_argument("--seconds", type=int, default=20, help="length of each synthetic clip")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--classes", default=",".join(CLASSES), help="comma-separated input classes")
+    p.add_argument("--no-legacy", action="store_true", help="skip the old always-transcode command")
+    p.add_argument("--json", dest="json_out", default="")
+    p.add_argument("--baseline", default="")
+    p.add_argument("--max-regression", type=float, default=0.15)
+    return p.parse_args(argv)
+
+
+async def _make_input(workdir: str, name: str, seconds: int) -> str:
+    from services.ffmpeg_runner import run_ffmpeg
+
+    ext, width, height, fps, video = CLASSES[name]
+    path = os.path.join(workdir, f"{name}.{ext}")
+    result = await run_ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        *video, "-c:a", "aac", "-b:a", "128k", "-shortest", path,
+    ], label="bench:input")
+    if not result.ok:
+        raise RuntimeError(f"could not generate {name}: {result.stderr[-300:]}")
+    return path
+
+
+async def _bench_class(workdir: str, name: str, args) -> dict:
+    from services import video_note
+    from services.ffmpeg_runner import run_ffmpeg
+
+    src = await _make_input(workdir, name, args.seconds)
+    dst = os.path.join(workdir, f"{name}_note.mp4")
+    times, speeds, kind = [], [], None
+    for _ in range(args.runs):
+        plan, result = await video_note.convert(src, dst, label="bench")
+        if not result.ok:
+            raise RuntimeError(f"{name}: {plan.kind} failed: {result.stderr[-300:]}")
+        kind = plan.kind
+        times.append(result.wall)
+        speeds.append(result.speed)
+
+    row = {
+        "plan": kind,
+        "median_s": round(statistics.median(times), 3),
+        "realtime": round(statistics.median(speeds), 1),
+        "runs": args.runs,
+    }
+    if not args.no_legacy:
+        legacy = []
+        for _ in range(args.runs):
+            # same thread count (and nice) as the planner's run, so the speedup is the plan's alone
+            result = await run_ffmpeg(["-i", src, *LEGACY_ARGS, dst], label="bench:legacy",
+                                      threads=video_note._threads())
+            legacy.append(result.wall)
+        row["legacy_median_s"] = round(statistics.median(legacy), 3)
+        row["speedup"] = round(row["legacy_median_s"] / max(row["median_s"], 1e-6), 2)
+    return row
+
+
+async def run(args) -> dict:
+    from services.media_probe import ffmpeg_path
+
+    if not ffmpeg_path():
+        raise SystemExit("ffmpeg not found")
+    names = [n.strip() for n in args.classes.split(",") if n.strip()]
+    unknown = set(names) - set(CLASSES)
+    if unknown:
+        raise SystemExit(f"unknown classes: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="bench_videonote_")
+    try:
+        classes = {name: await _bench_class(workdir, name, args) for name in names}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"clip_seconds": args.seconds, "cpu_count": os.cpu_count(), "classes": classes}
+
+
+def _print_table(report: dict):
+    print(f"{'class':<22} {'plan':<10} {'median s':>9} {'legacy s':>9} {'speedup':>8} {'×realtime':>10}")
+    for name, row in report["classes"].items():
+        print(f"{name:<22} {row['plan']:<10} {row['median_s']:>9} {row.get('legacy_median_s', '-'):>9} "
+              f"{row.get('speedup', '-'):>8} {row['realtime']:>10}")
+
+
+def main(args):
+    report = asyncio.run(run(args))
+    _print_table(report)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)["classes"]
+        slower = [
+            f"{name}: {row['median_s']}s vs {base[name]['median_s']}s"
+            for name, row in report["classes"].items()
+            if name in base and row["median_s"] > base[name]["median_s"] * (1 + args.max_regression)
+        ]
+        if slower:
+            print(f"❌ Median regression past {args.max_regression:.0%}: " + "; ".join(slower))
+            sys.exit(1)
+        print("✅ No class slower than the baseline")
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    main(_parse_args())
@@ -18,6 +18,8 @@ class Settings(BaseSettings):
     WEBHOOK_URL: str = ""       # e.g https://my-app.railway.app
     WEBHOOK_PATH: str = "/webhook/tg"
     WEBHOOK_SECRET: str = "my-secret-token"
+    BOT_HTTP_POOL_SIZE: int = 100     # keep-alive connections to api.telegram.org (bot/utils/bot_registry.py)
+    BOT_HTTP_KEEPALIVE: float = 60.0  # seconds an idle pooled connection is kept
 
     # ── Gemini AI ─────────────────────────────────────
     GEMINI_API_KEY: str = ""
@@ -78,6 +80,8 @@ class Settings(BaseSettings):
     ADMIN_DEV_BYPASS: str = ""       # Dev bypass token for admin Mini App testing
     PRIVATE_GROUP_ID: int = 0        # Private Telegram group ID (subscribers)
     CONTENT_CHANNEL_ID: int = 0      # Private channel for large video storage
+    BROADCAST_COPY_MODE: bool = True  # broadcasts post once to CONTENT_CHANNEL_ID and fan out via copyMessage
+    BROADCAST_SHARDS: int = 0         # >1: split sends across worker processes (python -m services.broadcast_shards)
     CLUB_PRICE: int = 97_000         # UZS — legacy recurring club subscription, no longer sold
     HR_CHAT_ID: int = 0              # Internal HR group — candidate interview summaries
     BOT_USERNAME: str = "ISROIL_AIBOT"  # used to build t.me deep links outside the bot process (e.g. quiz landing)
@@ -87,6 +91,36 @@ class Settings(BaseSettings):
     FULL_COURSE_PRICE: int = 4_000_000   # UZS — full course, closed by sales manager
     MASTERCLASS_DELAY_SECONDS: int = 3600  # default delay before auto-sending the masterclass video
 
+    # ── Retention / compaction (services/retention.py) ──
+    RETENTION_ENABLED: bool = True
+    RETENTION_EVENTS_DAYS: int = 180           # bot analytics events (funnel milestones are kept forever)
+    RETENTION_LANDING_EVENTS_DAYS: int = 90    # quiz / course / agency landing beacons
+    RETENTION_GROUP_WARNINGS_DAYS: int = 90    # moderation warnings older than this expire
+    EVENTS_PARTITIONED: bool = False           # manage monthly range partitions on `events`
+
+    # ── Analytics warehouse export (services/warehouse_export.py) ──
+    WAREHOUSE_EXPORT_ENABLED: bool = False
+    WAREHOUSE_DIR: str = "/data/warehouse"
+    WAREHOUSE_FORMAT: str = "parquet"          # parquet | ndjson
+    WAREHOUSE_SETTLE_HOURS: int = 24           # payments/purchases exported once their status has settled
+
+    # ── Media tools (services/media_jobs.py, services/media_worker.py) ──
+    MEDIA_WORKER_NICE: int = 10                # CPU priority drop for media workers and their ffmpeg children
+    MEDIA_WORKER_MEMORY_MB: int = 3072         # RLIMIT_AS per media worker process; 0 = unlimited
+    YTDLP_POOL_SIZE: int = 1                   # warm yt-dlp processes per mediadown worker (services/ytdlp_pool.py)
+    FFMPEG_THREADS: int = 2                    # encoder/filter threads per ffmpeg run (services/ffmpeg_runner.py)
+    FFMPEG_NICE: int = 5                       # extra nice for ffmpeg on top of the worker's (keeps inline runs below the webhook)
+    FFMPEG_TIMEOUT: int = 600                  # wall-clock seconds per ffmpeg run
+    FFMPEG_CPU_SECONDS: int = 0                # RLIMIT_CPU per ffmpeg run; 0 = FFMPEG_TIMEOUT × FFMPEG_THREADS
+    SCRATCH_DIR: str = ""                      # media scratch root (services/scratch.py); "" = ./temp
+    SCRATCH_QUOTA_MB: int = 8192               # all jobs' scratch files together
+    SCRATCH_JOB_MB: int = 2048                 # one job's budget (RLIMIT_FSIZE for its ffmpeg)
+    SCRATCH_MIN_FREE_MB: int = 1024            # jobs wait rather than leave less free disk than this
+    SCRATCH_TMPFS_DIR: str = "/dev/shm"        # small jobs' scratch in RAM; "" = disk only
+    SCRATCH_TMPFS_MB: int = 256
+    SCRATCH_STALE_HOURS: int = 6               # the sweeper removes scratch untouched for this long
+    IMAGE_INLINE_MB: int = 8                   # image tools keep files up to this size in memory (services/image_io.py)
+
     @property
     def ADMIN_IDS(self) -> List[int]:
         if not self.ADMIN_IDS_STR:
@@ -1,12 +1,12 @@
 """Background Remover AI using rembg."""
 import os
-import uuid
 import logging
 from aiogram import Router, F
-from aiogram.types import Message, FSInputFile
+from aiogram.types import Message, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from bot.fsm.states import AIRemoveBGFSM
 from bot.locales import uz
+from services.media_jobs import JobContext, submit as submit_job
 
 router = Router(name="bg_remover")
 logger = logging.getLogger("bg_remover")
@@ -41,54 +41,44 @@ async def process_bg_removal(message: Message, state: FSMContext):
     file_id = message.photo[-1].file_id if message.photo else message.document.file_id
     
     msg = await message.answer("⏳ Rasm olinmoqda, iltimos kuting...")
-    
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    uid = str(uuid.uuid4())[:8]
-    input_path = os.path.join(temp_dir, f"{uid}_bg_in.jpg")
-    output_path = os.path.join(temp_dir, f"{uid}_bg_out.png")
-    
+    await submit_job("bg_remover", message.bot, message.chat.id, msg.message_id, {"file_id": file_id})
+
+
+async def run_job(ctx: JobContext, payload: dict):
+    """Media job (services/media_jobs.py): remove the background, send a transparent PNG."""
+    # gradio_client uploads from a path, so the input is a file (the job's
+    # scratch dir is on tmpfs); the PNG comes back as bytes, never copied to disk
+    input_path = ctx.path("bg_in.jpg")
+
     try:
         # Download image
-        await message.bot.download(file_id, destination=input_path)
-        await msg.edit_text("✂️ Orqa fon qirqilmoqda. Sun'iy intellekt ishlamoqda...")
-        
-        # Process image in a separate thread to unblock async loop
-        import asyncio
-        loop = asyncio.get_running_loop()
-        success, err_msg = await loop.run_in_executor(None, _remove_background, input_path, output_path)
-        
-        if success and os.path.exists(output_path):
-            await msg.edit_text("📤 Natija yuborilmoqda...")
-            
-            output_file = FSInputFile(output_path, filename="bg_removed.png")
-            await message.answer_document(document=output_file, caption="✅ Orqa fon muvaffaqiyatli o'chirildi! (Shaffof PNG)\n\nYana rasm yuborishingiz yoki chiqish uchun '🔙 Orqaga' tugmasini bosishingiz mumkin.")
-            await msg.delete()
+        await ctx.bot.download(payload["file_id"], destination=input_path)
+        await ctx.edit("✂️ Orqa fon qirqilmoqda. Sun'iy intellekt ishlamoqda...")
+
+        # Blocking HF client call in a child process — killable on timeout/cancel
+        png, err_msg = await ctx.run_sync(_remove_background, input_path)
+
+        if png:
+            await ctx.edit("📤 Natija yuborilmoqda...")
+
+            output_file = BufferedInputFile(png, filename="bg_removed.png")
+            await ctx.bot.send_document(ctx.chat_id, document=output_file, caption="✅ Orqa fon muvaffaqiyatli o'chirildi! (Shaffof PNG)\n\nYana rasm yuborishingiz yoki chiqish uchun '🔙 Orqaga' tugmasini bosishingiz mumkin.")
+            await ctx.delete_status()
         else:
-            await msg.edit_text(f"⚠️ <b>Xatolik yuz berdi:</b>\n\n<code>{err_msg}</code>", parse_mode="HTML")
-        
+            await ctx.fail(f"⚠️ <b>Xatolik yuz berdi:</b>\n\n<code>{err_msg}</code>", parse_mode="HTML")
+
     except Exception as e:
         logger.error(f"BG Remover error: {e}")
-        try:
-            await msg.edit_text("❌ Tizimda xatolik yuz berdi. Iltimos keyinroq qayta urinib ko'ring.")
-        except Exception:
-            pass
-    finally:
-        for p in [input_path, output_path]:
-            try:
-                if os.path.exists(p):
-                    os.remove(p)
-            except Exception:
-                pass
+        await ctx.fail("❌ Tizimda xatolik yuz berdi. Iltimos keyinroq qayta urinib ko'ring.")
 
 
-def _remove_background(input_path: str, output_path: str) -> tuple[bool, str]:
-    """Remove background using free Hugging Face Space (BriaAI RMBG-1.4) via gradio_client."""
+def _remove_background(input_path: str) -> tuple[bytes, str]:
+    """Remove background using free Hugging Face Space (BriaAI RMBG-1.4) via gradio_client.
+
+    Returns the transparent PNG's bytes, or b"" and the error text.
+    """
     try:
         from gradio_client import Client, handle_file
-        import shutil
-        import tempfile
         
         # Connect to the Hugging Face Space
         client = Client("briaai/BRIA-RMBG-1.4")
@@ -99,17 +89,22 @@ def _remove_background(input_path: str, output_path: str) -> tuple[bool, str]:
             api_name="/predict"
         )
         
-        # Move generated file to the desired output path
-        shutil.copyfile(result_path, output_path)
-        
-        return True, ""
+        # Read the generated file back and drop gradio's temp copy
+        with open(result_path, "rb") as f:
+            png = f.read()
+        try:
+            os.remove(result_path)
+        except OSError:
+            pass
+
+        return png, ""
     except ImportError as e:
         err = f"gradio_client kutubxonasi o'rnatilmagan: {e}"
         import logging
         logging.getLogger("bg_remover").error(err)
-        return False, err
+        return b"", err
     except Exception as e:
         err = f"{type(e).__name__}: {str(e)[:300]}"
         import logging
         logging.getLogger("bg_remover").error(f"HF API xatolik: {err}")
-        return False, err
+        return b"", err
@@ -1,17 +1,21 @@
 """Smart File Compressor AI."""
 import os
-import uuid
 import logging
-import asyncio
 from aiogram import Router, F
-from aiogram.types import Message, FSInputFile
+from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from bot.fsm.states import AICompressorFSM
 from bot.locales import uz
+from services import image_io, media_cache
+from services.ffmpeg_runner import run_ffmpeg
+from services.media_jobs import JobContext, submit as submit_job
+from services.media_probe import ffmpeg_path
 
 router = Router(name="compressor")
 logger = logging.getLogger("compressor")
 
+PHOTO_MAX_SIDE = 1920
+
 
 @router.message(AICompressorFSM.waiting_for_file, F.text)
 async def handle_compressor_text(message: Message, state: FSMContext):
@@ -41,10 +45,12 @@ async def process_compression(message: Message, state: FSMContext):
     
     if message.video:
         file_id = message.video.file_id
+        source = message.video.file_unique_id
         file_type = "video"
         original_name = message.video.file_name or "video.mp4"
     elif message.photo:
         file_id = message.photo[-1].file_id
+        source = message.photo[-1].file_unique_id
         file_type = "photo"
         original_name = "photo.jpg"
     elif message.document:
@@ -62,113 +68,118 @@ async def process_compression(message: Message, state: FSMContext):
             return
             
         file_id = message.document.file_id
+        source = message.document.file_unique_id
         original_name = message.document.file_name or f"file.{file_type}"
     else:
         await message.answer("❌ Qo'llab-quvvatlanmaydigan fayl turi.")
         return
 
     await state.clear()
+
+    # Same file (file_unique_id) compressed before → resend the cached result
+    if await media_cache.try_cached(message.bot, message.chat.id, "compressor", source):
+        return
+
     msg = await message.answer("⏳ Fayl yuklanib siqish jarayoni boshlanmoqda, iltimos kuting...")
-    
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    uid = str(uuid.uuid4())[:8]
+    await submit_job("compressor", message.bot, message.chat.id, msg.message_id, {
+        "file_id": file_id, "source": source, "file_type": file_type, "original_name": original_name,
+    })
+
+
+async def run_job(ctx: JobContext, payload: dict):
+    """Media job (services/media_jobs.py): compress and send back the file."""
+    file_type = payload["file_type"]
+    original_name = payload["original_name"]
     ext = original_name.split('.')[-1] if '.' in original_name else file_type
-    
-    input_path = os.path.join(temp_dir, f"{uid}_in.{ext}")
-    output_path = os.path.join(temp_dir, f"{uid}_out_compressed.{ext}")
-    
+
+    input_path = ctx.path(f"in.{ext}")
+    output_path = ctx.path(f"out_compressed.{ext}")
+
     try:
-        await message.bot.download(file_id, destination=input_path)
-        original_size = os.path.getsize(input_path)
-        
-        await msg.edit_text(f"🗜 Asl hajm: **{original_size / (1024*1024):.1f} MB**.\nSiqilmoqda...")
-        
-        loop = asyncio.get_running_loop()
-        success = False
-        
+        await ctx.edit("📥 Fayl yuklab olinmoqda...")
+        if file_type == "photo":
+            # photos up to IMAGE_INLINE_MB never touch the scratch dir
+            src = await image_io.fetch(ctx.bot, payload["file_id"], input_path)
+        else:
+            await ctx.bot.download(payload["file_id"], destination=input_path)
+            src = input_path
+        original_size = image_io.size_of(src)
+
+        await ctx.edit(f"🗜 Asl hajm: **{original_size / (1024*1024):.1f} MB**.\nSiqilmoqda...")
+
+        result = False
+
+        # ffmpeg is its own process; the Pillow / PyMuPDF work is forked off the loop
         if file_type == "video":
-            success = await loop.run_in_executor(None, _compress_video, input_path, output_path)
+            result = await _compress_video(input_path, output_path, ctx)
         elif file_type == "photo":
-            success = await loop.run_in_executor(None, _compress_photo, input_path, output_path)
+            result = await ctx.run_sync(_compress_photo, src, image_io.output_for(src, output_path))
         elif file_type == "pdf":
-            success = await loop.run_in_executor(None, _compress_pdf, input_path, output_path)
-            
-        if not success or not os.path.exists(output_path):
-            await msg.edit_text("❌ Siqish jarayonida xatolik yuz berdi yoki bu faylni buning imkoni yo'q.")
+            result = await ctx.run_sync(_compress_pdf, input_path, output_path)
+
+        if not image_io.has_result(result, output_path):
+            await ctx.fail("❌ Siqish jarayonida xatolik yuz berdi yoki bu faylni buning imkoni yo'q.")
             return
-            
-        new_size = os.path.getsize(output_path)
+
+        new_size = image_io.result_size(result, output_path)
         saved_mb = (original_size - new_size) / (1024*1024)
         percent = 100 - (new_size / original_size * 100) if original_size > 0 else 0
-        
+
         if new_size >= original_size:
-            await msg.edit_text("⚠️ Bu faylni bundan ortiq siqib bo'lmas ekan.")
+            await ctx.fail("⚠️ Bu faylni bundan ortiq siqib bo'lmas ekan.")
             return
-            
-        result_file = FSInputFile(output_path, filename=f"compressed_{original_name}")
+
+        await ctx.edit("📤 Natija yuborilmoqda...")
+        result_file = image_io.input_file(result, output_path, f"compressed_{original_name}")
         caption = f"✅ <b>Siqish yakunlandi!</b>\n\n🔻 Asl hajm: {original_size/(1024*1024):.2f} MB\n📉 Yangi hajm: {new_size/(1024*1024):.2f} MB\n"
         caption += f"🎉 <b>Foyda:</b> {saved_mb:.2f} MB ({percent:.1f}%)"
-        
+
         if file_type == "video":
-            await message.answer_video(video=result_file, caption=caption, parse_mode="HTML")
+            kind = "video"
+            sent = await ctx.bot.send_video(ctx.chat_id, video=result_file, caption=caption, parse_mode="HTML")
         else:
-            await message.answer_document(document=result_file, caption=caption, parse_mode="HTML")
-            
-        await msg.delete()
-        
+            kind = "document"
+            sent = await ctx.bot.send_document(ctx.chat_id, document=result_file, caption=caption, parse_mode="HTML")
+        await media_cache.store("compressor", payload.get("source"), None, sent, kind,
+                                caption=caption, parse_mode="HTML", input_size=original_size)
+
+        await ctx.delete_status()
+
     except Exception as e:
         logger.error(f"Compressor process error: {e}")
-        try:
-            await msg.edit_text("❌ Tizimda xatolik yuz berdi.")
-        except Exception:
-            pass
-    finally:
-        for p in [input_path, output_path]:
-            try:
-                if os.path.exists(p): os.remove(p)
-            except Exception: pass
+        await ctx.fail("❌ Tizimda xatolik yuz berdi.")
 
 
-def _compress_video(input_path: str, output_path: str) -> bool:
+async def _compress_video(input_path: str, output_path: str, ctx=None) -> bool:
     """Compress video using FFmpeg."""
     try:
-        import subprocess
-        import shutil
-        ffmpeg = shutil.which("ffmpeg")
+        ffmpeg = ffmpeg_path()
         if not ffmpeg:
-            try:
-                import imageio_ffmpeg
-                ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
-            except ImportError:
-                return False
-                
+            return False
+
         # Compress using H.264 with high CRF (Constant Rate Factor) to heavily reduce size
-        cmd = [
-            ffmpeg, "-y", "-i", input_path,
+        result = await run_ffmpeg([
+            "-i", input_path,
             "-vcodec", "libx264", "-crf", "30", "-preset", "fast",
             "-acodec", "aac", "-b:a", "96k",
             output_path
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return result.returncode == 0
+        ], ctx=ctx, progress_text="⏳ Video siqilmoqda: {percent}%")
+        return result.ok
     except Exception as e:
-        import logging
-        logging.getLogger("compressor").error(f"Video compress error: {e}")
+        logger.error(f"Video compress error: {e}")
         return False
 
-def _compress_photo(input_path: str, output_path: str) -> bool:
-    """Compress image using Pillow."""
+def _compress_photo(src: image_io.Source, output_path: str | None) -> bytes | bool:
+    """Compress image using Pillow; returns the JPEG bytes when output_path is None."""
     try:
         from PIL import Image
-        img = Image.open(input_path)
+        img = image_io.open_image(src, PHOTO_MAX_SIDE)
         if img.mode != 'RGB':
             img = img.convert('RGB')
             
         # Resize if huge, and save with lower quality
-        img.thumbnail((1920, 1920), Image.Resampling.LANCZOS)
-        img.save(output_path, "JPEG", optimize=True, quality=65)
-        return True
+        img.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE), Image.Resampling.LANCZOS)
+        return image_io.save(img, output_path, "JPEG", optimize=True, quality=65)
     except Exception as e:
         import logging
         logging.getLogger("compressor").error(f"Image compress error: {e}")
@@ -1,14 +1,17 @@
 """Universal file converter — convert images, audio, video, and documents between formats."""
 import os
-import uuid
 import asyncio
 import logging
 
 from aiogram import Router, F
-from aiogram.types import Message, FSInputFile, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from bot.fsm.states import FileConvertFSM
 from bot.locales import uz
+from services import image_io, media_cache
+from services.ffmpeg_runner import run_ffmpeg
+from services.media_jobs import JobContext, run_command, run_sync, submit as submit_job
+from services.media_probe import ffmpeg_path
 
 router = Router(name="fileconvert")
 logger = logging.getLogger("fileconvert")
@@ -72,6 +75,8 @@ MIME_CATEGORIES = {
     "video": "video",
 }
 
+ICO_SIZE = 256
+
 
 def _detect_category(mime_type: str, filename: str) -> str | None:
     """Detect file category from mime type or extension."""
@@ -139,31 +144,37 @@ async def handle_convert_file(message: Message, state: FSMContext):
     # Determine file info
     if message.document:
         file_id = message.document.file_id
+        source = message.document.file_unique_id
         filename = message.document.file_name or "file"
         mime = message.document.mime_type or ""
         file_size = message.document.file_size
     elif message.photo:
         file_id = message.photo[-1].file_id
+        source = message.photo[-1].file_unique_id
         filename = "photo.jpg"
         mime = "image/jpeg"
         file_size = message.photo[-1].file_size
     elif message.video:
         file_id = message.video.file_id
+        source = message.video.file_unique_id
         filename = message.video.file_name or "video.mp4"
         mime = message.video.mime_type or "video/mp4"
         file_size = message.video.file_size
     elif message.audio:
         file_id = message.audio.file_id
+        source = message.audio.file_unique_id
         filename = message.audio.file_name or "audio.mp3"
         mime = message.audio.mime_type or "audio/mpeg"
         file_size = message.audio.file_size
     elif message.voice:
         file_id = message.voice.file_id
+        source = message.voice.file_unique_id
         filename = "voice.ogg"
         mime = "audio/ogg"
         file_size = message.voice.file_size
     elif message.video_note:
         file_id = message.video_note.file_id
+        source = message.video_note.file_unique_id
         filename = "videonote.mp4"
         mime = "video/mp4"
         file_size = message.video_note.file_size
@@ -195,7 +206,7 @@ async def handle_convert_file(message: Message, state: FSMContext):
         await message.answer("❌ Bu formatdan boshqa formatlarga o'girish imkoni yo'q.")
         return
 
-    await state.update_data(file_id=file_id, filename=filename, mime=mime, category=category, source_ext=source_ext)
+    await state.update_data(file_id=file_id, source=source, filename=filename, mime=mime, category=category, source_ext=source_ext)
     await state.set_state(FileConvertFSM.waiting_for_format)
 
     await message.answer(
@@ -243,97 +254,114 @@ async def process_conversion(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
 
+    # Same file (file_unique_id) converted to this format before → resend it
+    options = {"target": target_ext}
+    if await media_cache.try_cached(callback.bot, callback.message.chat.id, "fileconvert", data.get("source"), options):
+        await callback.answer()
+        try:
+            await callback.message.delete()
+        except Exception:
+            pass
+        return
+
     target_label = FORMATS.get(category, {}).get("targets", {}).get(target_ext, target_ext.upper())
     await callback.message.edit_text(f"⏳ {source_ext.upper()} → {target_label} konvertatsiya qilinmoqda...")
     await callback.answer()
+    await submit_job("fileconvert", callback.bot, callback.message.chat.id, callback.message.message_id, {
+        "file_id": file_id, "source": data.get("source"), "filename": filename, "category": category,
+        "source_ext": source_ext, "target_ext": target_ext,
+    })
 
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    uid = str(uuid.uuid4())[:8]
-    input_path = os.path.join(temp_dir, f"{uid}_input.{source_ext}")
+
+async def run_job(ctx: JobContext, payload: dict):
+    """Media job (services/media_jobs.py): convert the file and send the result."""
+    file_id = payload["file_id"]
+    filename = payload["filename"]
+    category = payload["category"]
+    source_ext = payload["source_ext"]
+    target_ext = payload["target_ext"]
+
+    input_path = ctx.path(f"input.{source_ext}")
     output_name = f"{os.path.splitext(filename)[0]}.{target_ext}"
-    output_path = os.path.join(temp_dir, f"{uid}_output.{target_ext}")
+    output_path = ctx.path(f"output.{target_ext}")
 
     try:
-        # Download file from Telegram
-        file = await callback.message.bot.get_file(file_id)
-        await callback.message.bot.download_file(file.file_path, input_path)
+        # Download file from Telegram — images up to IMAGE_INLINE_MB stay in memory
+        if category == "image":
+            src = await image_io.fetch(ctx.bot, file_id, input_path)
+        else:
+            file = await ctx.bot.get_file(file_id)
+            await ctx.bot.download_file(file.file_path, input_path)
+            src = input_path
 
-        success = False
+        result = False
 
-        # ── IMAGE conversion ──
+        # ── IMAGE conversion (Pillow, in a child process) ──
         if category == "image":
+            dst = image_io.output_for(src, output_path)
             if target_ext == "pdf":
-                success = await _image_to_pdf(input_path, output_path)
+                result = await ctx.run_sync(_image_to_pdf, src, dst)
             else:
-                success = await _convert_image(input_path, output_path, target_ext)
+                result = await ctx.run_sync(_convert_image, src, dst, target_ext)
 
         # ── AUDIO conversion ──
         elif category == "audio":
-            success = await _convert_ffmpeg(input_path, output_path, target_ext, "audio")
+            result = await _convert_ffmpeg(input_path, output_path, target_ext, "audio", ctx)
 
         # ── VIDEO conversion ──
         elif category == "video":
             if target_ext == "gif":
-                success = await _video_to_gif(input_path, output_path)
+                result = await _video_to_gif(input_path, output_path, ctx)
             elif target_ext == "mp3":
-                success = await _convert_ffmpeg(input_path, output_path, "mp3", "audio_only")
+                result = await _convert_ffmpeg(input_path, output_path, "mp3", "audio_only", ctx)
             else:
-                success = await _convert_ffmpeg(input_path, output_path, target_ext, "video")
+                result = await _convert_ffmpeg(input_path, output_path, target_ext, "video", ctx)
 
         # ── DOCUMENT conversion ──
         elif category == "document":
-            success = await _convert_document(input_path, output_path, source_ext, target_ext)
+            result = await _convert_document(input_path, output_path, source_ext, target_ext)
 
-        if not success or not os.path.exists(output_path):
-            await callback.message.edit_text("❌ Konvertatsiya muvaffaqiyatsiz tugadi. Boshqa format sinab ko'ring.")
+        if not image_io.has_result(result, output_path):
+            await ctx.fail("❌ Konvertatsiya muvaffaqiyatsiz tugadi. Boshqa format sinab ko'ring.")
             return
 
         # Send result
-        result_file = FSInputFile(output_path, filename=output_name)
-        file_size = os.path.getsize(output_path)
+        await ctx.edit("📤 Natija yuborilmoqda...")
+        result_file = image_io.input_file(result, output_path, output_name)
+        file_size = image_io.result_size(result, output_path)
         size_str = f"{file_size / (1024*1024):.1f} MB" if file_size > 1024*1024 else f"{file_size / 1024:.1f} KB"
 
         caption = f"✅ <b>Konvertatsiya tayyor!</b>\n📁 {source_ext.upper()} → {target_ext.upper()}\n💾 Hajmi: {size_str}"
 
         if target_ext in ("mp4", "avi", "mkv", "webm", "mov"):
-            await callback.message.answer_video(video=result_file, caption=caption, parse_mode="HTML")
+            kind = "video"
         elif target_ext in ("mp3", "wav", "ogg", "m4a", "flac", "aac"):
-            await callback.message.answer_audio(audio=result_file, caption=caption, parse_mode="HTML")
+            kind = "audio"
         elif target_ext in ("jpg", "jpeg", "png", "webp", "bmp") and file_size < 10 * 1024 * 1024:
-            await callback.message.answer_photo(photo=result_file, caption=caption, parse_mode="HTML")
+            kind = "photo"
         elif target_ext == "gif":
-            await callback.message.answer_animation(animation=result_file, caption=caption, parse_mode="HTML")
+            kind = "animation"
         else:
-            await callback.message.answer_document(document=result_file, caption=caption, parse_mode="HTML")
+            kind = "document"
+        method, arg = media_cache.SENDERS[kind]
+        sent = await getattr(ctx.bot, method)(ctx.chat_id, **{arg: result_file}, caption=caption, parse_mode="HTML")
+        await media_cache.store("fileconvert", payload.get("source"), {"target": target_ext}, sent, kind,
+                                caption=caption, parse_mode="HTML", input_size=image_io.size_of(src))
 
-        try:
-            await callback.message.delete()
-        except Exception:
-            pass
+        await ctx.delete_status()
 
     except Exception as e:
         logger.error(f"Conversion error: {e}")
-        try:
-            await callback.message.edit_text(f"❌ Xatolik: {str(e)[:200]}")
-        except Exception:
-            pass
-    finally:
-        for p in [input_path, output_path]:
-            try:
-                if os.path.exists(p):
-                    os.remove(p)
-            except Exception:
-                pass
+        await ctx.fail(f"❌ Xatolik: {str(e)[:200]}")
 
 
 # ── Conversion helpers ──
 
-async def _convert_image(input_path: str, output_path: str, target_ext: str) -> bool:
-    """Convert image using Pillow."""
+def _convert_image(src: image_io.Source, output_path: str | None, target_ext: str) -> bytes | bool:
+    """Convert image using Pillow; returns the encoded bytes when output_path is None."""
     try:
         from PIL import Image
-        img = Image.open(input_path)
+        img = image_io.open_image(src, ICO_SIZE if target_ext == "ico" else None)
 
         # Handle RGBA for formats that don't support it
         if target_ext in ("jpg", "jpeg", "bmp", "ico") and img.mode in ("RGBA", "P"):
@@ -351,20 +379,19 @@ async def _convert_image(input_path: str, output_path: str, target_ext: str) ->
         elif target_ext == "webp":
             save_kwargs["quality"] = 90
         elif target_ext == "ico":
-            img = img.resize((256, 256), Image.LANCZOS)
+            img = img.resize((ICO_SIZE, ICO_SIZE), Image.LANCZOS)
 
-        img.save(output_path, **save_kwargs)
-        return True
+        return image_io.save(img, output_path, image_io.format_for(target_ext), **save_kwargs)
     except Exception as e:
         logger.error(f"Image convert error: {e}")
         return False
 
 
-async def _image_to_pdf(input_path: str, output_path: str) -> bool:
-    """Convert image to PDF."""
+def _image_to_pdf(src: image_io.Source, output_path: str | None) -> bytes | bool:
+    """Convert image to PDF; returns the PDF bytes when output_path is None."""
     try:
         from PIL import Image
-        img = Image.open(input_path)
+        img = image_io.open_image(src)
         if img.mode in ("RGBA", "P"):
             bg = Image.new("RGB", img.size, (255, 255, 255))
             if img.mode == "P":
@@ -373,90 +400,68 @@ async def _image_to_pdf(input_path: str, output_path: str) -> bool:
             img = bg
         elif img.mode != "RGB":
             img = img.convert("RGB")
-        img.save(output_path, "PDF")
-        return True
+        return image_io.save(img, output_path, "PDF")
     except Exception as e:
         logger.error(f"Image to PDF error: {e}")
         return False
 
 
-async def _get_ffmpeg() -> str | None:
-    """Get FFmpeg executable path."""
-    try:
-        import imageio_ffmpeg
-        return imageio_ffmpeg.get_ffmpeg_exe()
-    except ImportError:
-        import shutil
-        return shutil.which("ffmpeg")
-
-
-async def _convert_ffmpeg(input_path: str, output_path: str, target_ext: str, mode: str) -> bool:
+async def _convert_ffmpeg(input_path: str, output_path: str, target_ext: str, mode: str, ctx=None) -> bool:
     """Convert audio/video using FFmpeg."""
-    ffmpeg = await _get_ffmpeg()
-    if not ffmpeg:
+    if not ffmpeg_path():
         logger.error("FFmpeg not found")
         return False
 
     try:
         if mode == "audio":
-            cmd = [ffmpeg, "-y", "-i", input_path, "-vn", "-q:a", "2", output_path]
+            args = ["-i", input_path, "-vn", "-q:a", "2", output_path]
         elif mode == "audio_only":
-            cmd = [ffmpeg, "-y", "-i", input_path, "-vn", "-ab", "192k", output_path]
+            args = ["-i", input_path, "-vn", "-ab", "192k", output_path]
         else:  # video
-            cmd = [
-                ffmpeg, "-y", "-i", input_path,
+            args = [
+                "-i", input_path,
                 "-c:v", "libx264", "-preset", "fast", "-crf", "23",
                 "-c:a", "aac", "-b:a", "128k",
                 "-movflags", "+faststart",
                 output_path,
             ]
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-        return process.returncode == 0
+        result = await run_ffmpeg(args, ctx=ctx, label=f"fileconvert:{mode}",
+                                  progress_text="🔄 Konvertatsiya qilinmoqda: {percent}%")
+        return result.ok
     except Exception as e:
         logger.error(f"FFmpeg convert error: {e}")
         return False
 
 
-async def _video_to_gif(input_path: str, output_path: str) -> bool:
+async def _video_to_gif(input_path: str, output_path: str, ctx=None) -> bool:
     """Convert video to GIF using FFmpeg."""
-    ffmpeg = await _get_ffmpeg()
-    if not ffmpeg:
+    if not ffmpeg_path():
         return False
 
     try:
-        # Generate palette for better quality
+        # Generate palette for better quality (from the same 15 seconds the GIF uses)
         palette_path = input_path + "_palette.png"
-        palette_cmd = [
-            ffmpeg, "-y", "-i", input_path,
+        await run_ffmpeg([
+            "-t", "15", "-i", input_path,
             "-vf", "fps=12,scale=480:-1:flags=lanczos,palettegen",
             palette_path,
-        ]
-        p1 = await asyncio.create_subprocess_exec(
-            *palette_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        await p1.communicate()
+        ], ctx=ctx, label="fileconvert:palette")
 
-        gif_cmd = [
-            ffmpeg, "-y", "-i", input_path, "-i", palette_path,
-            "-lavfi", "fps=12,scale=480:-1:flags=lanczos[x];[x][1:v]paletteuse",
+        result = await run_ffmpeg([
             "-t", "15",  # Max 15 seconds
+            "-i", input_path, "-i", palette_path,
+            "-lavfi", "fps=12,scale=480:-1:flags=lanczos[x];[x][1:v]paletteuse",
             output_path,
-        ]
-        p2 = await asyncio.create_subprocess_exec(
-            *gif_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        await p2.communicate()
+        ], ctx=ctx, label="fileconvert:gif", duration=15, progress_text="🔄 GIF tayyorlanmoqda: {percent}%")
+        returncode = result.returncode
 
         try:
             os.remove(palette_path)
         except Exception:
             pass
 
-        return p2.returncode == 0
+        return returncode == 0
     except Exception as e:
         logger.error(f"Video to GIF error: {e}")
         return False
@@ -471,16 +476,11 @@ async def _convert_document(input_path: str, output_path: str, source_ext: str,
             if source_ext == "pdf":
                 # Try basic PDF text extraction
                 try:
-                    import subprocess
                     # Use pdftotext if available
                     import shutil
                     if shutil.which("pdftotext"):
-                        proc = await asyncio.create_subprocess_exec(
-                            "pdftotext", input_path, output_path,
-                            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-                        )
-                        await proc.communicate()
-                        return proc.returncode == 0
+                        returncode, _, _ = await run_command(["pdftotext", input_path, output_path])
+                        return returncode == 0
                 except Exception:
                     pass
                 # Fallback: read raw
@@ -529,7 +529,7 @@ async def _convert_document(input_path: str, output_path: str, source_ext: str,
             if await _convert_via_libreoffice(input_path, output_path):
                 return True
             if source_ext == "txt":
-                return await _txt_to_pdf_fallback(input_path, output_path)
+                return await run_sync(_txt_to_pdf_fallback, input_path, output_path)
             return False
 
     except Exception as e:
@@ -563,13 +563,9 @@ async def _convert_via_libreoffice(input_path: str, output_path: str) -> bool:
             "--outdir", scratch_dir,
             input_path,
         ]
-        proc = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
-        )
         try:
-            await asyncio.wait_for(proc.communicate(), timeout=90)
+            await run_command(cmd, timeout=90)
         except asyncio.TimeoutError:
-            proc.kill()
             logger.error("LibreOffice conversion timed out")
             return False
 
@@ -588,7 +584,7 @@ async def _convert_via_libreoffice(input_path: str, output_path: str) -> bool:
         shutil.rmtree(profile_dir, ignore_errors=True)
 
 
-async def _txt_to_pdf_fallback(input_path: str, output_path: str) -> bool:
+def _txt_to_pdf_fallback(input_path: str, output_path: str) -> bool:
     """Plain-text-to-image-pages PDF, used only when LibreOffice is unavailable."""
     try:
         from PIL import Image, ImageDraw
@@ -0,0 +1,20 @@
+"""❌ Bekor qilish button on queued / running Superapp media jobs."""
+from aiogram import Router, F
+from aiogram.types import CallbackQuery
+
+from services.media_jobs import cancel
+
+router = Router(name="media_jobs")
+
+
+@router.callback_query(F.data.startswith("mjob:cancel:"))
+async def cancel_media_job(callback: CallbackQuery):
+    job_id = callback.data.split(":", 2)[2]
+    if not await cancel(job_id, callback.message.chat.id, callback.bot):
+        await callback.answer("Bu ish allaqachon tugagan.", show_alert=False)
+        return
+    await callback.answer("Bekor qilinmoqda...")
+    try:
+        await callback.message.edit_text("❌ Bekor qilindi.")
+    except Exception:
+        pass
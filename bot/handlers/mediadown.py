@@ -1,16 +1,22 @@
 """Social media downloader — download videos/photos from TikTok, Pinterest, etc.
 (Instagram and YouTube are not supported — see the note on SUPPORTED_PATTERNS.)"""
 import os
-import uuid
-import asyncio
+import html
 import logging
 import re
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
 from aiogram import Router, F
 from aiogram.types import Message, FSInputFile
 from aiogram.fsm.context import FSMContext
 from bot.fsm.states import MediaDownloadFSM
 from bot.locales import uz
+from services import media_cache
+from services.media_encode import TELEGRAM_TARGET, fit_to_size
+from services.media_jobs import JobContext, get_redis, submit as submit_job
+from services.ytdlp_pool import (
+    GEO_BLOCKED, LOGIN_REQUIRED, NOT_FOUND, PRIVATE, RATE_LIMITED, UNSUPPORTED, YtdlpError, get_pool,
+)
 
 router = Router(name="mediadown")
 logger = logging.getLogger("mediadown")
@@ -31,6 +37,8 @@ SUPPORTED_PATTERNS = [
     r"(https?://)?(www\.)?linkedin\.com/",
 ]
 
+DOWNLOAD_FAILED = "❌ Bu havoladan yuklab bo'lmadi. Iltimos, keyinroq qayta urinib ko'ring."
+
 
 def _is_supported_url(text: str) -> bool:
     """Check if the text contains a supported social media URL."""
@@ -59,6 +67,76 @@ def _get_platform_name(url: str) -> str:
     return "Noma'lum"
 
 
+# ── URL keys for the result cache / single-flight (services/media_cache.py) ──
+
+URL_CACHE_TTL = 3 * 86400
+SHORT_LINK_TTL = 7 * 86400
+SHORT_LINK = re.compile(r"^https?://(vm\.tiktok\.com|vt\.tiktok\.com|(www\.)?tiktok\.com/t)/", re.IGNORECASE)
+TRACKING_PARAMS = {
+    "igshid", "igsh", "si", "s", "t", "ref", "ref_src", "ref_url", "_r", "_t", "fbclid", "gclid",
+    "is_from_webapp", "sender_device", "share_app_id", "share_item_id", "share_link_id",
+    "social_sharing", "feature", "mibextid", "rdid", "share_id", "context",
+}
+MOBILE_UA = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
+
+
+def _extract_url(text: str) -> str:
+    """The first URL in the message, with a scheme."""
+    match = re.search(r"https?://\S+", text)
+    url = match.group(0) if match else text.split()[0]
+    return url if url.lower().startswith("http") else f"https://{url}"
+
+
+def _normalize_url(url: str) -> str:
+    """Cache key for a post: no scheme/www/tracking params; TikTok by video id."""
+    parts = urlsplit(url)
+    host = parts.netloc.lower().rsplit("@", 1)[-1].split(":")[0]
+    for prefix in ("www.", "m.", "mobile."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if host == "x.com":
+        host = "twitter.com"
+    path = parts.path.rstrip("/")
+    if host.endswith("tiktok.com"):
+        match = re.search(r"/(video|photo)/(\d+)", path)
+        if match:
+            return f"tiktok.com/{match.group(1)}/{match.group(2)}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith("utm_")
+    )
+    return f"{host}{path}" + (f"?{urlencode(query)}" if query else "")
+
+
+async def _resolve_short_link(url: str) -> str:
+    """Follow vm./vt.tiktok.com (and tiktok.com/t/) redirects to the real post URL."""
+    if not SHORT_LINK.match(url):
+        return url
+    redis = await get_redis()
+    key = f"media:shortlink:{url}"
+    if redis:
+        try:
+            cached = await redis.get(key)
+            if cached:
+                return cached
+        except Exception:
+            pass
+    try:
+        import httpx
+        async with httpx.AsyncClient(follow_redirects=True, timeout=8.0, headers={"User-Agent": MOBILE_UA}) as client:
+            async with client.stream("GET", url) as res:
+                resolved = str(res.url)
+    except Exception as e:
+        logger.warning(f"Short link {url} not resolved: {e}")
+        return url
+    if redis:
+        try:
+            await redis.set(key, resolved, ex=SHORT_LINK_TTL)
+        except Exception:
+            pass
+    return resolved
+
+
 @router.message(MediaDownloadFSM.waiting_for_url, F.text)
 async def handle_media_url(message: Message, state: FSMContext):
     """Handle URL input for media download."""
@@ -91,200 +169,178 @@ async def handle_media_url(message: Message, state: FSMContext):
         return
 
     platform = _get_platform_name(text)
+    url = await _resolve_short_link(_extract_url(text))
+    source = media_cache.text_source(_normalize_url(url))
+
+    # Downloaded recently → resend the cached file_id
+    if await media_cache.try_cached(message.bot, message.chat.id, "mediadown", source):
+        return
+
     msg = await message.answer(f"⏳ {platform} dan yuklab olinmoqda... Iltimos kuting.\n\n💡 Katta videolar yuklanishi va siqilishi bir necha daqiqa vaqt olishi mumkin.")
 
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    output_template = os.path.join(temp_dir, f"{uuid.uuid4()}.%(ext)s")
+    # Someone is downloading this post right now → get their result when it's sent
+    if not await media_cache.claim_inflight("mediadown", source, message.chat.id, msg.message_id):
+        await msg.edit_text("⏳ Bu havola hozir yuklanmoqda — tayyor bo'lishi bilan sizga ham yuboriladi.")
+        return
+    entry = await media_cache.peek("mediadown", source)
+    if entry:  # the previous download finished between the lookup and the claim
+        await media_cache.finish_inflight(message.bot, "mediadown", source, entry, DOWNLOAD_FAILED)
+        await media_cache.send_cached(message.bot, message.chat.id, "mediadown", source, None, entry)
+        await msg.delete()
+        return
+
+    await submit_job("mediadown", message.bot, message.chat.id, msg.message_id, {
+        "url": url, "platform": platform, "source": source,
+    })
+
+
+async def run_job(ctx: JobContext, payload: dict):
+    """Media job (services/media_jobs.py): yt-dlp download, fit to 50 MB, send."""
+    text = payload["url"]
+    platform = payload["platform"]
+    source = payload.get("source")
+    output_template = ctx.path("media.%(ext)s")
+    entry = None
 
     try:
-        # Use yt-dlp to download (up to 5GB)
-        cmd = [
-            "yt-dlp",
-            "--no-playlist",
-            "-o", output_template,
-            "--merge-output-format", "mp4",
-            "--recode-video", "mp4",
-            # Best available quality — if too big, FFmpeg will compress to fit
-            "-f", "bestvideo+bestaudio/best",
-            "--no-warnings",
-            "--no-check-certificates",
-            "--socket-timeout", "30",
-            "--retries", "3",
-            "--user-agent", "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
-        ]
-
-        cmd.append(text)
-
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout, stderr = await process.communicate()
+        # Download with a warm in-process yt-dlp (services/ytdlp_pool.py).
+        # Best available quality — if too big, FFmpeg will compress to fit
+        async def on_progress(p: dict):
+            if p.get("stage") == "processing":
+                await ctx.edit("⚙️ Video tayyorlanmoqda...")
+            elif p.get("total"):
+                mb = 1024 * 1024
+                await ctx.stage(
+                    f"📥 {platform} dan yuklanmoqda: {p['downloaded'] * 100 // p['total']}%\n"
+                    f"{p['downloaded'] / mb:.1f} / {p['total'] / mb:.1f} MB"
+                )
 
-        if process.returncode != 0:
-            error_text = (stderr.decode() + stdout.decode())[:500]
-            logger.error(f"yt-dlp error for {text}: {error_text}")
+        try:
+            info = await get_pool().download(
+                text, output_template, platform, on_progress,
+                http_headers={"User-Agent": MOBILE_UA},
+            )
+        except YtdlpError as e:
+            logger.error(f"yt-dlp error for {text}: {e}")
 
-            if "Sign in to confirm" in error_text or "cookies" in error_text.lower():
-                await msg.edit_text(
+            if e.code == LOGIN_REQUIRED:
+                await ctx.fail(
                     f"🤖 {platform} bot tekshiruvidan o'ta olmadi.\n\n"
                     "Iltimos, boshqa platformadagi kontentni sinab ko'ring yoki keyinroq qayta urinib ko'ring."
                 )
-            elif "Private" in error_text or "login" in error_text.lower():
-                await msg.edit_text(f"🔒 Bu {platform} kontent yopiq (private). Faqat ochiq (public) kontentlarni yuklab olish mumkin.")
-            elif "not found" in error_text.lower() or "404" in error_text:
-                await msg.edit_text(f"❌ Kontent topilmadi. Havola to'g'riligini tekshiring.")
-            elif "Unsupported URL" in error_text:
-                await msg.edit_text(f"❌ Bu turdagi havola qo'llab-quvvatlanmaydi.")
+            elif e.code == PRIVATE:
+                await ctx.fail(f"🔒 Bu {platform} kontent yopiq (private). Faqat ochiq (public) kontentlarni yuklab olish mumkin.")
+            elif e.code == NOT_FOUND:
+                await ctx.fail(f"❌ Kontent topilmadi. Havola to'g'riligini tekshiring.")
+            elif e.code == UNSUPPORTED:
+                await ctx.fail(f"❌ Bu turdagi havola qo'llab-quvvatlanmaydi.")
+            elif e.code == GEO_BLOCKED:
+                await ctx.fail(f"🌍 Bu {platform} kontent bizning serverimiz hududida bloklangan.")
+            elif e.code == RATE_LIMITED:
+                await ctx.fail(f"⏳ {platform} hozir so'rovlarni cheklayapti. Bir necha daqiqadan so'ng qayta urinib ko'ring.")
             else:
-                await msg.edit_text(f"❌ {platform} dan yuklab bo'lmadi.\n\n<pre>{error_text[:300]}</pre>", parse_mode="HTML")
+                await ctx.fail(f"❌ {platform} dan yuklab bo'lmadi.\n\n<pre>{html.escape(e.message[:300])}</pre>", parse_mode="HTML")
             return
 
-        # Find downloaded file
-        downloaded = None
-        base_name = output_template.replace(".%(ext)s", "")
-        for ext in ["mp4", "mkv", "webm", "mp3", "m4a", "jpg", "jpeg", "png", "webp"]:
-            candidate = f"{base_name}.{ext}"
-            if os.path.exists(candidate):
-                downloaded = candidate
-                break
+        # Find downloaded file — yt-dlp reports it; look around in case a postprocessor renamed it
+        downloaded = info.get("filepath")
+        if not downloaded or not os.path.exists(downloaded):
+            downloaded = None
+            base_name = output_template.replace(".%(ext)s", "")
+            for ext in ["mp4", "mkv", "webm", "mp3", "m4a", "jpg", "jpeg", "png", "webp"]:
+                candidate = f"{base_name}.{ext}"
+                if os.path.exists(candidate):
+                    downloaded = candidate
+                    break
 
         if not downloaded:
-            # Scan temp dir for the file
-            uid = os.path.basename(base_name)
-            for f in os.listdir(temp_dir):
-                if f.startswith(uid):
-                    downloaded = os.path.join(temp_dir, f)
+            # Scan the job dir for the file
+            for f in os.listdir(ctx.temp_dir):
+                if f.startswith("media."):
+                    downloaded = os.path.join(ctx.temp_dir, f)
                     break
 
         if not downloaded or not os.path.exists(downloaded):
-            await msg.edit_text("❌ Fayl yuklab olindi, lekin topilmadi. Qayta urinib ko'ring.")
+            await ctx.fail("❌ Fayl yuklab olindi, lekin topilmadi. Qayta urinib ko'ring.")
             return
 
         file_size = os.path.getsize(downloaded)
 
-        # If file exceeds Telegram 50MB limit, compress with FFmpeg
-        if file_size > 49 * 1024 * 1024:
-            size_mb = file_size // (1024*1024)
-            try:
-                await msg.edit_text(
+        # Over the Telegram limit, or an MKV/WebM that may remux to MP4
+        ext = downloaded.rsplit(".", 1)[-1].lower()
+        if file_size > TELEGRAM_TARGET or ext in ("mkv", "webm", "mov"):
+            if file_size > TELEGRAM_TARGET:
+                size_mb = file_size // (1024*1024)
+                await ctx.edit(
                     f"🗜 Fayl hajmi <b>{size_mb} MB</b>. Telegram limitiga (50 MB) moslashtirish uchun siqilmoqda...\n\n"
                     f"⏳ Bu jarayon {max(1, size_mb // 50)}-{max(2, size_mb // 25)} daqiqa davom etishi mumkin.",
                     parse_mode="HTML"
                 )
-            except Exception:
-                pass
-
-            try:
-                import imageio_ffmpeg
-                ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-            except ImportError:
-                import shutil
-                ffmpeg_exe = shutil.which("ffmpeg")
-
-            if ffmpeg_exe:
-                compressed_path = downloaded.rsplit(".", 1)[0] + "_compressed.mp4"
-
-                # Get video duration first
-                probe_cmd = [
-                    ffmpeg_exe, "-i", downloaded,
-                    "-f", "null", "-"
-                ]
-                probe = await asyncio.create_subprocess_exec(
-                    *probe_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-                )
-                _, probe_err = await probe.communicate()
-                
-                # Parse duration from stderr
-                duration = 60  # default fallback
-                probe_text = probe_err.decode()
-                import re as re2
-                dur_match = re2.search(r"Duration:\s*(\d+):(\d+):(\d+)", probe_text)
-                if dur_match:
-                    h, m, s = int(dur_match.group(1)), int(dur_match.group(2)), int(dur_match.group(3))
-                    duration = max(h * 3600 + m * 60 + s, 1)
-
-                # Target ~45MB to be safe (45 * 8 * 1024 kbit / duration)
-                target_bitrate = int((45 * 8 * 1024) / duration)
-                audio_bitrate = 96
-                video_bitrate = max(target_bitrate - audio_bitrate, 200)
-
-                compress_cmd = [
-                    ffmpeg_exe, "-y", "-i", downloaded,
-                    "-c:v", "libx264", "-b:v", f"{video_bitrate}k",
-                    "-preset", "fast", "-crf", "28",
-                    "-c:a", "aac", "-b:a", f"{audio_bitrate}k",
-                    "-movflags", "+faststart",
-                    compressed_path
-                ]
-                comp = await asyncio.create_subprocess_exec(
-                    *compress_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-                )
-                await comp.communicate()
-
-                if comp.returncode == 0 and os.path.exists(compressed_path):
-                    os.remove(downloaded)
-                    downloaded = compressed_path
-                    file_size = os.path.getsize(downloaded)
-            
-            # Final check after compression
-            if file_size > 50 * 1024 * 1024:
-                await msg.edit_text(
-                    f"⚠️ Siqishdan keyin ham fayl {file_size // (1024*1024)} MB. "
-                    "Iltimos, kichikroq video sinab ko'ring."
+            fitted = await fit_to_size(downloaded, ctx.path("media_fitted.mp4"), TELEGRAM_TARGET, ctx=ctx)
+            if fitted is None:
+                await ctx.fail(
+                    f"⚠️ Fayl {file_size // (1024*1024)} MB — Telegram limitiga (50 MB) sig'dirib bo'lmadi. "
+                    "Iltimos, qisqaroq video sinab ko'ring."
                 )
-                os.remove(downloaded)
                 return
+            if fitted != downloaded:
+                os.remove(downloaded)
+                downloaded = fitted
+                file_size = os.path.getsize(downloaded)
 
+        await ctx.edit("📤 Yuborilmoqda...")
         file = FSInputFile(downloaded)
         ext = downloaded.rsplit(".", 1)[-1].lower()
 
-        try:
-            await msg.delete()
-        except Exception:
-            pass
-
         # Send based on file type
         if ext in ("mp4", "mkv", "webm"):
-            await message.answer_video(
+            kind, caption = "video", f"📥 {platform} dan yuklandi\n🔗 {text[:60]}"
+            sent = await ctx.bot.send_video(
+                ctx.chat_id,
                 video=file,
-                caption=f"📥 {platform} dan yuklandi\n🔗 {text[:60]}",
+                caption=caption,
                 supports_streaming=True,
             )
         elif ext in ("mp3", "m4a", "ogg"):
-            await message.answer_audio(
+            kind, caption = "audio", f"📥 {platform} dan yuklandi"
+            sent = await ctx.bot.send_audio(
+                ctx.chat_id,
                 audio=file,
-                caption=f"📥 {platform} dan yuklandi",
+                caption=caption,
             )
         elif ext in ("jpg", "jpeg", "png", "webp"):
-            await message.answer_photo(
+            kind, caption = "photo", f"📥 {platform} dan yuklandi"
+            sent = await ctx.bot.send_photo(
+                ctx.chat_id,
                 photo=file,
-                caption=f"📥 {platform} dan yuklandi",
+                caption=caption,
             )
         else:
-            await message.answer_document(
+            kind, caption = "document", f"📥 {platform} dan yuklandi"
+            sent = await ctx.bot.send_document(
+                ctx.chat_id,
                 document=file,
-                caption=f"📥 {platform} dan yuklandi",
+                caption=caption,
             )
 
+        entry = await media_cache.store("mediadown", source, None, sent, kind, caption=caption,
+                                        input_size=file_size, ttl=URL_CACHE_TTL)
+        await ctx.delete_status()
+
     except Exception as e:
         logger.error(f"Media download error: {e}")
-        try:
-            await msg.edit_text(f"❌ Kutilmagan xatolik: {str(e)[:200]}")
-        except Exception:
-            pass
+        await ctx.fail(f"❌ Kutilmagan xatolik: {str(e)[:200]}")
     finally:
-        # Cleanup
-        base_name = output_template.replace(".%(ext)s", "")
-        uid = os.path.basename(base_name)
-        for f in os.listdir(temp_dir):
-            if f.startswith(uid):
-                try:
-                    os.remove(os.path.join(temp_dir, f))
-                except Exception:
-                    pass
+        # answer everyone who asked for the same post while this ran
+        if source:
+            await media_cache.finish_inflight(ctx.bot, "mediadown", source, entry, DOWNLOAD_FAILED)
+
+
+async def on_abandoned(bot, payload: dict):
+    """Media job hook: the job ended before run_job (cancelled while queued, out of
+    worker attempts) — release the single-flight claim so waiters get an answer."""
+    if payload.get("source"):
+        await media_cache.finish_inflight(bot, "mediadown", payload["source"], None, DOWNLOAD_FAILED)
 
 
 @router.message(MediaDownloadFSM.waiting_for_url)
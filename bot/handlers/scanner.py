@@ -1,13 +1,12 @@
 """Document Scanner AI using OpenCV."""
-import os
-import uuid
 import logging
-import asyncio
 from aiogram import Router, F
-from aiogram.types import Message, FSInputFile, ContentType
+from aiogram.types import Message, ContentType
 from aiogram.fsm.context import FSMContext
 from bot.fsm.states import AIScannerFSM
 from bot.locales import uz
+from services import image_io
+from services.media_jobs import JobContext, submit as submit_job
 
 router = Router(name="scanner")
 logger = logging.getLogger("scanner")
@@ -67,63 +66,58 @@ async def process_scanned_pdf(message: Message, state: FSMContext):
         return
         
     from bot.keyboards.buttons import superapp_keyboard
-    msg = await message.answer(f"⏳ {len(photos)} ta rasm skaner qilinmoqda va PDF tayyorlanmoqda, iltimos kuting...", reply_markup=superapp_keyboard())
     await state.clear()
-    
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    uid = str(uuid.uuid4())[:8]
-    
-    downloaded_paths = []
-    output_pdf_path = os.path.join(temp_dir, f"{uid}_scanned.pdf")
-    
+    await message.answer(f"⏳ {len(photos)} ta rasm skaner qilinmoqda va PDF tayyorlanmoqda, iltimos kuting...", reply_markup=superapp_keyboard())
+    # A separate status message: reply-keyboard messages can't carry the job's cancel button
+    msg = await message.answer("🕒 Navbatga qo'yildi...")
+    await submit_job("scanner", message.bot, message.chat.id, msg.message_id, {"photos": photos})
+
+
+async def run_job(ctx: JobContext, payload: dict):
+    """Media job (services/media_jobs.py): scan the photos into one PDF."""
+    photos = payload["photos"]
+    sources = []
+    output_pdf_path = ctx.path("scanned.pdf")
+
     try:
-        # 1. Download all photos
+        # 1. Download all photos (in memory up to IMAGE_INLINE_MB each)
         for i, file_id in enumerate(photos):
-            photo_path = os.path.join(temp_dir, f"{uid}_photo_{i}.jpg")
-            await message.bot.download(file_id, destination=photo_path)
-            downloaded_paths.append(photo_path)
-            
-        # 2. Process in executor
-        loop = asyncio.get_running_loop()
-        success = await loop.run_in_executor(None, _create_scanned_pdf, downloaded_paths, output_pdf_path)
-        
-        if not success or not os.path.exists(output_pdf_path):
-            await msg.edit_text("❌ PDF yaratishda xatolik yuz berdi.")
+            await ctx.stage(f"📥 Rasmlar yuklab olinmoqda: {i + 1}/{len(photos)}")
+            sources.append(await image_io.fetch(ctx.bot, file_id, ctx.path(f"photo_{i}.jpg")))
+
+        # 2. OpenCV work in a child process; the PDF comes back as bytes unless a photo was too big
+        await ctx.edit("⚙️ Skaner qilinmoqda...")
+        inline = all(isinstance(src, bytes) for src in sources)
+        result = await ctx.run_sync(_create_scanned_pdf, sources, None if inline else output_pdf_path)
+
+        if not image_io.has_result(result, output_pdf_path):
+            await ctx.fail("❌ PDF yaratishda xatolik yuz berdi.")
             return
-            
+
         # 3. Send PDF
-        pdf_file = FSInputFile(output_pdf_path, filename="Nuvi_Scanner.pdf")
-        await message.answer_document(document=pdf_file, caption=f"✅ {len(photos)} ta sahifali PDF tayyor! (Kengaytirilgan skaner formati)")
-        await msg.delete()
-        
+        pdf_file = image_io.input_file(result, output_pdf_path, "Nuvi_Scanner.pdf")
+        await ctx.bot.send_document(ctx.chat_id, document=pdf_file, caption=f"✅ {len(photos)} ta sahifali PDF tayyor! (Kengaytirilgan skaner formati)")
+        await ctx.delete_status()
+
     except Exception as e:
         logger.error(f"Scanner process error: {e}")
-        try:
-            await msg.edit_text("❌ Tizimda xatolik yuz berdi.")
-        except Exception:
-            pass
-    finally:
-        for p in downloaded_paths:
-            try:
-                if os.path.exists(p): os.remove(p)
-            except Exception: pass
-        try:
-            if os.path.exists(output_pdf_path): os.remove(output_pdf_path)
-        except Exception: pass
-
-
-def _create_scanned_pdf(image_paths: list[str], output_pdf: str) -> bool:
-    """Enhance images and compile to PDF using OpenCV and Pillow."""
+        await ctx.fail("❌ Tizimda xatolik yuz berdi.")
+
+
+def _create_scanned_pdf(sources: list[image_io.Source], output_pdf: str | None) -> bytes | bool:
+    """Enhance images and compile to PDF using OpenCV and Pillow; returns the PDF bytes when output_pdf is None."""
     try:
         import cv2
         import numpy as np
         from PIL import Image
 
         processed_images = []
-        for path in image_paths:
-            # Read image
-            img = cv2.imread(path)
+        for src in sources:
+            # Read image (decoded straight from memory for inline sources)
+            if isinstance(src, bytes):
+                img = cv2.imdecode(np.frombuffer(src, np.uint8), cv2.IMREAD_COLOR)
+            else:
+                img = cv2.imread(src)
             if img is None:
                 continue
 
@@ -146,10 +140,9 @@ def _create_scanned_pdf(image_paths: list[str], output_pdf: str) -> bool:
             return False
 
         # Save all as single PDF
-        processed_images[0].save(
-            output_pdf, "PDF", resolution=150.0, save_all=True, append_images=processed_images[1:]
+        return image_io.save(
+            processed_images[0], output_pdf, "PDF", resolution=150.0, save_all=True, append_images=processed_images[1:]
         )
-        return True
     except Exception as e:
         import logging
         logging.getLogger("scanner").error(f"OpenCV processing error: {e}")
@@ -1,15 +1,27 @@
 """Handler to transform user videos into Telegram Video Notes (circular videos)."""
 import os
-import uuid
-import asyncio
-import shutil
 from aiogram import Router, F
 from aiogram.types import Message, FSInputFile
 from aiogram.fsm.context import FSMContext
 from bot.fsm.states import VideoNoteFSM
+from services import media_cache, video_note
+from services.media_jobs import JobContext, submit as submit_job
+from services.media_probe import ffmpeg_path
 
 router = Router(name="videonote")
 
+VOICE_FORBIDDEN_TEXT = (
+    "❌ <b>Yuborib bo'lmadi!</b>\n\n"
+    "Sizning Telegram akkauntingizda botlardan <b>Ovozli va Video xabarlar</b> qabul qilish bloklangan ekan.\n\n"
+    "⚙️ <b>Buni qanday to'g'rilash mumkin?</b>\n"
+    "1. Telegram sozlamalariga (Settings) kiring.\n"
+    "2. Maxfiylik va Xavfsizlik (Privacy and Security) bo'limini tanlang.\n"
+    "3. <b>Voice Messages</b> (Ovozli xabarlar) qatorini bosing.\n"
+    "4. Pastdagi <i>Always Allow</i> (Doim ruxsat beriladiganlar) ro'yxatiga ushbu botni qo'shing yoki 'Everyone' ni belgilang.\n\n"
+    "Shundan so'ng bot bemalol sizga dumaloq video yubora oladi!"
+)
+
+
 @router.message(VideoNoteFSM.waiting_for_video, F.video | F.document)
 async def process_video_to_note(message: Message, state: FSMContext):
     # Check if it's a valid video format
@@ -49,78 +61,68 @@ async def process_video_to_note(message: Message, state: FSMContext):
         )
         return
     
-    # Send processing message
+    # Same video (file_unique_id) converted before → resend the cached note
+    try:
+        if await media_cache.try_cached(message.bot, message.chat.id, "videonote", file_obj.file_unique_id):
+            return
+    except Exception as e:
+        if "VOICE_MESSAGES_FORBIDDEN" in str(e):
+            await message.answer(VOICE_FORBIDDEN_TEXT, parse_mode="HTML")
+            return
+        raise
+
+    # Send processing message; the conversion itself runs as a media job
     msg = await message.answer("🔄 Videongiz dumaloq qilib tayyorlanmoqda... Iltimos kuting (1-2 daqiqa vaqt olishi mumkin).")
-    # Using local temp folder to avoid /tmp permission issues
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    input_path = os.path.join(temp_dir, f"{uuid.uuid4()}.mp4")
-    output_path = os.path.join(temp_dir, f"{uuid.uuid4()}_note.mp4")
-    
+    await submit_job("videonote", message.bot, message.chat.id, msg.message_id, {
+        "file_id": file_obj.file_id, "source": file_obj.file_unique_id,
+    })
+
+
+async def run_job(ctx: JobContext, payload: dict):
+    """Media job (services/media_jobs.py): crop to a 640px square and send as a video note."""
+    input_path = ctx.path("input.mp4")
+    output_path = ctx.path("note.mp4")
+
     try:
-        try:
-            import imageio_ffmpeg
-            ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-        except ImportError:
-            import shutil
-            ffmpeg_exe = shutil.which("ffmpeg")
-            
+        ffmpeg_exe = ffmpeg_path()
+
         if not ffmpeg_exe:
             raise RuntimeError("ffmpeg dasturi serverda o'rnatilmagan (yoki topilmadi).")
-            
-        # Download the file from Telegram
-        await message.bot.download(file_obj, destination=input_path)
-        
-        # FFmpeg command to crop exactly 1:1, max 640x640, duration max 60s
-        # Telegram expects video notes to be square and max 1 minute length
-        cmd = [
-            ffmpeg_exe, "-y", "-i", input_path,
-            "-t", "60", # enforce 60s max length
-            "-vf", "crop='min(iw,ih)':'min(iw,ih)',scale=640:640",
-            "-c:v", "libx264", "-crf", "26", "-preset", "veryfast",
-            "-c:a", "aac", "-b:a", "128k",
-            output_path
-        ]
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+
+        if payload.get("upload"):
+            # Mini App upload (api/routers/tools_api.py), already on this machine
+            os.replace(payload["upload"], input_path)
+        else:
+            # Download the file from Telegram
+            await ctx.edit("📥 Video yuklab olinmoqda...")
+            await ctx.bot.download(payload["file_id"], destination=input_path)
+
+        # Square 1:1, max 640x640, max 60s — remuxed, cropped or transcoded
+        # depending on what the input already is (services/video_note.py)
+        await ctx.edit("⚙️ Video dumaloq qilinmoqda...")
+        _, result = await video_note.convert(
+            input_path, output_path, ctx=ctx, progress_text="⚙️ Video dumaloq qilinmoqda: {percent}%",
         )
-        await process.communicate()
-        
-        if process.returncode != 0:
-            await msg.edit_text("❌ Videoni qayta ishlashda xatolik yuz berdi. Iltimos, boshqa fayl yuborib ko'ring (yoki hajmi juda katta bo'lishi mumkin).")
+
+        if not result.ok:
+            await ctx.fail("❌ Videoni qayta ishlashda xatolik yuz berdi. Iltimos, boshqa fayl yuborib ko'ring (yoki hajmi juda katta bo'lishi mumkin).")
             return
 
         # Send the file back to the user
-        video_note = FSInputFile(output_path)
-        await message.answer_video_note(video_note)
-        await msg.delete()
-        
+        await ctx.edit("📤 Yuborilmoqda...")
+        sent = await ctx.bot.send_video_note(ctx.chat_id, FSInputFile(output_path))
+        await media_cache.store("videonote", payload.get("source"), None, sent, "video_note",
+                                input_size=os.path.getsize(input_path))
+        await ctx.delete_status()
+
     except Exception as e:
-        import traceback
-        err = traceback.format_exc()
         if "VOICE_MESSAGES_FORBIDDEN" in str(e):
-            tutorial_text = (
-                "❌ <b>Yuborib bo'lmadi!</b>\n\n"
-                "Sizning Telegram akkauntingizda botlardan <b>Ovozli va Video xabarlar</b> qabul qilish bloklangan ekan.\n\n"
-                "⚙️ <b>Buni qanday to'g'rilash mumkin?</b>\n"
-                "1. Telegram sozlamalariga (Settings) kiring.\n"
-                "2. Maxfiylik va Xavfsizlik (Privacy and Security) bo'limini tanlang.\n"
-                "3. <b>Voice Messages</b> (Ovozli xabarlar) qatorini bosing.\n"
-                "4. Pastdagi <i>Always Allow</i> (Doim ruxsat beriladiganlar) ro'yxatiga ushbu botni qo'shing yoki 'Everyone' ni belgilang.\n\n"
-                "Shundan so'ng bot bemalol sizga dumaloq video yubora oladi!"
-            )
-            await msg.edit_text(tutorial_text, parse_mode="HTML")
+            await ctx.fail(VOICE_FORBIDDEN_TEXT, parse_mode="HTML")
         else:
-            await msg.edit_text(f"❌ Kutilmagan server xatoligi yuz berdi:\n<pre>{str(e)[:500]}</pre>", parse_mode="HTML")
+            await ctx.fail(f"❌ Kutilmagan server xatoligi yuz berdi:\n<pre>{str(e)[:500]}</pre>", parse_mode="HTML")
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        if payload.get("upload") and os.path.exists(payload["upload"]):
+            os.remove(payload["upload"])  # failed before it was moved into the job dir
 
 
 @router.message(VideoNoteFSM.waiting_for_video, F.text)
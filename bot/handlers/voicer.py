@@ -1,6 +1,5 @@
 """Text-to-Speech Voicer AI using edge-tts."""
 import os
-import uuid
 import logging
 import asyncio
 from aiogram import Router, F
@@ -8,10 +7,13 @@ from aiogram.types import Message, FSInputFile, InlineKeyboardMarkup, InlineKeyb
 from aiogram.fsm.context import FSMContext
 from bot.fsm.states import AIVoicerFSM
 from bot.locales import uz
+from services import media_cache, scratch
 
 router = Router(name="voicer")
 logger = logging.getLogger("voicer")
 
+SCRATCH_WAIT = 15  # seconds the handler waits for scratch space before answering "busy"
+
 
 VOICES = {
     "uz-UZ-MadinaNeural": "🇺🇿 O'zbek (Ayol - Madina)",
@@ -87,14 +89,24 @@ async def process_voice_selection(callback: CallbackQuery, state: FSMContext):
         return
         
     await state.clear()
+
+    # Same text + voice synthesized before → resend the cached voice message
+    source, options = media_cache.text_source(text), {"voice": voice_idx}
+    if await media_cache.try_cached(callback.bot, callback.message.chat.id, "voicer", source, options):
+        try:
+            await callback.message.delete()
+        except Exception:
+            pass
+        return
+
     await callback.message.edit_text("⏳ Matn ovozga aylantirilmoqda, iltimos kuting...")
     
-    temp_dir = os.path.join(os.getcwd(), "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    uid = str(uuid.uuid4())[:8]
-    output_path = os.path.join(temp_dir, f"{uid}_voice.mp3")
-    
+    job_dir = None
     try:
+        # a few hundred KB of MP3, tmpfs when available; an update handler waits briefly at most
+        job_dir = await scratch.acquire("voicer", expected=5 * scratch.MB, timeout=SCRATCH_WAIT)
+        output_path = job_dir.path("voice.mp3")
+
         # Run edge_tts
         success, error_msg = await _generate_tts(text, voice_idx, output_path)
         
@@ -103,9 +115,17 @@ async def process_voice_selection(callback: CallbackQuery, state: FSMContext):
             return
             
         audio_file = FSInputFile(output_path)
-        await callback.message.answer_voice(voice=audio_file, caption=f"🗣 {VOICES.get(voice_idx, 'Ovoz')}")
+        caption = f"🗣 {VOICES.get(voice_idx, 'Ovoz')}"
+        sent = await callback.message.answer_voice(voice=audio_file, caption=caption)
+        await media_cache.store("voicer", source, options, sent, "voice", caption=caption)
         await callback.message.delete()
         
+    except scratch.ScratchFull as e:
+        logger.warning(f"Voicer: no scratch space: {e}")
+        try:
+            await callback.message.edit_text("⚠️ Server hozir band. Iltimos, birozdan so'ng qayta urinib ko'ring.")
+        except Exception:
+            pass
     except Exception as e:
         logger.error(f"Voicer process error: {e}")
         try:
@@ -113,11 +133,8 @@ async def process_voice_selection(callback: CallbackQuery, state: FSMContext):
         except Exception:
             pass
     finally:
-        try:
-            if os.path.exists(output_path):
-                os.remove(output_path)
-        except Exception:
-            pass
+        if job_dir:
+            job_dir.release()
 
 
 async def _generate_tts(text: str, voice: str, output_path: str) -> tuple[bool, str]:
@@ -11,11 +11,11 @@ import asyncio
 import logging
 
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
+from aiogram import Dispatcher
 from aiogram.enums import ParseMode
 
 from bot.config import settings
+from bot.utils.bot_registry import close_bots, get_bot
 
 # Logging
 logging.basicConfig(
@@ -65,21 +65,16 @@ async def main():
         logger.warning("Webhook olib tashlanmoqda va Polling rejimiga o'tilmoqda!")
         logger.warning("Production (Railway) serverida api/main.py ishlatilishi shart.")
         logger.warning("=========================================================")
-        temp_bot = Bot(token=settings.BOT_TOKEN)
-        await temp_bot.delete_webhook()
-        await temp_bot.session.close()
+        await get_bot().delete_webhook()
 
     storage = await make_storage()
 
     # Bot & Dispatcher
-    bot = Bot(
-        token=settings.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
+    bot = get_bot(parse_mode=ParseMode.HTML)
     dp = Dispatcher(storage=storage)
 
     # Register routers
-    from bot.handlers import registration, segmentation, lead_magnet, funnel, subscription, referral, admin, moderation, menu, lifecycle, jobs, hr_interview, wallet, videonote, mediadown, fileconvert, bg_remover, scanner, voicer, compressor, superapp, tripwire, application
+    from bot.handlers import registration, segmentation, lead_magnet, funnel, subscription, referral, admin, moderation, menu, lifecycle, jobs, hr_interview, wallet, videonote, mediadown, fileconvert, bg_remover, scanner, voicer, compressor, media_jobs, superapp, tripwire, application
     dp.include_routers(
         lifecycle.router,    # Bot block/unblock tracking — must be first
         registration.router,
@@ -102,6 +97,7 @@ async def main():
         scanner.router,      # Document scanner
         voicer.router,       # Text to speech (free edge-tts)
         compressor.router,   # File size compressor
+        media_jobs.router,   # ❌ cancel on queued/running media jobs
         moderation.router,   # Auto-moderation for groups
         menu.router,         # Must be last — catches menu button text
     )
@@ -111,7 +107,7 @@ async def main():
         logger.info("🤖 Bot polling rejimida ishga tushdi!")
         await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
-        await bot.session.close()
+        await close_bots()
         logger.info("Bot to'xtatildi.")
 
 
@@ -0,0 +1,156 @@
+"""Process-wide Bot registry — one pooled, keep-alive HTTP session per process.
+
+Code outside a handler (task queue, crons, API routers, broadcasts) used
+to build `Bot(token=settings.BOT_TOKEN)` per message and close it after,
+paying a fresh TCP+TLS handshake to api.telegram.org every time. Use
+
+    from bot.utils.bot_registry import get_bot
+    await get_bot().send_message(...)
+
+instead, and don't close it: every Bot handed out shares one aiohttp
+connector (BOT_HTTP_POOL_SIZE connections, idle ones kept for
+BOT_HTTP_KEEPALIVE seconds). `close_bots()` runs once at shutdown.
+`session.close()` on a registry bot is a no-op, so leftover
+`finally: await bot.session.close()` blocks can't tear the pool down.
+
+`stats()` reports requests, errors, latency per API method and how
+many requests reused a pooled connection vs. opened a new one.
+"""
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Optional
+
+from aiohttp import TCPConnector
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from bot.config import settings
+
+logger = logging.getLogger("bot_registry")
+
+LATENCY_SAMPLES = 2000  # recent request latencies kept for percentiles
+
+
+class _Metrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.connections_opened = 0
+        self.connections_acquired = 0
+        self.by_method: dict[str, list] = defaultdict(lambda: [0, 0.0, 0.0])  # count, total_s, max_s
+        self.latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+
+    def observe(self, method: str, seconds: float, ok: bool):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        m = self.by_method[method]
+        m[0] += 1
+        m[1] += seconds
+        m[2] = max(m[2], seconds)
+        self.latencies.append(seconds)
+
+    def snapshot(self) -> dict:
+        lat = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            return round(lat[min(int(len(lat) * p), len(lat) - 1)] * 1000, 1) if lat else 0.0
+
+        reused = max(self.connections_acquired - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections_opened": self.connections_opened,
+            "connections_reused": reused,
+            "reuse_ratio": round(reused / max(self.connections_acquired, 1), 3),
+            "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)},
+            "methods": {
+                name: {"count": c, "avg_ms": round(total / c * 1000, 1), "max_ms": round(mx * 1000, 1)}
+                for name, (c, total, mx) in sorted(self.by_method.items(), key=lambda kv: -kv[1][0])
+            },
+        }
+
+
+_metrics = _Metrics()
+
+
+class _CountingConnector(TCPConnector):
+    """TCPConnector that counts new connections vs. every acquisition."""
+
+    async def connect(self, req, traces, timeout):
+        _metrics.connections_acquired += 1
+        return await super().connect(req, traces, timeout)
+
+    async def _create_connection(self, req, traces, timeout):
+        _metrics.connections_opened += 1
+        return await super()._create_connection(req, traces, timeout)
+
+
+class PooledSession(AiohttpSession):
+    """AiohttpSession with a sized keep-alive pool, request metrics and a guarded close."""
+
+    def __init__(self, pool_size: int, keepalive: float, **kwargs):
+        super().__init__(**kwargs)
+        self._connector_type = _CountingConnector
+        self._connector_init.update(
+            limit=pool_size,
+            keepalive_timeout=keepalive,
+            ttl_dns_cache=3600,
+        )
+
+    async def make_request(self, bot, method, timeout=None):
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            result = await super().make_request(bot, method, timeout)
+            ok = True
+            return result
+        finally:
+            _metrics.observe(method.__api_method__, time.perf_counter() - t0, ok)
+
+    async def close(self):
+        """No-op — the pool lives as long as the process (see shutdown())."""
+
+    async def shutdown(self):
+        await super().close()
+
+
+_session: Optional[PooledSession] = None
+_bots: dict[Optional[str], Bot] = {}
+
+
+def get_session() -> PooledSession:
+    global _session
+    if _session is None:
+        _session = PooledSession(pool_size=settings.BOT_HTTP_POOL_SIZE, keepalive=settings.BOT_HTTP_KEEPALIVE)
+    return _session
+
+
+def get_bot(parse_mode: Optional[str] = None) -> Bot:
+    """The process-wide Bot (per default parse_mode), sharing one pooled session."""
+    bot = _bots.get(parse_mode)
+    if bot is None:
+        default = DefaultBotProperties(parse_mode=parse_mode) if parse_mode else None
+        bot = Bot(token=settings.BOT_TOKEN, session=get_session(), default=default)
+        _bots[parse_mode] = bot
+    return bot
+
+
+async def close_bots():
+    """Close the shared HTTP pool — once, at process shutdown."""
+    global _session
+    if _session is not None:
+        await _session.shutdown()
+        logger.info(f"Bot HTTP pool closed: {stats()}")
+    _session = None
+    _bots.clear()
+
+
+def stats() -> dict:
+    return {
+        "pool_size": settings.BOT_HTTP_POOL_SIZE,
+        "keepalive_s": settings.BOT_HTTP_KEEPALIVE,
+        **_metrics.snapshot(),
+    }
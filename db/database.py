@@ -106,6 +106,9 @@ async def _auto_migrate(engine):
         ("job_vacancies", "posted_at", "TIMESTAMP"),
         ("job_vacancies", "pinned", "BOOLEAN DEFAULT FALSE"),
         ("job_vacancies", "pin_expires_at", "TIMESTAMP"),
+        # Broadcast copy mode (copyMessage fan-out from CONTENT_CHANNEL_ID)
+        ("broadcast_messages", "source_chat_id", "BIGINT"),
+        ("broadcast_messages", "source_message_ids", "JSON"),
     ]
     async with engine.begin() as conn:
         for table, column, col_type in migrations:
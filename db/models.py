@@ -1,7 +1,7 @@
 """SQLAlchemy async models — full PostgreSQL schema."""
 from sqlalchemy import (
-    BigInteger, Boolean, Column, DateTime, Enum, Float,
-    ForeignKey, Index, Integer, JSON, String, Text, UniqueConstraint, func,
+    BigInteger, Boolean, Column, Date, DateTime, Enum, Float,
+    ForeignKey, Index, Integer, JSON, LargeBinary, String, Text, UniqueConstraint, func, text,
 )
 from sqlalchemy.orm import DeclarativeBase, relationship
 
@@ -68,6 +68,11 @@ class User(Base):
         Index("ix_users_lead_segment", "lead_segment"),
         Index("ix_users_campaign", "campaign"),
         Index("ix_users_user_status", "user_status"),
+        # Keyset pagination for the admin users list (sort key + id tiebreak).
+        # pg_trgm GIN indexes on name/username/phone live in migration b1000000005.
+        Index("ix_users_created_at_id", "created_at", "id"),
+        Index("ix_users_lead_score_id", "lead_score", "id"),
+        Index("ix_users_source_created_at_id", "source", text("created_at DESC"), text("id DESC")),
     )
 
 
@@ -139,9 +144,59 @@ class Event(Base):
     __table_args__ = (
         Index("ix_events_event_type", "event_type"),
         Index("ix_events_user_created", "user_id", "created_at"),
+        Index("ix_events_created_at", "created_at"),
     )
 
 
+class UserEventSummary(Base):
+    """Per-user, per-event-type aggregate of `events` — maintained on every
+    AnalyticsService.track() so audience predicates ("has vsl_50 but no
+    payment_open in 7 days") never scan raw events. Survives retention."""
+    __tablename__ = "user_event_summaries"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    event_type = Column(String(50), nullable=False)
+    first_at = Column(DateTime(timezone=True), nullable=False)
+    last_at = Column(DateTime(timezone=True), nullable=False)
+    count = Column(Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "event_type", name="uq_user_event_summary"),
+        Index("ix_user_event_summaries_type_last", "event_type", "last_at"),
+    )
+
+
+class DailyEventRollup(Base):
+    """Per-day counts of event rows removed by the retention job
+    (services/retention.py). `source` is the raw table name; `dimension`
+    carries utm_source for landing events and group_id for warnings."""
+    __tablename__ = "daily_event_rollups"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    source = Column(String(30), nullable=False)       # events | quiz_events | course_landing_events | agency_events | group_warnings
+    day = Column(Date, nullable=False)
+    event_type = Column(String(60), nullable=False)
+    dimension = Column(String(100), nullable=False, default="", server_default="")
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("source", "day", "event_type", "dimension", name="uq_daily_event_rollup_key"),
+        Index("ix_daily_event_rollups_source_type", "source", "event_type"),
+    )
+
+
+class RetentionRun(Base):
+    """One row per retention/compaction run with what it did."""
+    __tablename__ = "retention_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    status = Column(String(20), default="running", nullable=False)  # running | completed | failed
+    report = Column(JSON, nullable=True)      # {"tables": {...}, "partitions": {...}, "duration_s": ...}
+
+
 # ──────────────────────────────────────────────
 # Content — Lead magnets
 # ──────────────────────────────────────────────
@@ -250,6 +305,8 @@ class BroadcastMessage(Base):
     content = Column(Text, nullable=False)
     entities = Column(JSON, nullable=True)   # Telegram message entities for format preservation
     file_id = Column(String(255), nullable=True)
+    source_chat_id = Column(BigInteger, nullable=True)     # copy mode: storage chat holding the posted content
+    source_message_ids = Column(JSON, nullable=True)       # copy mode: message ids to copyMessage(s) from
     sent_count = Column(Integer, default=0)
     failed_count = Column(Integer, default=0)
     total_count = Column(Integer, default=0)
@@ -258,6 +315,25 @@ class BroadcastMessage(Base):
     completed_at = Column(DateTime, nullable=True)
 
 
+class BroadcastDelivery(Base):
+    """Per-recipient outcome of a broadcast — written in bulk by
+    services/broadcast_delivery.DeliveryWriter. One row per (broadcast,
+    recipient); a retry overwrites the row, so re-sends are deduplicated."""
+    __tablename__ = "broadcast_deliveries"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcast_messages.id", ondelete="CASCADE"), nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    status = Column(String(10), nullable=False)          # sent | failed | blocked
+    error_class = Column(String(60), nullable=True)      # exception class name for failures
+    message_id = Column(BigInteger, nullable=True)       # first message id delivered to the user
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("broadcast_id", "telegram_id", name="uq_broadcast_delivery"),
+        Index("ix_broadcast_deliveries_broadcast_status", "broadcast_id", "status"),
+    )
+
 
 # ──────────────────────────────────────────────
 # Admin settings
@@ -505,6 +581,27 @@ class AgencyEvent(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
 
 
+class LandingSessionSketch(Base):
+    """HyperLogLog sketch of distinct session_ids for one landing funnel
+    stage, per UTC day and utm_source. Updated on every beacon so the admin
+    stats endpoints merge a handful of fixed-size sketches instead of
+    running COUNT(DISTINCT session_id) over the raw *_events tables."""
+    __tablename__ = "landing_session_sketches"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    landing = Column(String(20), nullable=False)      # quiz | course | agency
+    event_type = Column(String(60), nullable=False)
+    day = Column(Date, nullable=False)
+    utm_source = Column(String(100), nullable=False, default="", server_default="")  # "" = no utm
+    registers = Column(LargeBinary, nullable=False)   # zlib-compressed HLL registers (services/hll.py)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("landing", "event_type", "day", "utm_source", name="uq_landing_sketch_key"),
+        Index("ix_landing_sketch_landing_day", "landing", "day"),
+    )
+
+
 # ──────────────────────────────────────────────
 # Moderated Groups (Nazoratchi Bot)
 # ──────────────────────────────────────────────
@@ -558,7 +655,7 @@ class GroupWarning(Base):
     user_id = Column(BigInteger, nullable=False, index=True)
     warned_by = Column(BigInteger, nullable=False)
     reason = Column(String(500), nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
 
 
 class CaptchaVerification(Base):
@@ -613,6 +710,11 @@ class DailyReport(Base):
     pre_payments = Column(Integer, default=0)
     end_time = Column(String(50), nullable=True)
 
+    # report_date is the day (midnight) — one row per AmoCRM user per day, upserted nightly
+    __table_args__ = (
+        UniqueConstraint("amocrm_user_id", "report_date", name="uq_daily_report_user_day"),
+    )
+
 
 # ──────────────────────────────────────────────
 # Products / one-time purchases (tripwire, full course)
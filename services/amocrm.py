@@ -1,16 +1,71 @@
+"""AmoCRM API client — one pooled httpx client per process, rate limited.
+
+Every AmoCRMService shares a module-level `httpx.AsyncClient` (keep-alive
+pool of MAX_CONNECTIONS), and every request first takes a slot from a
+process-wide limiter that spaces request starts to RATE_LIMIT per second
+(AmoCRM allows 7 req/s per integration). 429 responses are retried after
+`Retry-After`. List endpoints are read to the end by following
+`_links.next`, PAGE_LIMIT items per page.
+"""
+import asyncio
 import httpx
 import logging
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional
 from bot.config import settings
 
 logger = logging.getLogger("amocrm")
 
+RATE_LIMIT = 7.0        # requests/sec — AmoCRM's per-integration limit
+MAX_CONNECTIONS = 8
+PAGE_LIMIT = 250        # AmoCRM's maximum page size
+MAX_PAGES = 200         # safety stop for a runaway `_links.next` chain
+RETRIES_429 = 3
+
+
+class _RateLimiter:
+    """Spaces request starts 1/rate seconds apart (reservation, no polling)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+_client: Optional[httpx.AsyncClient] = None
+_limiter = _RateLimiter(RATE_LIMIT)
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=15.0,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared pool (process shutdown / one-off scripts)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
 class AmoCRMService:
     def __init__(self):
         self.domain = settings.AMOCRM_DOMAIN
         self.token = settings.AMOCRM_ACCESS_TOKEN
-        self.client = httpx.AsyncClient(timeout=15.0)
+        self.client = _get_client()
 
     def is_configured(self) -> bool:
         return bool(self.domain and self.token)
@@ -21,18 +76,45 @@ class AmoCRMService:
             "Content-Type": "application/json"
         }
 
+    async def _get(self, url: str, params: Optional[dict] = None) -> Optional[dict]:
+        """Rate-limited GET. Returns the JSON body, or None for 204 (no content)."""
+        for attempt in range(RETRIES_429 + 1):
+            await _limiter.wait()
+            res = await self.client.get(url, headers=self._headers(), params=params)
+            if res.status_code == 429 and attempt < RETRIES_429:
+                wait = float(res.headers.get("Retry-After") or 1.0)
+                logger.warning(f"AmoCRM 429 on {url}, retrying in {wait}s")
+                await asyncio.sleep(wait)
+                continue
+            if res.status_code == 204:
+                return None
+            res.raise_for_status()
+            return res.json()
+
+    async def _paginate(self, path: str, embedded: str, params: Optional[dict] = None) -> AsyncGenerator[dict, None]:
+        """Yield every item of a list endpoint, following `_links.next`."""
+        url: Optional[str] = f"https://{self.domain}/api/v4/{path}"
+        params = {**(params or {}), "limit": PAGE_LIMIT}
+        for _ in range(MAX_PAGES):
+            data = await self._get(url, params)
+            if not data:
+                return
+            for item in data.get("_embedded", {}).get(embedded, []):
+                yield item
+            url = data.get("_links", {}).get("next", {}).get("href")
+            if not url:
+                return
+            params = None  # the next href carries the query
+        logger.warning(f"AmoCRM {path}: stopped after {MAX_PAGES} pages")
+
     async def get_users(self) -> List[Dict[str, Any]]:
         """Fetch all users (managers) from amoCRM."""
         if not self.is_configured():
             logger.warning("AmoCRM not configured. Returning empty users.")
             return []
-            
-        url = f"https://{self.domain}/api/v4/users"
+
         try:
-            res = await self.client.get(url, headers=self._headers())
-            res.raise_for_status()
-            data = res.json()
-            return data.get("_embedded", {}).get("users", [])
+            return [u async for u in self._paginate("users", "users")]
         except Exception as e:
             logger.error(f"Failed to fetch amocrm users: {e}")
             return []
@@ -50,24 +132,15 @@ class AmoCRMService:
         # amoCRM actually stores calls under /api/v4/calls but it depends on the telephony widget.
         # As a robust fallback, we query events typed as call_in / call_out if needed, or just let users log it.
         # This is a stub implementation until specific amoCRM structure is known.
-        url = f"https://{self.domain}/api/v4/events"
         params = {
             "filter[created_at][from]": timestamp_start,
             "filter[created_at][to]": timestamp_end,
             "filter[created_by]": user_id,
-            "limit": 100
         }
         try:
-            res = await self.client.get(url, headers=self._headers(), params=params)
-            if res.status_code == 204:
-                return {"total_calls": 0, "duration": 0, "answered": 0, "missed": 0}
-            res.raise_for_status()
-            data = res.json()
-            events = data.get("_embedded", {}).get("events", [])
-            
             # Placeholder: amoCRM call events differ by telephony.
             # Usually events with type 'outgoing_call' or 'incoming_call'.
-            calls = [e for e in events if "call" in e.get("type", "")]
+            calls = [e async for e in self._paginate("events", "events", params) if "call" in e.get("type", "")]
             return {
                 "total_calls": len(calls),
                 "duration": sum(120 for _ in calls), # Example mock 2 mins per call
@@ -85,29 +158,24 @@ class AmoCRMService:
         if not self.is_configured():
             return {"won": 0, "pre_payments": 0, "total_leads": 0}
 
-        url = f"https://{self.domain}/api/v4/leads"
         # We can filter leads created by user, but usually it's 'responsible_user_id'
         params = {
             "filter[updated_at][from]": timestamp_start,
             "filter[updated_at][to]": timestamp_end,
             "filter[responsible_user_id]": user_id,
-            "limit": 50
         }
         try:
-            res = await self.client.get(url, headers=self._headers(), params=params)
-            if res.status_code == 204:
-                return {"won": 0, "pre_payments": 0, "total_leads": 0}
-            res.raise_for_status()
-            data = res.json()
-            leads = data.get("_embedded", {}).get("leads", [])
-            
-            # Status IDs are pipeline-specific. We use mock aggregation here.
-            # Muvaffaqiyatli sotildi (success = 142) is generic AMO ID for success, 143 for loss.
-            won_leads = [l for l in leads if l.get("status_id") == 142]
-            
+            total = won = 0
+            async for lead in self._paginate("leads", "leads", params):
+                total += 1
+                # Status IDs are pipeline-specific. We use mock aggregation here.
+                # Muvaffaqiyatli sotildi (success = 142) is generic AMO ID for success, 143 for loss.
+                if lead.get("status_id") == 142:
+                    won += 1
+
             return {
-                "total_leads": len(leads),
-                "won": len(won_leads),
+                "total_leads": total,
+                "won": won,
                 "pre_payments": 0 # Requires custom fields analysis
             }
         except Exception as e:
@@ -115,4 +183,4 @@ class AmoCRMService:
             return {"won": 0, "pre_payments": 0, "total_leads": 0}
 
     async def close(self):
-        await self.client.aclose()
+        """Kept for callers; the pool is shared and outlives a service instance."""
@@ -1,11 +1,12 @@
 """Analytics service — centralized event tracking."""
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
 from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import Event, User
+from db.models import Event, User, UserEventSummary
 
 
 # Event type constants
@@ -44,6 +45,18 @@ class AnalyticsService:
         )
         self.session.add(event)
         await self.session.flush()
+        await self._bump_summary(user_id, event_type)
+
+    async def _bump_summary(self, user_id: int, event_type: str):
+        """Fold one event into user_event_summaries (same transaction as the event)."""
+        now = datetime.now(timezone.utc)
+        stmt = pg_insert(UserEventSummary).values(
+            user_id=user_id, event_type=event_type, first_at=now, last_at=now, count=1,
+        )
+        await self.session.execute(stmt.on_conflict_do_update(
+            constraint="uq_user_event_summary",
+            set_={"last_at": stmt.excluded.last_at, "count": UserEventSummary.count + 1},
+        ))
 
     async def has_event(self, user_id: int, event_type: str) -> bool:
         """Check if a user has a specific event."""
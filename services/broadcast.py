@@ -1,12 +1,19 @@
-"""Broadcast service — filtered mass messaging with Semaphore-based full pipelining.
+"""Broadcast service — filtered mass messaging in rate-paced concurrent chunks.
 
 Architecture:
-  - Users are fetched in batches of BATCH_SIZE (memory-efficient streaming)
-  - Each user gets its own asyncio.Task — no one waits for anyone else
-  - asyncio.Semaphore(CONCURRENCY) enforces Telegram's 30 msg/sec limit
-  - 429 RetryAfter is handled per-user (only that task sleeps & retries)
-  - Blocked users (Forbidden/deactivated) are batched and flushed to DB
-  - Progress is saved every PROGRESS_SAVE_EVERY messages via a separate session
+  - Recipients are resolved once as a bitmap from the segment index
+    (services/segments.py); telegram_ids are looked up BATCH_SIZE at a time
+  - CHUNK_SIZE users are sent concurrently per round; rounds are paced to
+    SEND_RATE msg/sec (just under Telegram's 30/sec) by sleeping between
+    chunks
+  - 429 RetryAfter is handled per-user (only that send sleeps & retries)
+  - Every outcome goes to broadcast_deliveries via a buffered bulk writer
+    (services/broadcast_delivery.py), which also marks blocked users inactive
+  - Progress is sampled by one background _ProgressReporter: DB write at most
+    every PROGRESS_DB_INTERVAL s, admin ping every PROGRESS_NOTIFY_INTERVAL s
+  - With BROADCAST_SHARDS > 1 the send runs in worker processes, one users.id
+    range each, paced by a token bucket shared through Redis
+    (services/broadcast_shards.py)
 
 Performance:
   - Theoretical: 28 msg/sec sustained → 20,000 users in ~12 min (single token limit)
@@ -15,21 +22,27 @@ Performance:
 """
 import asyncio
 import logging
+from functools import partial
 from datetime import datetime, timezone
 from typing import Optional, AsyncGenerator
 
-from sqlalchemy import select, update, func
+from sqlalchemy import exists, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import BroadcastMessage, User, Subscription
+from db.models import BroadcastDelivery, BroadcastMessage, User
+from services.broadcast_delivery import (
+    STATUS_BLOCKED, STATUS_FAILED, STATUS_SENT, DeliveryWriter, count_failed, iter_failed_recipients, recount,
+)
 from services.crm import CRMService
+from services.segments import SEGMENT_INDEX_SEND_TTL, get_index, iter_bits, range_mask, split_bits
 
 logger = logging.getLogger("broadcast")
 
 BATCH_SIZE          = 500   # Users loaded per DB query
-PROGRESS_SAVE_EVERY = 200   # Save sent/failed counts every N messages
-CONCURRENCY         = 200   # Semaphore — high value, rate limiter is the real throttle
+PROGRESS_DB_INTERVAL     = 3.0   # seconds between progress writes (only if counters moved)
+PROGRESS_NOTIFY_INTERVAL = 30.0  # seconds between admin progress pings
 SEND_RATE           = 29.0  # Token bucket: msgs/sec (just under Telegram's 30/sec limit)
+CHUNK_SIZE          = 25    # users sent concurrently per round in send_broadcast
 
 
 class BroadcastService:
@@ -66,26 +79,14 @@ class BroadcastService:
         return result.scalar_one_or_none()
 
     async def count_recipients(self, broadcast: BroadcastMessage) -> int:
-        """Count active recipients without loading them into memory."""
-        filters = broadcast.filters or {}
-        q = select(func.count()).select_from(User).where(User.is_active.isnot(False))
-        if filters.get("source"):
-            q = q.where(User.source == filters["source"])
-        if filters.get("user_status"):
-            q = q.where(User.user_status == filters["user_status"])
-        if filters.get("lead_segment"):
-            q = q.where(User.lead_segment == filters["lead_segment"])
-        if filters.get("lead_score_min"):
-            q = q.where(User.lead_score >= filters["lead_score_min"])
-        if filters.get("paid"):
-            active_sub_sq = (
-                select(Subscription.user_id)
-                .where(Subscription.status == "active")
-                .scalar_subquery()
-            )
-            q = q.where(User.id.in_(active_sub_sq))
-        result = await self.session.execute(q)
-        return result.scalar() or 0
+        """Count active recipients from the segment bitmap index (no DB scan)."""
+        index = await get_index()
+        return index.count(_recipient_spec(broadcast.filters))
+
+    async def resolve_recipients(self, broadcast: BroadcastMessage) -> int:
+        """Bitmap of recipient user ids, from an index at most SEGMENT_INDEX_SEND_TTL old."""
+        index = await get_index(max_age=SEGMENT_INDEX_SEND_TTL)
+        return index.evaluate(_recipient_spec(broadcast.filters))
 
     # Kept for backward-compat (admin.py preview count)
     async def get_recipients(self, broadcast: BroadcastMessage) -> list:
@@ -103,11 +104,23 @@ class BroadcastService:
                 break
         return all_users
 
-    async def mark_sending(self, broadcast_id: int, total: int):
+    async def set_copy_source(self, broadcast_id: int, chat_id: int, message_ids: list[int]):
+        """Remember the storage-chat copy so retries/resumes fan out from it too."""
+        await self.session.execute(
+            update(BroadcastMessage)
+            .where(BroadcastMessage.id == broadcast_id)
+            .values(source_chat_id=chat_id, source_message_ids=message_ids)
+        )
+
+    async def mark_sending(self, broadcast_id: int, total: Optional[int] = None):
+        """`total=None` (retry runs) keeps the original recipient count."""
+        values = {"status": "sending"}
+        if total is not None:
+            values["total_count"] = total
         await self.session.execute(
             update(BroadcastMessage)
             .where(BroadcastMessage.id == broadcast_id)
-            .values(status="sending", total_count=total)
+            .values(**values)
         )
 
     async def update_progress(self, broadcast_id: int, sent: int, failed: int):
@@ -117,6 +130,17 @@ class BroadcastService:
             .values(sent_count=sent, failed_count=failed)
         )
 
+    async def add_progress(self, broadcast_id: int, sent: int, failed: int):
+        """Increment the counters — for shards, which each only know their own share."""
+        await self.session.execute(
+            update(BroadcastMessage)
+            .where(BroadcastMessage.id == broadcast_id)
+            .values(
+                sent_count=BroadcastMessage.sent_count + sent,
+                failed_count=BroadcastMessage.failed_count + failed,
+            )
+        )
+
     async def mark_completed(self, broadcast_id: int):
         await self.session.execute(
             update(BroadcastMessage)
@@ -162,29 +186,195 @@ class _TokenBucket:
 
 # ── Streaming recipient IDs (cursor-based) ────────────────────────────────────
 
-async def _iter_recipient_ids(filters: dict) -> AsyncGenerator:
+def _recipient_spec(filters: Optional[dict]) -> dict:
+    """Broadcast filters + the implicit 'still reachable' condition."""
+    return {"and": [filters or {}], "is_active": True}
+
+
+async def _iter_recipient_ids(
+    recipients: int,
+    with_profile: bool = False,
+    skip_sent_for: Optional[int] = None,
+) -> AsyncGenerator:
     """
-    Async generator: yields telegram_id ints using cursor-based pagination.
-    Each batch uses WHERE id > last_id ORDER BY id — hits PK index, O(1) regardless
-    of table size. Much faster than OFFSET for large tables (20k+ rows).
+    Async generator: yields (telegram_id, profile) for the user ids set in
+    the `recipients` bitmap, BATCH_SIZE ids per primary-key lookup. The
+    lookup re-checks is_active so users blocked since the index snapshot are
+    skipped. With `with_profile`, the personalization fields come back in
+    the same query; otherwise profile is None. With `skip_sent_for`, users
+    already delivered to by that broadcast (a resumed run) are skipped.
     """
     from db.database import async_session
-    last_id = 0
-    while True:
+    from services.broadcast_template import profile_values
+
+    columns = [User.telegram_id, User.name, User.username] if with_profile else [User.telegram_id]
+    conditions = [User.is_active.isnot(False)]
+    if skip_sent_for is not None:
+        conditions.append(~exists().where(
+            BroadcastDelivery.broadcast_id == skip_sent_for,
+            BroadcastDelivery.telegram_id == User.telegram_id,
+            BroadcastDelivery.status == STATUS_SENT,
+        ))
+    batch: list[int] = []
+
+    async def _lookup(ids: list[int]) -> list:
         async with async_session() as session:
-            crm = CRMService(session)
-            rows = await crm.get_user_ids_cursor(filters, limit=BATCH_SIZE, min_id=last_id)
-            if not rows:
-                return
-            last_id = rows[-1][0]  # Row.id (first column)
-            tids = [row[1] for row in rows if row[1]]  # Row.telegram_id
-            count = len(rows)
+            rows = await session.execute(
+                select(*columns)
+                .where(User.id.in_(ids), *conditions)
+                .order_by(User.id)
+            )
+            if with_profile:
+                return [(r[0], profile_values(r[1], r[2])) for r in rows.all() if r[0]]
+            return [(tid, None) for tid in rows.scalars().all() if tid]
+
+    for uid in iter_bits(recipients):
+        batch.append(uid)
+        if len(batch) >= BATCH_SIZE:
+            for item in await _lookup(batch):
+                yield item
+            batch = []
+    if batch:
+        for item in await _lookup(batch):
+            yield item
+
+
+class _ProgressReporter:
+    """Samples the send loop's counters on a timer, off the hot path.
+
+    One background task replaces the per-chunk session+commit and the
+    inline admin pings: the DB is written at most every `db_interval`
+    seconds (skipped when nothing moved), the admin is pinged every
+    `notify_interval` seconds. `stats` records what it cost.
+
+    `incremental` writes the change since the last write instead of the
+    totals, so several shards can report into the same broadcast row.
+    """
 
-        for tid in tids:
-            yield tid
+    def __init__(
+        self,
+        broadcast_id: int,
+        total: int,
+        counters,
+        notify=None,
+        write_db: bool = True,
+        incremental: bool = False,
+        db_interval: Optional[float] = None,
+        notify_interval: Optional[float] = None,
+    ):
+        self.broadcast_id = broadcast_id
+        self.total = total
+        self.counters = counters          # () -> (sent, failed)
+        self.notify = notify              # async (text) -> None
+        self.write_db = write_db
+        self.incremental = incremental
+        self.db_interval = db_interval or PROGRESS_DB_INTERVAL
+        self.notify_interval = notify_interval or PROGRESS_NOTIFY_INTERVAL
+        self._task: Optional[asyncio.Task] = None
+        self._written = (0, 0)
+        self._last_notify = 0.0
+        self.stats = {"ticks": 0, "db_writes": 0, "notifications": 0, "busy_s": 0.0}
+
+    def start(self):
+        self._last_notify = asyncio.get_running_loop().time()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.stats["busy_s"] = round(self.stats["busy_s"], 4)
 
-        if count < BATCH_SIZE:
+    async def write(self):
+        """Persist the counters if they moved since the last write."""
+        sent, failed = self.counters()
+        if (sent, failed) == self._written:
             return
+        try:
+            from db.database import async_session
+            async with async_session() as _s:
+                svc = BroadcastService(_s)
+                if self.incremental:
+                    await svc.add_progress(self.broadcast_id, sent - self._written[0], failed - self._written[1])
+                else:
+                    await svc.update_progress(self.broadcast_id, sent, failed)
+                await _s.commit()
+            self._written = (sent, failed)
+            self.stats["db_writes"] += 1
+        except Exception as e:
+            logger.warning(f"[Broadcast {self.broadcast_id}] Progress write failed: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.db_interval)
+            t0 = loop.time()
+            self.stats["ticks"] += 1
+            sent, failed = self.counters()
+            if self.write_db:
+                await self.write()
+            if self.notify and t0 - self._last_notify >= self.notify_interval:
+                self._last_notify = t0
+                processed = sent + failed
+                pct = round(processed / max(self.total, 1) * 100)
+                await self.notify(
+                    f"📊 <b>Broadcast #{self.broadcast_id}</b>\n"
+                    f"✅ {sent:,} / ❌ {failed:,}\n"
+                    f"📈 {processed:,}/{self.total:,} ({pct}%)"
+                )
+                self.stats["notifications"] += 1
+            self.stats["busy_s"] += loop.time() - t0
+
+
+def _final_text(broadcast_id: int, sent: int, failed: int) -> str:
+    processed = sent + failed
+    return (
+        f"✅ <b>Broadcast #{broadcast_id} yakunlandi!</b>\n\n"
+        f"✅ Muvaffaqiyatli: <b>{sent:,}</b>\n"
+        f"❌ Yetkazilmadi: <b>{failed:,}</b>\n"
+        f"👥 Jami: <b>{processed:,}</b>\n"
+        f"📈 Natija: <b>{round(sent / max(processed, 1) * 100)}%</b>"
+    )
+
+
+async def _send_final(bot, broadcast_id: int, sent: int, failed: int, progress_chat_id, progress_message_id):
+    """Final summary to the admin: edit the progress message (if any) and send a fresh one."""
+    if not progress_chat_id:
+        return
+    final_text = _final_text(broadcast_id, sent, failed)
+    if progress_message_id:
+        try:
+            await bot.edit_message_text(
+                chat_id=progress_chat_id,
+                message_id=progress_message_id,
+                text=final_text,
+                parse_mode="HTML",
+            )
+        except Exception:
+            pass
+    try:
+        await bot.send_message(chat_id=progress_chat_id, text=final_text, parse_mode="HTML")
+    except Exception:
+        pass
+
+
+async def _finish_shard(bot, broadcast_id: int, id_range: tuple, progress_chat_id, progress_message_id):
+    """Count one shard done; the last one recounts, completes and reports the broadcast."""
+    from db.database import async_session
+    from services.broadcast_shards import shard_done
+
+    # a shard is identified by where its range starts
+    if not await shard_done(broadcast_id, id_range[0]):
+        return
+    async with async_session() as _s:
+        sent, failed = await recount(_s, broadcast_id)
+        await BroadcastService(_s).mark_completed(broadcast_id)
+        await _s.commit()
+    logger.info(f"[Broadcast {broadcast_id}] All shards DONE. sent={sent} failed={failed}")
+    await _send_final(bot, broadcast_id, sent, failed, progress_chat_id, progress_message_id)
 
 
 # ── Main broadcast function ───────────────────────────────────────────────────
@@ -194,26 +384,35 @@ async def send_broadcast(
     bot_instance=None,
     progress_chat_id: Optional[int] = None,
     progress_message_id: Optional[int] = None,
+    retry_failed: bool = False,
+    id_range: Optional[tuple[int, Optional[int]]] = None,
 ):
     """
     Chunked broadcast: sends CHUNK_SIZE users concurrently, waits, repeats.
 
     Design:
     - CHUNK_SIZE users are gathered concurrently per round
-    - After each chunk, sleep(CHUNK_SLEEP) to keep rate ≈ 29 msg/sec
+    - Pacing ≈ SEND_RATE msg/sec: a single sender sleeps CHUNK_SLEEP after
+      each chunk; shards take tokens from the shared Redis bucket instead
     - 429 RetryAfter handled per-user (only that slot retries)
-    - Admin gets Telegram progress ping every 500 sends
+    - Progress comes from _ProgressReporter: coalesced, time-based DB writes
+      and an admin ping every PROGRESS_NOTIFY_INTERVAL s (not per shard)
     - Admin always gets final result (success or error)
+
+    Sharding (BROADCAST_SHARDS > 1, fresh sends only): this call resolves the
+    recipients, prepares the copy source and enqueues one job per users.id
+    range, then returns. Workers call back in with `id_range` set; they send
+    only that range, pace against the shared Redis bucket and write progress
+    as increments. The last shard to finish completes the broadcast.
     """
     import traceback as _tb
     from db.database import async_session
     from bot.config import settings
-    from aiogram import Bot
+    from bot.utils.bot_registry import get_bot
 
     # CHUNK_SIZE × (1/SEND_RATE) ≈ sleep_time keeps throughput at SEND_RATE msg/sec
-    CHUNK_SIZE  = 25           # users sent concurrently per round
+    # (module-level so benchmarks/broadcast_bench.py can tune them)
     CHUNK_SLEEP = CHUNK_SIZE / SEND_RATE  # ≈ 0.86s per chunk → 29 msg/sec
-    NOTIFY_EVERY = 500         # admin ping every N completed sends
 
     logger.info(f"[Broadcast {broadcast_id}] Starting...")
 
@@ -237,13 +436,38 @@ async def send_broadcast(
         c_type  = broadcast.content_type
         file_id = broadcast.file_id
         content = broadcast.content or ""
-        filters = dict(broadcast.filters or {})
         stored_entities_json = broadcast.entities
+        source_chat_id = broadcast.source_chat_id
+        source_message_ids = list(broadcast.source_message_ids or [])
+
+        if retry_failed:
+            recipients = 0
+            total = await count_failed(session, broadcast_id)
+        else:
+            recipients = await service.resolve_recipients(broadcast)
+            if id_range:
+                recipients &= range_mask(*id_range)
+            total = recipients.bit_count()
+        logger.info(
+            f"[Broadcast {broadcast_id}] {total} recipients"
+            f"{' (retrying failures)' if retry_failed else ''}"
+            f"{f' in ids {list(id_range)}' if id_range else ''}."
+        )
 
-        total = await service.count_recipients(broadcast)
-        logger.info(f"[Broadcast {broadcast_id}] {total} recipients.")
+        if total == 0 and retry_failed:
+            # Nothing failed — the broadcast already finished, leave it as it is
+            if progress_chat_id and bot_instance:
+                try:
+                    await bot_instance.send_message(
+                        chat_id=progress_chat_id,
+                        text=f"ℹ️ <b>Broadcast #{broadcast_id}</b>: qayta yuboriladigan xato qabul qiluvchi yo'q.",
+                        parse_mode="HTML",
+                    )
+                except Exception:
+                    pass
+            return
 
-        if total == 0:
+        if total == 0 and not id_range:
             await service.mark_completed(broadcast_id)
             await session.commit()
             if progress_chat_id and bot_instance:
@@ -257,12 +481,18 @@ async def send_broadcast(
                     pass
             return
 
-        await service.mark_sending(broadcast_id, total)
-        await session.commit()
+        if not id_range:  # shards: the coordinator already marked it sending
+            # a retry keeps total_count: it is the broadcast's audience, not this run's
+            await service.mark_sending(broadcast_id, None if retry_failed else total)
+            await session.commit()
 
     # ── Phase 2: prepare bot & content ────────────────────────────────────
-    _own_bot = bot_instance is None
-    bot = bot_instance or Bot(token=settings.BOT_TOKEN)
+    bot = bot_instance or get_bot()
+
+    if id_range and total == 0:
+        # Nothing left in this range — still counts towards completion.
+        await _finish_shard(bot, broadcast_id, id_range, progress_chat_id, progress_message_id)
+        return {"sent": 0, "failed": 0}
 
     send_entities = None
     if stored_entities_json:
@@ -274,39 +504,89 @@ async def send_broadcast(
 
     is_media     = c_type in ("photo", "video", "document", "audio", "voice") and file_id
     use_entities = bool(send_entities)
-    ent_kw = {"entities": send_entities} if use_entities and not is_media else {}
-    cap_kw = {"caption_entities": send_entities} if use_entities and is_media else {}
+
+    # Parsed once; per-recipient render only joins strings and shifts entity offsets
+    from services.broadcast_template import compile_template
+    template = compile_template(content, send_entities)
+    personalized = template.is_dynamic
     CAPTION_LIMIT = 1024
     TEXT_LIMIT    = 4096
 
     # ── Phase 3: per-user send helper ─────────────────────────────────────
-    async def _send_one(tid: int) -> tuple[bool, bool]:
-        """Returns (ok, blocked). Handles 429 + HTML parse retry."""
+    async def _deliver(chat_id: int, content: str, entities, pm) -> list[int]:
+        """Send the content by type to one chat. Returns the sent message ids."""
+        ent_kw = {"entities": entities} if use_entities and not is_media else {}
+        cap_kw = {"caption_entities": entities} if use_entities and is_media else {}
+        _pm = {} if use_entities else ({"parse_mode": pm} if pm else {})
+        msgs = []
+        if is_media:
+            cap = content[:CAPTION_LIMIT] if content else ""
+            overflow = content[CAPTION_LIMIT:] if content and len(content) > CAPTION_LIMIT else ""
+            if c_type == "photo":
+                msgs.append(await bot.send_photo(chat_id, photo=file_id, caption=cap or None, **cap_kw, **_pm))
+            elif c_type == "video":
+                msgs.append(await bot.send_video(chat_id, video=file_id, caption=cap or None, **cap_kw, **_pm))
+            elif c_type == "document":
+                msgs.append(await bot.send_document(chat_id, document=file_id, caption=cap or None, **cap_kw, **_pm))
+            elif c_type == "audio":
+                msgs.append(await bot.send_audio(chat_id, audio=file_id, caption=cap or None, **cap_kw, **_pm))
+            elif c_type == "voice":
+                msgs.append(await bot.send_voice(chat_id, voice=file_id, caption=cap or None, **cap_kw, **_pm))
+            if overflow:
+                msgs.append(await bot.send_message(chat_id, text=overflow[:TEXT_LIMIT], **_pm))
+        elif c_type == "video_note" and file_id:
+            msgs.append(await bot.send_video_note(chat_id, video_note=file_id))
+        else:
+            chunks = [content[i:i + TEXT_LIMIT] for i in range(0, max(len(content), 1), TEXT_LIMIT)]
+            for ch in chunks:
+                msgs.append(await bot.send_message(chat_id, text=ch, **ent_kw, **_pm))
+        return [m.message_id for m in msgs]
+
+    # ── Copy mode: post once to the storage chat, fan out with copyMessage(s) ──
+    # One request per recipient even for long-caption media / multi-part text,
+    # formatting preserved exactly as stored. Not used for personalized
+    # templates (the copy can't be re-rendered per user).
+    copy_call = None
+    # Shards only reuse the coordinator's copy — they must not each post one.
+    has_source = bool(source_chat_id and source_message_ids)
+    if not personalized and settings.BROADCAST_COPY_MODE and settings.CONTENT_CHANNEL_ID and (has_source or not id_range):
+        try:
+            if not has_source:
+                source_chat_id = settings.CONTENT_CHANNEL_ID
+                try:
+                    source_message_ids = await _deliver(source_chat_id, template.content, send_entities, "HTML")
+                except Exception as e:
+                    if "can't parse entities" not in str(e).lower():
+                        raise
+                    source_message_ids = await _deliver(source_chat_id, template.content, send_entities, None)
+                async with async_session() as _s:
+                    await BroadcastService(_s).set_copy_source(broadcast_id, source_chat_id, source_message_ids)
+                    await _s.commit()
+            if len(source_message_ids) == 1:
+                copy_call = partial(bot.copy_message, from_chat_id=source_chat_id, message_id=source_message_ids[0])
+            else:
+                copy_call = partial(bot.copy_messages, from_chat_id=source_chat_id, message_ids=source_message_ids)
+            logger.info(f"[Broadcast {broadcast_id}] Copy mode from {source_chat_id}: messages {source_message_ids}")
+        except Exception as e:
+            logger.warning(f"[Broadcast {broadcast_id}] Copy mode unavailable, sending directly: {e}")
+            copy_call = None
+
+    async def _send_one(tid: int, profile: Optional[dict] = None) -> tuple[bool, bool, Optional[int], Optional[str]]:
+        """Returns (ok, blocked, message_id, error_class). Handles 429 + HTML parse retry."""
+        if personalized:
+            content, entities = template.render(profile, html_mode=not use_entities)
+        else:
+            content, entities = template.content, send_entities
+
         async def _do(pm="HTML", retry=3):
-            _pm = {} if use_entities else ({"parse_mode": pm} if pm else {})
             try:
-                if is_media:
-                    cap = content[:CAPTION_LIMIT] if content else ""
-                    overflow = content[CAPTION_LIMIT:] if content and len(content) > CAPTION_LIMIT else ""
-                    if c_type == "photo":
-                        await bot.send_photo(tid, photo=file_id, caption=cap or None, **cap_kw, **_pm)
-                    elif c_type == "video":
-                        await bot.send_video(tid, video=file_id, caption=cap or None, **cap_kw, **_pm)
-                    elif c_type == "document":
-                        await bot.send_document(tid, document=file_id, caption=cap or None, **cap_kw, **_pm)
-                    elif c_type == "audio":
-                        await bot.send_audio(tid, audio=file_id, caption=cap or None, **cap_kw, **_pm)
-                    elif c_type == "voice":
-                        await bot.send_voice(tid, voice=file_id, caption=cap or None, **cap_kw, **_pm)
-                    if overflow:
-                        await bot.send_message(tid, text=overflow[:TEXT_LIMIT], **_pm)
-                elif c_type == "video_note" and file_id:
-                    await bot.send_video_note(tid, video_note=file_id)
+                if copy_call is not None:
+                    copied = await copy_call(tid)
+                    first = copied[0] if isinstance(copied, list) else copied
+                    message_id = getattr(first, "message_id", None)
                 else:
-                    chunks = [content[i:i + TEXT_LIMIT] for i in range(0, max(len(content), 1), TEXT_LIMIT)]
-                    for i, ch in enumerate(chunks):
-                        await bot.send_message(tid, text=ch, **ent_kw, **_pm)
-                return True, False
+                    message_id = (await _deliver(tid, content, entities, pm) or [None])[0]
+                return True, False, message_id, None
 
             except Exception as e:
                 err = str(e).lower()
@@ -327,100 +607,137 @@ async def send_broadcast(
                     await asyncio.sleep(wait)
                     return await _do(pm=pm, retry=retry - 1)
                 blocked = "bot was blocked" in err or "user is deactivated" in err or "forbidden" in err
-                return False, blocked
+                return False, blocked, None, type(e).__name__
 
         return await _do()
 
+    # ── Sharded: hand the id ranges to the worker processes ──────────────
+    if not id_range and not retry_failed and settings.BROADCAST_SHARDS > 1:
+        from services.broadcast_shards import enqueue_shards
+
+        ranges = split_bits(recipients, settings.BROADCAST_SHARDS)
+        if len(ranges) > 1:
+            async with async_session() as _s:
+                # Shards add to the counters — start them from zero
+                await BroadcastService(_s).update_progress(broadcast_id, 0, 0)
+                await _s.commit()
+            if await enqueue_shards(broadcast_id, ranges, progress_chat_id, progress_message_id):
+                await _notify(
+                    f"📤 <b>Broadcast #{broadcast_id} boshlandi</b>\n"
+                    f"👥 Jami: <b>{total:,}</b> ta foydalanuvchi · {len(ranges)} ta jarayon"
+                )
+                return {"sent": 0, "failed": 0, "shards": len(ranges)}
+            logger.warning(f"[Broadcast {broadcast_id}] Sharding unavailable, sending in-process.")
+
     # ── Phase 4: chunked send loop ─────────────────────────────────────────
     sent = 0
     failed = 0
-    inactive_ids: list = []
-    last_notify_at = 0
+    writer = DeliveryWriter(broadcast_id)
+
+    async def _progress_ping(text: str):
+        """Live-edit the admin's progress message when we have one, else send."""
+        if progress_message_id and progress_chat_id:
+            try:
+                await bot.edit_message_text(
+                    chat_id=progress_chat_id, message_id=progress_message_id, text=text, parse_mode="HTML",
+                )
+                return
+            except Exception:
+                pass
+        await _notify(text)
+
+    reporter = _ProgressReporter(
+        broadcast_id, total,
+        counters=lambda: (sent, failed),
+        notify=_progress_ping if progress_chat_id and not id_range else None,
+        write_db=not retry_failed,  # a retry run recounts from the log at the end
+        incremental=bool(id_range),
+    )
+
+    # Shards share one Redis token bucket; a single sender sleeps CHUNK_SLEEP per chunk
+    bucket = None
+    if id_range:
+        from services.broadcast_shards import RedisTokenBucket, get_redis
+        redis = await get_redis()
+        if redis:
+            bucket = RedisTokenBucket(redis, rate=SEND_RATE, capacity=CHUNK_SIZE)
+        else:
+            logger.warning(f"[Broadcast {broadcast_id}] No Redis — shard paced locally at {SEND_RATE}/s")
+
+    async def _record(chunk: list, results: list):
+        """Count outcomes and log them per recipient (blocked → is_active=False on flush)."""
+        nonlocal sent, failed
+        for (t, _), r in zip(chunk, results):
+            if isinstance(r, Exception):
+                failed += 1
+                await writer.add(t, STATUS_FAILED, type(r).__name__)
+                continue
+            ok, blocked, message_id, error_class = r
+            if ok:
+                sent += 1
+                await writer.add(t, STATUS_SENT, message_id=message_id)
+            else:
+                failed += 1
+                await writer.add(t, STATUS_BLOCKED if blocked else STATUS_FAILED, error_class)
+
+    if retry_failed:
+        recipient_iter = iter_failed_recipients(broadcast_id, with_profile=personalized)
+    else:
+        recipient_iter = _iter_recipient_ids(recipients, with_profile=personalized, skip_sent_for=broadcast_id)
 
     try:
-        await _notify(
-            f"📤 <b>Broadcast #{broadcast_id} boshlandi</b>\n"
-            f"👥 Jami: <b>{total:,}</b> ta foydalanuvchi"
-        )
+        if not id_range:
+            await _notify(
+                f"📤 <b>Broadcast #{broadcast_id} boshlandi</b>\n"
+                f"👥 Jami: <b>{total:,}</b> ta foydalanuvchi"
+            )
 
+        reporter.start()
         chunk: list = []
-        async for tid in _iter_recipient_ids(filters):
-            chunk.append(tid)
+        async for tid, profile in recipient_iter:
+            chunk.append((tid, profile))
             if len(chunk) < CHUNK_SIZE:
                 continue
 
+            if bucket:
+                await bucket.acquire(len(chunk))
+
             # Send this chunk concurrently
-            results = await asyncio.gather(*[_send_one(t) for t in chunk], return_exceptions=True)
-            for t, r in zip(chunk, results):
-                if isinstance(r, Exception):
-                    failed += 1
-                else:
-                    ok, blocked = r
-                    if ok:
-                        sent += 1
-                    else:
-                        failed += 1
-                        if blocked:
-                            inactive_ids.append(t)
+            results = await asyncio.gather(*[_send_one(t, p) for t, p in chunk], return_exceptions=True)
+            await _record(chunk, results)
             chunk = []
 
-            # Save progress to DB
-            processed = sent + failed
-            try:
-                async with async_session() as _s:
-                    svc = BroadcastService(_s)
-                    await svc.update_progress(broadcast_id, sent, failed)
-                    await _s.commit()
-            except Exception:
-                pass
-
-            # Notify admin every NOTIFY_EVERY sends
-            if processed - last_notify_at >= NOTIFY_EVERY:
-                last_notify_at = processed
-                pct = round(processed / max(total, 1) * 100)
-                await _notify(
-                    f"📊 <b>Broadcast #{broadcast_id}</b>\n"
-                    f"✅ {sent:,} / ❌ {failed:,}\n"
-                    f"📈 {processed:,}/{total:,} ({pct}%)"
-                )
-
             # Pace: sleep between chunks to hold ≈ 29 msg/sec
-            await asyncio.sleep(CHUNK_SLEEP)
+            if not bucket:
+                await asyncio.sleep(CHUNK_SLEEP)
 
         # Send remaining users in last partial chunk
         if chunk:
-            results = await asyncio.gather(*[_send_one(t) for t in chunk], return_exceptions=True)
-            for t, r in zip(chunk, results):
-                if isinstance(r, Exception):
-                    failed += 1
-                else:
-                    ok, blocked = r
-                    if ok:
-                        sent += 1
-                    else:
-                        failed += 1
-                        if blocked:
-                            inactive_ids.append(t)
+            if bucket:
+                await bucket.acquire(len(chunk))
+            results = await asyncio.gather(*[_send_one(t, p) for t, p in chunk], return_exceptions=True)
+            await _record(chunk, results)
 
-        # Mark blocked users inactive
-        if inactive_ids:
-            try:
-                from sqlalchemy import update as _upd
-                async with async_session() as _s:
-                    await _s.execute(
-                        _upd(User)
-                        .where(User.telegram_id.in_(inactive_ids))
-                        .values(is_active=False)
-                    )
-                    await _s.commit()
-                logger.info(f"[Broadcast {broadcast_id}] Marked {len(inactive_ids)} users inactive.")
-            except Exception:
-                pass
+        await reporter.stop()
+
+        # Flush the delivery log (also marks blocked users inactive)
+        await writer.flush()
+        if writer.deactivated:
+            logger.info(f"[Broadcast {broadcast_id}] Marked {writer.deactivated} users inactive.")
+
+        if id_range:
+            await reporter.write()
+            logger.info(f"[Broadcast {broadcast_id}] Shard {list(id_range)} done: sent={sent} failed={failed}")
+            await _finish_shard(bot, broadcast_id, id_range, progress_chat_id, progress_message_id)
+            return {"sent": sent, "failed": failed, "progress": reporter.stats}
 
         # Final DB update
         async with async_session() as _s:
             svc = BroadcastService(_s)
-            await svc.update_progress(broadcast_id, sent, failed)
+            if retry_failed:
+                await recount(_s, broadcast_id)
+            else:
+                await svc.update_progress(broadcast_id, sent, failed)
             await svc.mark_completed(broadcast_id)
             await _s.commit()
 
@@ -432,30 +749,10 @@ async def send_broadcast(
         )
 
         # Final admin notification
-        final_text = (
-            f"✅ <b>Broadcast #{broadcast_id} yakunlandi!</b>\n\n"
-            f"✅ Muvaffaqiyatli: <b>{sent:,}</b>\n"
-            f"❌ Yetkazilmadi: <b>{failed:,}</b>\n"
-            f"👥 Jami: <b>{processed:,}</b>\n"
-            f"📈 Natija: <b>{round(sent / max(processed, 1) * 100)}%</b>"
-        )
-        if progress_chat_id:
-            if progress_message_id:
-                try:
-                    await bot.edit_message_text(
-                        chat_id=progress_chat_id,
-                        message_id=progress_message_id,
-                        text=final_text,
-                        parse_mode="HTML",
-                    )
-                except Exception:
-                    pass
-            try:
-                await bot.send_message(chat_id=progress_chat_id, text=final_text, parse_mode="HTML")
-            except Exception:
-                pass
+        await _send_final(bot, broadcast_id, sent, failed, progress_chat_id, progress_message_id)
 
     except Exception as e:
+        await reporter.stop()
         logger.error(f"[Broadcast {broadcast_id}] CRASHED: {e}\n{_tb.format_exc()}")
         await _notify(
             f"❌ <b>Broadcast #{broadcast_id} xatolik!</b>\n"
@@ -464,15 +761,23 @@ async def send_broadcast(
         )
         # Still mark completed with current counts
         try:
-            async with async_session() as _s:
-                svc = BroadcastService(_s)
-                await svc.update_progress(broadcast_id, sent, failed)
-                await svc.mark_completed(broadcast_id)
-                await _s.commit()
+            if id_range:
+                # Keep what this shard did; the last shard completes the broadcast
+                await writer.flush()
+                await reporter.write()
+                await _finish_shard(bot, broadcast_id, id_range, progress_chat_id, progress_message_id)
+            else:
+                await writer.flush()
+                async with async_session() as _s:
+                    svc = BroadcastService(_s)
+                    if retry_failed:  # sent/failed only cover this pass; the log has the totals
+                        await recount(_s, broadcast_id)
+                    else:
+                        await svc.update_progress(broadcast_id, sent, failed)
+                    await svc.mark_completed(broadcast_id)
+                    await _s.commit()
         except Exception:
             pass
         raise
-    finally:
-        if _own_bot:
-            await bot.session.close()
 
+    return {"sent": sent, "failed": failed, "progress": reporter.stats}
@@ -0,0 +1,155 @@
+"""Broadcast delivery log — buffered bulk writes to `broadcast_deliveries`.
+
+send_broadcast records one outcome per recipient into a DeliveryWriter.
+The buffer is flushed every FLUSH_EVERY records (and at the end) in a
+single short transaction:
+
+  * one multi-row INSERT … ON CONFLICT (broadcast_id, telegram_id) DO UPDATE
+    — a retry overwrites the earlier failure instead of adding a row;
+  * one UPDATE users SET is_active = false for the recipients that blocked
+    the bot / were deactivated in that window.
+
+The log is what "retry failed only" streams from (iter_failed_recipients)
+and what dedupes resumed sends (users already `sent` are skipped).
+"""
+import logging
+from typing import AsyncGenerator, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db.models import BroadcastDelivery, BroadcastMessage, User
+
+logger = logging.getLogger("broadcast")
+
+FLUSH_EVERY = 500
+STREAM_BATCH = 500
+
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"    # retryable (network, 429 exhausted, bad request …)
+STATUS_BLOCKED = "blocked"  # bot blocked / user deactivated — never retried
+
+
+class DeliveryWriter:
+    """Collects per-recipient outcomes and writes them in bulk."""
+
+    def __init__(self, broadcast_id: int, flush_every: int = FLUSH_EVERY):
+        self.broadcast_id = broadcast_id
+        self.flush_every = flush_every
+        self._rows: list[dict] = []
+        self._blocked: list[int] = []
+        self.written = 0
+        self.deactivated = 0
+
+    async def add(
+        self,
+        telegram_id: int,
+        status: str,
+        error_class: Optional[str] = None,
+        message_id: Optional[int] = None,
+    ):
+        self._rows.append({
+            "broadcast_id": self.broadcast_id,
+            "telegram_id": telegram_id,
+            "status": status,
+            "error_class": (error_class or None) and error_class[:60],
+            "message_id": message_id,
+        })
+        if status == STATUS_BLOCKED:
+            self._blocked.append(telegram_id)
+        if len(self._rows) >= self.flush_every:
+            await self.flush()
+
+    async def flush(self):
+        if not self._rows:
+            return
+        from db.database import async_session, is_sqlite
+
+        rows, blocked = self._rows, self._blocked
+        self._rows, self._blocked = [], []
+        try:
+            async with async_session() as session:
+                # SQLite (local dev / benchmarks) has the same ON CONFLICT upsert
+                stmt = (sqlite_insert if is_sqlite else pg_insert)(BroadcastDelivery).values(rows)
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=["broadcast_id", "telegram_id"],  # uq_broadcast_delivery
+                    set_={
+                        "status": stmt.excluded.status,
+                        "error_class": stmt.excluded.error_class,
+                        "message_id": stmt.excluded.message_id,
+                        "created_at": func.now(),
+                    },
+                ))
+                if blocked:
+                    await session.execute(
+                        update(User)
+                        .where(User.telegram_id.in_(blocked))
+                        .values(is_active=False)
+                    )
+                await session.commit()
+            self.written += len(rows)
+            self.deactivated += len(blocked)
+        except Exception as e:
+            # The send already happened — losing log rows beats aborting the broadcast.
+            logger.error(f"[Broadcast {self.broadcast_id}] Delivery log flush failed ({len(rows)} rows): {e}")
+
+
+async def iter_failed_recipients(broadcast_id: int, with_profile: bool = False) -> AsyncGenerator:
+    """Yield (telegram_id, profile) for retryable failures of a broadcast.
+
+    Keyset-paginated over the delivery log; blocked recipients and users
+    deactivated since are skipped. Profile fields come from the same query.
+    """
+    from db.database import async_session
+    from services.broadcast_template import profile_values
+
+    last_id = 0
+    while True:
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(BroadcastDelivery.id, BroadcastDelivery.telegram_id, User.name, User.username)
+                .join(User, User.telegram_id == BroadcastDelivery.telegram_id)
+                .where(
+                    BroadcastDelivery.broadcast_id == broadcast_id,
+                    BroadcastDelivery.status == STATUS_FAILED,
+                    BroadcastDelivery.id > last_id,
+                    User.is_active.isnot(False),
+                )
+                .order_by(BroadcastDelivery.id)
+                .limit(STREAM_BATCH)
+            )).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        for _, tid, name, username in rows:
+            yield tid, (profile_values(name, username) if with_profile else None)
+        if len(rows) < STREAM_BATCH:
+            return
+
+
+async def count_failed(session, broadcast_id: int) -> int:
+    return (await session.execute(
+        select(func.count()).select_from(BroadcastDelivery).where(
+            BroadcastDelivery.broadcast_id == broadcast_id,
+            BroadcastDelivery.status == STATUS_FAILED,
+        )
+    )).scalar() or 0
+
+
+async def recount(session, broadcast_id: int) -> tuple[int, int]:
+    """Set sent/failed counters on the broadcast from its delivery log; returns them."""
+    rows = (await session.execute(
+        select(BroadcastDelivery.status, func.count())
+        .where(BroadcastDelivery.broadcast_id == broadcast_id)
+        .group_by(BroadcastDelivery.status)
+    )).all()
+    by_status = dict(rows)
+    sent = by_status.get(STATUS_SENT, 0)
+    failed = sum(by_status.values()) - sent
+    await session.execute(
+        update(BroadcastMessage)
+        .where(BroadcastMessage.id == broadcast_id)
+        .values(sent_count=sent, failed_count=failed)
+    )
+    return sent, failed
@@ -0,0 +1,265 @@
+"""Sharded broadcasts — send from worker processes under one shared rate budget.
+
+With BROADCAST_SHARDS > 1 the web process only coordinates a broadcast:
+send_broadcast resolves the recipients, posts the copy-mode source, cuts
+the recipient bitmap into BROADCAST_SHARDS contiguous users.id ranges of
+~equal size (segments.split_bits) and pushes one job per range onto a
+Redis list. Worker processes started with
+
+    python -m services.broadcast_shards --processes 4
+
+BLMOVE the jobs into their own `broadcast:shards:run:<n>` list and run
+send_broadcast(..., id_range=(lo, hi)) for their range only. Webhook
+handling never shares an event loop with the send. A job leaves the
+running list only once its shard is done; the process that next starts
+in slot n requeues whatever a killed worker (deploy, OOM) left there —
+the rerun skips users the delivery log already has as sent. The
+supervisor restarts workers that exit.
+
+Pacing is global: before each chunk a shard reserves CHUNK_SIZE tokens
+from a token bucket that lives in Redis and is updated by one Lua script
+(atomic across processes), so the combined rate stays at SEND_RATE no
+matter how many shards run. The bucket reserves rather than polls — the
+script books the tokens and returns how long the caller must wait — so
+shards interleave fairly without retry storms.
+
+Completion: each shard decrements `broadcast:<id>:pending` — once: the
+shard is added to `broadcast:<id>:done` in the same script, so a shard
+that is reported twice (crash path, then a requeued rerun) doesn't count
+twice. The one that takes the counter to zero recounts from the delivery log, marks the broadcast
+completed and sends the admin the final summary. Progress counters are
+written as increments, so shards never overwrite each other.
+
+Without Redis the coordinator falls back to the in-process send.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+from bot.config import settings
+from services.media_jobs import REDIS_RETRY
+
+logger = logging.getLogger("broadcast")
+
+QUEUE_KEY = "broadcast:shards"
+BUCKET_KEY = "broadcast:rate"
+PENDING_TTL = 2 * 86400
+POP_TIMEOUT = 5  # seconds; BLMOVE wakes up this often to notice shutdown
+SUPERVISE_INTERVAL = 5
+
+# KEYS[1] = bucket hash; ARGV = rate/s, capacity, tokens wanted.
+# Returns the seconds the caller must wait before using its tokens (as a
+# string: Lua numbers are truncated to integers on the way out).
+_RESERVE_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate) - want
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], 60000)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# KEYS[1] = pending counter, KEYS[2] = done set; ARGV = shard, ttl.
+# Returns the shards still pending, or nil if this shard was already counted.
+_DONE_LUA = """
+if redis.call('SADD', KEYS[2], ARGV[1]) == 0 then
+    return false
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return redis.call('DECR', KEYS[1])
+"""
+
+_redis = None
+_redis_retry_at = 0.0
+
+
+async def get_redis():
+    """Shared redis.asyncio client, or None when Redis is unreachable.
+
+    A failed connect is retried after REDIS_RETRY seconds, as in media_jobs.
+    """
+    global _redis, _redis_retry_at
+    if _redis is None and time.monotonic() >= _redis_retry_at:
+        _redis_retry_at = time.monotonic() + REDIS_RETRY
+        try:
+            import redis.asyncio as aioredis
+            client = aioredis.from_url(settings.get_redis_url, decode_responses=True)
+            await client.ping()
+            _redis = client
+        except Exception as e:
+            logger.warning(f"Redis unavailable for sharded broadcasts (retry in {REDIS_RETRY}s): {e}")
+    return _redis
+
+
+class RedisTokenBucket:
+    """Token bucket shared by every process that uses the same Redis key."""
+
+    def __init__(self, redis, rate: float, capacity: float, key: str = BUCKET_KEY):
+        self.redis = redis
+        self.rate = rate
+        self.capacity = capacity
+        self.key = key
+        self._script = redis.register_script(_RESERVE_LUA)
+
+    async def acquire(self, tokens: int = 1):
+        """Reserve `tokens` and sleep until they are due."""
+        wait = float(await self._script(keys=[self.key], args=[self.rate, self.capacity, tokens]))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+async def enqueue_shards(
+    broadcast_id: int,
+    ranges: list[tuple[int, Optional[int]]],
+    progress_chat_id: Optional[int] = None,
+    progress_message_id: Optional[int] = None,
+) -> bool:
+    """Push one job per id range for the worker processes. False if Redis is down."""
+    redis = await get_redis()
+    if not redis:
+        return False
+    jobs = [
+        json.dumps({
+            "broadcast_id": broadcast_id,
+            "id_range": [lo, hi],
+            "shard": n,
+            "progress_chat_id": progress_chat_id,
+            "progress_message_id": progress_message_id,
+        })
+        for n, (lo, hi) in enumerate(ranges)
+    ]
+    try:
+        pending = f"broadcast:{broadcast_id}:pending"
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.set(pending, len(jobs), ex=PENDING_TTL)
+            pipe.delete(f"broadcast:{broadcast_id}:done")
+            pipe.rpush(QUEUE_KEY, *jobs)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"[Broadcast {broadcast_id}] Could not enqueue shards: {e}")
+        return False
+    logger.info(f"[Broadcast {broadcast_id}] Enqueued {len(jobs)} shards: {ranges}")
+    return True
+
+
+async def shard_done(broadcast_id: int, shard: int) -> bool:
+    """Mark shard `shard` finished, once. True for the last one (it finalizes the broadcast)."""
+    redis = await get_redis()
+    if not redis:
+        return True
+    try:
+        left = await redis.eval(
+            _DONE_LUA, 2, f"broadcast:{broadcast_id}:pending", f"broadcast:{broadcast_id}:done",
+            shard, PENDING_TTL,
+        )
+        if left is None:
+            logger.info(f"[Broadcast {broadcast_id}] shard {shard} was already counted")
+            return False
+        return int(left) <= 0
+    except Exception as e:
+        logger.warning(f"[Broadcast {broadcast_id}] Shard counter unavailable, finalizing: {e}")
+        return True
+
+
+# ── Worker process ────────────────────────────────────────────────────────────
+
+def running_key(worker: int) -> str:
+    return f"{QUEUE_KEY}:run:{worker}"
+
+
+async def _requeue_leftover(redis, mine: str):
+    """Put back the shard the previous process in this slot was sending when it died."""
+    while True:
+        item = await redis.lmove(mine, QUEUE_KEY, "RIGHT", "LEFT")
+        if not item:
+            return
+        job = json.loads(item)
+        logger.warning(f"[Broadcast {job['broadcast_id']}] shard {job['shard']} requeued after a worker crash")
+
+
+async def run_worker(worker: int = 0):
+    """Take shard jobs forever and send them, one at a time."""
+    from services.broadcast import send_broadcast
+
+    redis = await get_redis()
+    if not redis:
+        raise SystemExit("Redis is required for broadcast workers")
+    mine = running_key(worker)
+    await _requeue_leftover(redis, mine)
+    logger.info(f"📤 Broadcast worker {worker} waiting on {QUEUE_KEY}")
+    while True:
+        try:
+            item = await redis.blmove(QUEUE_KEY, mine, POP_TIMEOUT, "LEFT", "RIGHT")
+        except Exception as e:
+            logger.error(f"Broadcast worker {worker}: queue error: {e}")
+            await asyncio.sleep(POP_TIMEOUT)
+            continue
+        if not item:
+            continue
+        job = json.loads(item)
+        lo, hi = job["id_range"]
+        logger.info(f"Broadcast worker {worker}: #{job['broadcast_id']} shard {job['shard']} ids [{lo}, {hi})")
+        try:
+            await send_broadcast(
+                job["broadcast_id"],
+                progress_chat_id=job.get("progress_chat_id"),
+                progress_message_id=job.get("progress_message_id"),
+                id_range=(lo, hi),
+            )
+        except Exception as e:
+            # send_broadcast already logged, notified and counted the shard as done
+            logger.error(f"Broadcast worker {worker}: #{job['broadcast_id']} shard {job['shard']} failed: {e}")
+        # only a shard that reached shard_done (or failed through send_broadcast) is acked;
+        # a killed process leaves it in `mine` for the next one in this slot
+        await redis.lrem(mine, 0, item)
+
+
+def _worker_main(worker: int):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    try:
+        asyncio.run(run_worker(worker))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Sharded broadcast worker processes")
+    parser.add_argument("--processes", type=int, default=max(settings.BROADCAST_SHARDS, 1))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ctx = multiprocessing.get_context("spawn")
+    procs = {}
+
+    def start(n):
+        p = ctx.Process(target=_worker_main, args=(n,), name=f"broadcast-{n}")
+        p.start()
+        procs[n] = p
+
+    for n in range(max(args.processes, 1)):
+        start(n)
+    try:
+        # a restarted worker requeues the shard its predecessor left in its running list
+        while True:
+            time.sleep(SUPERVISE_INTERVAL)
+            for n, p in list(procs.items()):
+                if not p.is_alive():
+                    logger.warning(f"Broadcast worker {n} exited ({p.exitcode}), restarting")
+                    start(n)
+    except KeyboardInterrupt:
+        for p in procs.values():
+            p.terminate()
@@ -0,0 +1,112 @@
+"""Per-recipient broadcast personalization — `{name}`-style placeholders.
+
+The template is parsed once per broadcast into literal parts + field slots,
+and every Telegram entity is pre-classified against the slots (which ones
+sit before it, which inside it). Rendering for a recipient is then a join
+plus a few integer additions per entity — no re-parsing, no regex.
+
+Telegram entity offsets/lengths are in UTF-16 code units, so all widths
+here are measured that way (emoji and other astral characters count 2).
+
+Only the known FIELDS are placeholders; any other `{...}` is left as-is,
+so existing messages containing braces are unaffected. A message without
+placeholders renders to the original objects at zero cost.
+"""
+import html
+import re
+from typing import Optional
+
+FIELDS = ("name", "first_name", "username")
+FIELD_DEFAULTS = {"name": "do'stim", "first_name": "do'stim", "username": ""}
+_PLACEHOLDER_RE = re.compile(r"\{(" + "|".join(FIELDS) + r")\}")
+
+
+def _u16(s: str) -> int:
+    return len(s.encode("utf-16-le")) // 2
+
+
+def profile_values(name: Optional[str], username: Optional[str]) -> dict:
+    """Field values for one recipient, from the columns fetched with the batch."""
+    name = (name or "").strip()
+    return {
+        "name": name or FIELD_DEFAULTS["name"],
+        "first_name": name.split()[0] if name else FIELD_DEFAULTS["first_name"],
+        "username": f"@{username}" if username else FIELD_DEFAULTS["username"],
+    }
+
+
+class CompiledTemplate:
+    """A broadcast text/caption with placeholders resolved at compile time."""
+
+    def __init__(self, content: str, entities: Optional[list] = None):
+        self.content = content
+        self.entities = entities
+        self.parts: list[str] = []        # literal, slot, literal, slot, ..., literal
+        self.slots: list[str] = []        # field name per slot
+        slot_widths: list[int] = []
+        slot_starts: list[int] = []       # UTF-16 offset of each slot in the template
+
+        pos, u16_pos = 0, 0
+        for m in _PLACEHOLDER_RE.finditer(content):
+            literal = content[pos:m.start()]
+            self.parts.append(literal)
+            u16_pos += _u16(literal)
+            slot_starts.append(u16_pos)
+            slot_widths.append(_u16(m.group(0)))
+            u16_pos += slot_widths[-1]
+            self.slots.append(m.group(1))
+            pos = m.end()
+        self.parts.append(content[pos:])
+        self._slot_widths = slot_widths
+
+        # Per entity: slot indexes that shift its offset / change its length.
+        self._entity_plan: list[tuple[list[int], list[int]]] = []
+        for e in entities or []:
+            before = [i for i, s in enumerate(slot_starts) if s < e.offset]
+            inside = [i for i, s in enumerate(slot_starts) if e.offset <= s < e.offset + e.length]
+            self._entity_plan.append((before, inside))
+
+    @property
+    def is_dynamic(self) -> bool:
+        return bool(self.slots)
+
+    @property
+    def fields(self) -> set:
+        return set(self.slots)
+
+    def render(self, values: Optional[dict], html_mode: bool = False) -> tuple[str, Optional[list]]:
+        """Return (text, entities) for one recipient.
+
+        html_mode escapes values for parse_mode=HTML sends (no entities).
+        """
+        if not self.slots:
+            return self.content, self.entities
+        values = values or FIELD_DEFAULTS
+        deltas = []
+        out = [self.parts[0]]
+        for i, field in enumerate(self.slots):
+            v = values.get(field) or FIELD_DEFAULTS[field]
+            if html_mode:
+                v = html.escape(v, quote=False)
+            out.append(v)
+            out.append(self.parts[i + 1])
+            if self.entities:
+                deltas.append(_u16(v) - self._slot_widths[i])
+        text = "".join(out)
+
+        if not self.entities:
+            return text, self.entities
+        entities = []
+        for e, (before, inside) in zip(self.entities, self._entity_plan):
+            if not before and not inside:
+                entities.append(e)
+                continue
+            entities.append(e.model_copy(update={
+                "offset": e.offset + sum(deltas[i] for i in before),
+                "length": max(e.length + sum(deltas[i] for i in inside), 0),
+            }))
+        return text, entities
+
+
+def compile_template(content: str, entities: Optional[list] = None) -> CompiledTemplate:
+    return CompiledTemplate(content or "", entities)
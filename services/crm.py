@@ -9,6 +9,7 @@ from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import User, ReferralBalance, Subscription
+from services.segments import compile_spec
 
 logger = logging.getLogger(__name__)
 
@@ -215,26 +216,5 @@ class CRMService:
         return result.all()  # list of Row(id, telegram_id)
 
     def _apply_filters(self, q, filters: dict):
-        """Apply common broadcast filters to a query."""
-        if filters.get("source"):
-            q = q.where(User.source == filters["source"])
-        if filters.get("campaign"):
-            q = q.where(User.campaign == filters["campaign"])
-        if filters.get("level_tag"):
-            q = q.where(User.level_tag == filters["level_tag"])
-        if filters.get("lead_score_min"):
-            q = q.where(User.lead_score >= filters["lead_score_min"])
-        if filters.get("lead_score_max"):
-            q = q.where(User.lead_score <= filters["lead_score_max"])
-        if filters.get("user_status"):
-            q = q.where(User.user_status == filters["user_status"])
-        if filters.get("lead_segment"):
-            q = q.where(User.lead_segment == filters["lead_segment"])
-        if filters.get("paid"):
-            active_sub_sq = (
-                select(Subscription.user_id)
-                .where(Subscription.status == "active")
-                .scalar_subquery()
-            )
-            q = q.where(User.id.in_(active_sub_sq))
-        return q
+        """Apply common broadcast filters to a query (see services.segments)."""
+        return q.where(compile_spec(filters))
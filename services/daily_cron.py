@@ -1,6 +1,7 @@
 import asyncio
 import logging
 from datetime import datetime, time, timezone, timedelta
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from db.database import async_session
 from db.models import DailyReport
 from services.amocrm import AmoCRMService
@@ -8,6 +9,19 @@ from bot.config import settings
 
 logger = logging.getLogger("daily_cron")
 
+USER_FANOUT = 4  # AmoCRM users fetched concurrently
+
+
+async def _user_activity(amo: AmoCRMService, sem: asyncio.Semaphore, u: dict, start_ts: int, end_ts: int):
+    """Calls + leads for one AmoCRM user (both requests in flight at once)."""
+    async with sem:
+        calls, leads = await asyncio.gather(
+            amo.get_daily_calls_for_user(u.get("id"), start_ts, end_ts),
+            amo.get_daily_leads_for_user(u.get("id"), start_ts, end_ts),
+        )
+    return u, calls, leads
+
+
 async def extract_and_send_daily_reports():
     """Extracts reports from AmoCRM, saves them to DB, and sends to the Sales Group."""
     logger.info("Starting Daily AmoCRM Auto-Extraction Job...")
@@ -15,84 +29,82 @@ async def extract_and_send_daily_reports():
         logger.warning("AmoCRM credentials not set. Skipping extraction.")
         return
 
+    started = asyncio.get_running_loop().time()
     amo = AmoCRMService()
     users = await amo.get_users()
     if not users:
         logger.warning("No users found in AmoCRM.")
-        await amo.close()
         return
 
     # Target today:
     now = datetime.now()
-    start_of_day = int(datetime(now.year, now.month, now.day).timestamp())
-    end_of_day = int((datetime(now.year, now.month, now.day) + timedelta(days=1)).timestamp())
+    report_day = datetime(now.year, now.month, now.day)
+    start_of_day = int(report_day.timestamp())
+    end_of_day = int((report_day + timedelta(days=1)).timestamp())
 
     group_msg = f"📊 <b>Sotuvchilar kunlik hisoboti - {now.strftime('%d.%m.%Y')}</b>\n\n"
 
-    async with async_session() as session:
-        for u in users:
-            amocrm_id = u.get("id")
-            name = u.get("name", "Noma'lum xodim")
-
-            # In amoCRM, a user might not be a sales person, usually you'd filter by group.
-            # We'll just fetch for all users that have some data.
-            calls = await amo.get_daily_calls_for_user(amocrm_id, start_of_day, end_of_day)
-            leads = await amo.get_daily_leads_for_user(amocrm_id, start_of_day, end_of_day)
-
-            # If no activity at all, skip logging this user to not spam groups with empty records
-            if calls["total_calls"] == 0 and leads["total_leads"] == 0:
-                continue
-
-            # Find or create report
-            from sqlalchemy import select
-            q = await session.execute(
-                select(DailyReport).where(
-                    DailyReport.amocrm_user_id == amocrm_id,
-                    DailyReport.report_date >= datetime(now.year, now.month, now.day)
-                )
-            )
-            report = q.scalar_one_or_none()
-            if not report:
-                report = DailyReport(
-                    amocrm_user_id=amocrm_id,
-                    user_name=name,
-                    report_date=now
-                )
-                session.add(report)
-
-            report.arrival_time = "09:00" # Mock login time
-            report.start_time = "09:10"
-            report.amo_call_time = f"{calls['duration'] // 60} min"
-            report.calls_answered = calls["answered"]
-            report.calls_missed = calls["missed"]
-            report.total_calls = calls["total_calls"]
-            report.sales_won = leads["won"]
-            report.pre_payments = leads["pre_payments"]
-            report.leads_received = leads["total_leads"]
-            report.end_time = now.strftime("%H:%M")
-
+    # Users are fetched USER_FANOUT at a time; the client's limiter keeps the
+    # total at AmoCRM's 7 req/s whatever the fan-out.
+    sem = asyncio.Semaphore(USER_FANOUT)
+    results = await asyncio.gather(*[_user_activity(amo, sem, u, start_of_day, end_of_day) for u in users])
+
+    rows = []
+    for u, calls, leads in results:
+        # In amoCRM, a user might not be a sales person, usually you'd filter by group.
+        # We'll just fetch for all users that have some data.
+        # If no activity at all, skip logging this user to not spam groups with empty records
+        if calls["total_calls"] == 0 and leads["total_leads"] == 0:
+            continue
+
+        name = u.get("name", "Noma'lum xodim")
+        rows.append({
+            "amocrm_user_id": u.get("id"),
+            "user_name": name,
+            "report_date": report_day,
+            "arrival_time": "09:00",  # Mock login time
+            "start_time": "09:10",
+            "amo_call_time": f"{calls['duration'] // 60} min",
+            "calls_answered": calls["answered"],
+            "calls_missed": calls["missed"],
+            "total_calls": calls["total_calls"],
+            "sales_won": leads["won"],
+            "pre_payments": leads["pre_payments"],
+            "leads_received": leads["total_leads"],
+            "end_time": now.strftime("%H:%M"),
+        })
+
+        # Format the telegram text block
+        group_msg += f"👤 <b>{name}</b>\n"
+        group_msg += f"📞 Jami qo'ng'iroqlar: {calls['total_calls']} ta\n"
+        group_msg += f"✅ Ko'tarilganlar: {calls['answered']} ta\n"
+        group_msg += f"💰 Muvaffaqiyatli sotuv: {leads['won']} ta\n"
+        group_msg += f"💵 Oldindan to'lov: {leads['pre_payments']} ta\n\n"
+
+    # One upsert for every user's row of the day (uq_daily_report_user_day)
+    if rows:
+        async with async_session() as session:
+            stmt = pg_insert(DailyReport).values(rows)
+            await session.execute(stmt.on_conflict_do_update(
+                constraint="uq_daily_report_user_day",
+                set_={c: stmt.excluded[c] for c in rows[0] if c not in ("amocrm_user_id", "report_date")},
+            ))
             await session.commit()
 
-            # Format the telegram text block
-            group_msg += f"👤 <b>{name}</b>\n"
-            group_msg += f"📞 Jami qo'ng'iroqlar: {calls['total_calls']} ta\n"
-            group_msg += f"✅ Ko'tarilganlar: {calls['answered']} ta\n"
-            group_msg += f"💰 Muvaffaqiyatli sotuv: {leads['won']} ta\n"
-            group_msg += f"💵 Oldindan to'lov: {leads['pre_payments']} ta\n\n"
-
-    await amo.close()
+    logger.info(
+        f"AmoCRM extraction: {len(users)} users, {len(rows)} reports "
+        f"in {asyncio.get_running_loop().time() - started:.1f}s"
+    )
 
     # Send to sales group if configured
     if settings.AMOCRM_SALES_GROUP_ID:
         try:
-            from aiogram import Bot
-            bot = Bot(token=settings.BOT_TOKEN)
-            await bot.send_message(
+            from bot.utils.bot_registry import get_bot
+            await get_bot().send_message(
                 chat_id=settings.AMOCRM_SALES_GROUP_ID,
                 text=group_msg,
                 parse_mode="HTML"
             )
-            await bot.session.close()
             logger.info("Successfully sent group report.")
         except Exception as e:
             logger.error(f"Failed to send report to group {settings.AMOCRM_SALES_GROUP_ID}: {e}")
@@ -0,0 +1,241 @@
+"""One way to run ffmpeg — progress, limits, cancellation and metrics.
+
+    result = await run_ffmpeg(["-i", src, "-c:v", "libx264", ..., dst],
+                              ctx=ctx, progress_text="⚙️ Ishlanmoqda: {percent}%")
+    if not result.ok: ...
+
+`args` are everything after the binary (no `-y`). The runner adds
+`-progress pipe:1` and reads it as ffmpeg goes:
+
+- progress: percent of the input duration (probed from the first `-i`
+  when not given) goes to `ctx.stage(progress_text)` and/or
+  `on_progress(dict)`.
+- limits: `-threads`/`-filter_threads` FFMPEG_THREADS per run, an extra
+  FFMPEG_NICE, RLIMIT_CPU (FFMPEG_CPU_SECONDS), RLIMIT_FSIZE (the job's
+  scratch budget) and a wall-clock
+  `timeout` (FFMPEG_TIMEOUT) — on timeout the process is killed and
+  asyncio.TimeoutError raised, as with run_command.
+- cancellation: cancelling the awaiting task (the job's ❌ button, the
+  job timeout) kills ffmpeg.
+- metrics: wall/CPU seconds, encode fps and realtime factor are logged,
+  written to the job hash and summed per label in `media:ffmpeg:stats`
+  (GET /api/admin/media-ffmpeg).
+"""
+import asyncio
+import logging
+import os
+import re
+import resource
+import signal
+import time
+from collections import deque
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from bot.config import settings
+from services.media_jobs import get_redis, job_key
+from services.media_probe import ffmpeg_path, probe
+
+logger = logging.getLogger("ffmpeg_runner")
+
+STATS_KEY = "media:ffmpeg:stats"
+STDERR_TAIL = 30   # lines kept for error logs
+
+_BENCH = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+
+class FFmpegResult(NamedTuple):
+    returncode: int
+    wall: float           # seconds
+    cpu: float            # user + system seconds (ffmpeg -benchmark)
+    media_seconds: float  # output timeline produced
+    frames: int
+    stderr: str           # last STDERR_TAIL lines
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+    @property
+    def cpu_limited(self) -> bool:
+        return self.returncode == -signal.SIGXCPU
+
+    @property
+    def size_limited(self) -> bool:
+        return self.returncode == -signal.SIGXFSZ
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.wall if self.wall else 0.0
+
+    @property
+    def speed(self) -> float:
+        """Realtime factor: media seconds produced per wall second."""
+        return self.media_seconds / self.wall if self.wall else 0.0
+
+
+def _limit_child(cpu_seconds: int, max_file: int):
+    # runs in the forked child right before exec
+    if settings.FFMPEG_NICE:
+        os.nice(settings.FFMPEG_NICE)
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+    if max_file:
+        resource.setrlimit(resource.RLIMIT_FSIZE, (max_file, max_file))
+
+
+def _seconds(value: Optional[str]) -> float:
+    try:
+        return int(value) / 1_000_000
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def _input_duration(args: list[str]) -> float:
+    try:
+        info = await probe(args[args.index("-i") + 1])
+    except (ValueError, IndexError):
+        return 0.0
+    return info.duration if info else 0.0
+
+
+async def run_ffmpeg(
+    args: list[str],
+    *,
+    ctx=None,
+    label: Optional[str] = None,
+    duration: Optional[float] = None,
+    progress_text: Optional[str] = None,
+    on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+    timeout: Optional[float] = None,
+    threads: Optional[int] = None,
+) -> FFmpegResult:
+    """Run ffmpeg with `args` (last one is the output); see module docstring."""
+    exe = ffmpeg_path()
+    if not exe:
+        raise RuntimeError("ffmpeg not found")
+    label = label or (ctx.tool if ctx else "ffmpeg")
+    threads = threads or settings.FFMPEG_THREADS
+    timeout = timeout or settings.FFMPEG_TIMEOUT
+    cpu_seconds = settings.FFMPEG_CPU_SECONDS or int(timeout * threads)
+    max_file = ctx.scratch.budget if ctx and getattr(ctx, "scratch", None) else 0
+    reporting = bool(on_progress or (ctx and progress_text))
+    if duration is None and reporting:
+        duration = await _input_duration(args)
+
+    cmd = [
+        exe, "-hide_banner", "-nostdin", "-y", "-benchmark", "-nostats", "-progress", "pipe:1",
+        "-filter_threads", str(threads), *args[:-1], "-threads", str(threads), args[-1],
+    ]
+    started = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        preexec_fn=lambda: _limit_child(cpu_seconds, max_file),
+    )
+    state: dict = {}
+    tail: deque = deque(maxlen=STDERR_TAIL)
+
+    async def read_progress():
+        block: dict = {}
+        async for raw in proc.stdout:
+            key, _, value = raw.decode(errors="ignore").strip().partition("=")
+            block[key] = value
+            if key != "progress":
+                continue
+            state.update(block)
+            block = {}
+            if not reporting:
+                continue
+            done = _seconds(state.get("out_time_us"))
+            update = {
+                "seconds": done,
+                "percent": min(int(done * 100 / duration), 99) if duration else None,
+                "fps": state.get("fps"),
+                "speed": state.get("speed"),
+            }
+            try:
+                if on_progress:
+                    await on_progress(update)
+                if ctx and progress_text and update["percent"] is not None:
+                    await ctx.stage(progress_text.format(percent=update["percent"]))
+            except Exception as e:
+                logger.debug(f"[{label}] progress callback failed: {e}")
+
+    async def read_stderr():
+        async for raw in proc.stderr:
+            tail.append(raw.decode(errors="ignore").rstrip())
+
+    try:
+        await asyncio.wait_for(asyncio.gather(read_progress(), read_stderr(), proc.wait()), timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        logger.warning(f"🎞 [{label}] ffmpeg killed after {time.monotonic() - started:.1f}s")
+        raise
+
+    stderr = "\n".join(tail)
+    bench = _BENCH.search(stderr)
+    try:
+        frames = int(state.get("frame") or 0)
+    except ValueError:
+        frames = 0
+    result = FFmpegResult(
+        returncode=proc.returncode,
+        wall=time.monotonic() - started,
+        cpu=float(bench.group(1)) + float(bench.group(2)) if bench else 0.0,
+        media_seconds=_seconds(state.get("out_time_us")),
+        frames=frames,
+        stderr=stderr,
+    )
+    await _record(label, ctx, result)
+    return result
+
+
+async def _record(label: str, ctx, result: FFmpegResult):
+    if result.ok:
+        logger.info(
+            f"🎞 [{label}] {result.wall:.1f}s wall, {result.cpu:.1f}s cpu, "
+            f"{result.fps:.0f} fps, {result.speed:.2f}x realtime"
+        )
+    else:
+        reason = "CPU limit" if result.cpu_limited else "scratch budget" if result.size_limited else f"exit {result.returncode}"
+        logger.warning(f"🎞 [{label}] ffmpeg failed ({reason}): {result.stderr[-500:]}")
+
+    redis = await get_redis()
+    if not redis:
+        return
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hincrby(STATS_KEY, f"{label}:runs", 1)
+            pipe.hincrby(STATS_KEY, f"{label}:failed", 0 if result.ok else 1)
+            pipe.hincrby(STATS_KEY, f"{label}:wall_ms", int(result.wall * 1000))
+            pipe.hincrby(STATS_KEY, f"{label}:cpu_ms", int(result.cpu * 1000))
+            pipe.hincrby(STATS_KEY, f"{label}:media_ms", int(result.media_seconds * 1000))
+            pipe.hincrby(STATS_KEY, f"{label}:frames", result.frames)
+            if ctx:
+                pipe.hset(job_key(ctx.job_id), mapping={
+                    "ffmpeg_wall": round(result.wall, 2),
+                    "ffmpeg_cpu": round(result.cpu, 2),
+                    "ffmpeg_fps": round(result.fps, 1),
+                    "ffmpeg_speed": round(result.speed, 2),
+                })
+            await pipe.execute()
+    except Exception as e:
+        logger.debug(f"ffmpeg metrics not recorded: {e}")
+
+
+async def stats() -> dict:
+    """Per-label runs, failures, average encode fps, realtime factor and CPU per media second."""
+    redis = await get_redis()
+    if not redis:
+        return {}
+    labels: dict[str, dict] = {}
+    for name, value in (await redis.hgetall(STATS_KEY)).items():
+        label, field = name.rsplit(":", 1)
+        labels.setdefault(label, {})[field] = int(value)
+    for v in labels.values():
+        wall, media = v.get("wall_ms", 0) / 1000, v.get("media_ms", 0) / 1000
+        v["avg_fps"] = round(v.get("frames", 0) / wall, 1) if wall else 0
+        v["realtime"] = round(media / wall, 2) if wall else 0
+        v["cpu_per_media_second"] = round(v.get("cpu_ms", 0) / 1000 / media, 2) if media else 0
+    return labels
@@ -0,0 +1,94 @@
+"""In-memory I/O for the small image tools — no scratch files on the common path.
+
+Telegram photos and most image documents are a few hundred KB to a few
+MB. Downloading them to disk, reopening them with Pillow, writing the
+result and reading it back for the upload is all filesystem churn, so up
+to IMAGE_INLINE_MB the tools stay in memory:
+
+    src = await image_io.fetch(ctx.bot, file_id, ctx.path("in.jpg"))
+    # bytes when small, else the path it was downloaded to
+    out = await ctx.run_sync(_work, src, image_io.output_for(src, ctx.path("out.jpg")))
+    # the child: img = image_io.open_image(src, max_side); return image_io.save(img, dst, "JPEG")
+    document = image_io.input_file(out, ctx.path("out.jpg"), "photo.jpg")
+
+Bytes reach the run_sync child and come back over its pipe — a copy of a
+few MB, still far cheaper than the filesystem round trip. JPEGs that are about to be downscaled are decoded at 1/2–1/8 scale
+via `draft()` — the cheapest resize there is.
+
+`python -m benchmarks.image_bench` compares the disk and in-memory paths.
+"""
+import io
+import os
+from typing import Optional, Union
+
+from aiogram.types import BufferedInputFile, FSInputFile
+
+from bot.config import settings
+
+Source = Union[bytes, str]   # image bytes, or a path for files above the inline limit
+
+INLINE_MAX = settings.IMAGE_INLINE_MB * 1024 * 1024
+
+
+async def fetch(bot, file_id: str, path: str) -> Source:
+    """The file's bytes when it is at most INLINE_MAX, else download it to `path`."""
+    file = await bot.get_file(file_id)
+    if file.file_size and file.file_size <= INLINE_MAX:
+        return (await bot.download_file(file.file_path)).getvalue()
+    await bot.download_file(file.file_path, path)
+    return path
+
+
+def output_for(src: Source, path: str) -> Optional[str]:
+    """Where the result goes: nowhere (return bytes) for inline sources."""
+    return None if isinstance(src, bytes) else path
+
+
+def size_of(src: Source) -> int:
+    return len(src) if isinstance(src, bytes) else os.path.getsize(src)
+
+
+def input_file(result: Union[bytes, bool], path: str, filename: str):
+    """What to send for a tool's result: the bytes it returned, or the file it wrote."""
+    if isinstance(result, bytes):
+        return BufferedInputFile(result, filename=filename)
+    return FSInputFile(path, filename=filename)
+
+
+def result_size(result: Union[bytes, bool], path: str) -> int:
+    return len(result) if isinstance(result, bytes) else os.path.getsize(path)
+
+
+def has_result(result: Union[bytes, bool], path: str) -> bool:
+    if isinstance(result, bytes):
+        return bool(result)
+    return bool(result) and os.path.exists(path)
+
+
+# ── Pillow side (runs in the run_sync child) ─────────────────────────────────
+
+def open_image(src: Source, max_side: Optional[int] = None):
+    """Open `src`; a JPEG that will be scaled to `max_side` is decoded at reduced scale."""
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(src) if isinstance(src, bytes) else src)
+    if max_side and img.format == "JPEG" and max(img.size) > max_side:
+        img.draft(None, (max_side, max_side))  # keeps ≥ max_side, so the final resize stays exact
+    return img
+
+
+def save(img, dst: Optional[str], format: str, **params) -> Union[bytes, bool]:
+    """Encode `img` to the path `dst`, or to bytes when `dst` is None."""
+    if dst:
+        img.save(dst, format, **params)
+        return True
+    buf = io.BytesIO()
+    img.save(buf, format, **params)
+    return buf.getvalue()
+
+
+def format_for(ext: str) -> str:
+    """Pillow format name for a file extension ("jpg" → "JPEG")."""
+    from PIL import Image
+
+    return Image.registered_extensions().get(f".{ext.lower()}", ext.upper())
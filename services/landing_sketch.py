@@ -0,0 +1,164 @@
+"""Landing funnel sketches — approximate unique sessions per stage.
+
+Every funnel beacon from the quiz / course / agency landing pages is folded
+into a HyperLogLog sketch keyed by (landing, event_type, UTC day,
+utm_source). Admin stats merge the sketches covering the requested window,
+so a funnel costs one small indexed read regardless of traffic volume.
+The raw *_events rows are still written for ad-hoc analysis.
+
+Beacons only touch memory: `record` adds the session to a per-process
+sketch for its key, and `flush` (every FLUSH_INTERVAL, started from the
+API lifespan, and once more on shutdown) merges each dirty sketch into its
+row — one locked read-modify-write per key per interval instead of one per
+beacon. Merging is idempotent, so a failed flush is simply retried and
+several processes flushing the same key can't inflate the count. Funnel
+stats lag by up to FLUSH_INTERVAL.
+
+Callers record only after the event row has committed, so a rolled-back
+beacon is never counted. utm_source comes from the client: once MAX_SOURCES
+distinct values have been seen, new ones are counted under "other", which
+keeps the buffer (and the table) bounded whatever the page is sent.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import LandingSessionSketch
+from services.hll import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+LANDING_QUIZ = "quiz"
+LANDING_COURSE = "course"
+LANDING_AGENCY = "agency"
+
+FLUSH_INTERVAL = 10  # seconds
+MAX_SOURCES = 200    # distinct utm_source values per process before "other"
+OTHER_SOURCE = "other"
+
+# (landing, event_type, day, utm_source) → sketch of sessions not yet in the row
+_buffer: dict[tuple, HyperLogLog] = {}
+_sources: set[str] = set()
+
+
+def _source_key(utm_source: Optional[str]) -> str:
+    source = (utm_source or "")[:100]
+    if source in _sources:
+        return source
+    if len(_sources) >= MAX_SOURCES:
+        return OTHER_SOURCE
+    _sources.add(source)
+    return source
+
+
+class LandingSketchService:
+    """Updates and queries per-day HyperLogLog sketches of landing sessions."""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def record(
+        self,
+        landing: str,
+        event_type: str,
+        session_id: str,
+        utm_source: Optional[str] = None,
+        at: Optional[datetime] = None,
+    ):
+        """Add session_id to the sketch for this stage/day/source.
+
+        Call it once the beacon's event row has committed. Buffered in this
+        process; the next `flush` writes it. No database work on the beacon path.
+        """
+        key = (landing, event_type, (at or datetime.utcnow()).date(), _source_key(utm_source))
+        hll = _buffer.get(key)
+        if hll is None:
+            hll = _buffer[key] = HyperLogLog()
+        hll.add(session_id)
+
+    async def merge_into_row(self, key: tuple, hll: HyperLogLog):
+        """Union `hll` into the stored sketch for `key` (row locked FOR UPDATE)."""
+        landing, event_type, day, utm_source = key
+        values = {"landing": landing, "event_type": event_type, "day": day, "utm_source": utm_source}
+        await self.session.execute(
+            pg_insert(LandingSessionSketch)
+            .values(**values, registers=hll.to_bytes())
+            .on_conflict_do_nothing(constraint="uq_landing_sketch_key")
+        )
+        result = await self.session.execute(
+            select(LandingSessionSketch)
+            .where(*(getattr(LandingSessionSketch, k) == v for k, v in values.items()))
+            .with_for_update()
+        )
+        row = result.scalar_one()
+        merged = HyperLogLog.from_bytes(row.registers).merge(hll).to_bytes()
+        if merged != row.registers:
+            row.registers = merged
+
+    async def unique_counts(
+        self,
+        landing: str,
+        event_types: Iterable[str],
+        since: date,
+        utm_source: Optional[str] = None,
+    ) -> dict:
+        """Approximate distinct sessions per event_type since `since` (inclusive)."""
+        event_types = list(event_types)
+        q = (
+            select(LandingSessionSketch.event_type, LandingSessionSketch.registers)
+            .where(
+                LandingSessionSketch.landing == landing,
+                LandingSessionSketch.day >= since,
+                LandingSessionSketch.event_type.in_(event_types),
+            )
+        )
+        if utm_source is not None:
+            q = q.where(LandingSessionSketch.utm_source == utm_source)
+        result = await self.session.execute(q)
+
+        blobs = defaultdict(list)
+        for event_type, registers in result.all():
+            blobs[event_type].append(registers)
+        return {evt: HyperLogLog.merged(blobs[evt]).count() if blobs[evt] else 0 for evt in event_types}
+
+
+# ── Flushing ─────────────────────────────────────────────────────────────────
+
+async def flush():
+    """Merge every buffered sketch into its row, in one transaction."""
+    global _buffer
+    if not _buffer:
+        return
+    from db.database import async_session
+
+    pending, _buffer = _buffer, {}
+    try:
+        async with async_session() as session:
+            service = LandingSketchService(session)
+            for key in sorted(pending):  # same lock order in every process
+                await service.merge_into_row(key, pending[key])
+            await session.commit()
+    except Exception as e:
+        logger.warning(f"Landing sketch flush failed, keeping {len(pending)} sketches for the next one: {e}")
+        for key, hll in pending.items():  # merge is idempotent — nothing double-counts
+            if key in _buffer:
+                _buffer[key].merge(hll)
+            else:
+                _buffer[key] = hll
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await flush()
+
+
+def start_flusher():
+    """Starts the periodic sketch flush in the background."""
+    asyncio.create_task(_flush_loop())
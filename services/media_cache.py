@@ -0,0 +1,309 @@
+"""Conversion result cache — the same input never gets converted twice.
+
+Viral videos and documents get forwarded to the bot over and over; each
+copy carries the same Telegram `file_unique_id`. A finished conversion is
+remembered under
+
+    (tool, file_unique_id, options)   e.g. ("fileconvert", "AgAD…", {"target": "mp3"})
+
+as the `file_id` Telegram assigned to the *result* when we sent it. A hit
+re-sends that file_id: no download, no ffmpeg, no upload. Tools whose
+input is text (voicer) use a hash of the text as the source id.
+
+Entries live in Redis for ENTRY_TTL (or the `ttl` given to `store`) with a
+small in-process LRU in front (and standing in when Redis is down). A
+local copy of a Redis entry is trusted for LOCAL_TTL at most, so another
+process's `drop()` reaches this one quickly; without Redis it keeps the
+entry's own TTL. `stats()` reports hits, misses and
+bytes saved (input download + output upload avoided) per tool —
+GET /api/admin/media-cache.
+
+Single-flight: `claim_inflight()` lets one request produce a result while
+concurrent requests for the same key wait; `finish_inflight()` answers
+the waiters from the leader's cache entry (one download, one upload).
+A leader job that never runs (cancelled while queued, out of worker
+attempts) releases the claim through its tool's `on_abandoned` hook.
+
+Bump CACHE_VERSION when a tool's output for the same options changes.
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from services.media_jobs import get_redis
+
+logger = logging.getLogger("media_cache")
+
+CACHE_VERSION = 1
+ENTRY_TTL = 30 * 86400
+LOCAL_ENTRIES = 2048
+LOCAL_TTL = 60       # seconds a local copy of a Redis entry is used before re-reading it
+STATS_KEY = "media:cache:stats"
+INFLIGHT_TTL = 1200  # a leader that died frees the key after this long
+
+# KEYS[1] = inflight marker, KEYS[2] = waiters list; ARGV = owner, waiter json, ttl.
+# Atomic so a waiter can't be appended after the leader drained the list.
+_CLAIM_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+# result kind → (Bot method, file argument); also the Message attribute holding the file
+SENDERS = {
+    "video": ("send_video", "video"),
+    "animation": ("send_animation", "animation"),
+    "audio": ("send_audio", "audio"),
+    "voice": ("send_voice", "voice"),
+    "video_note": ("send_video_note", "video_note"),
+    "photo": ("send_photo", "photo"),
+    "document": ("send_document", "document"),
+}
+
+_local: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()  # key → (expires at, entry)
+_local_stats: dict[str, int] = {}
+_local_inflight: dict[str, list] = {}
+
+
+def text_source(*parts: str) -> str:
+    """Source id for text inputs (voicer): a hash instead of a file_unique_id."""
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()[:32]
+
+
+def cache_key(tool: str, source: str, options: Optional[dict] = None) -> str:
+    opts = json.dumps(options or {}, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha1(f"{CACHE_VERSION}|{opts}".encode()).hexdigest()[:16]
+    return f"media:cache:{tool}:{source}:{digest}"
+
+
+def _remember(key: str, entry: dict, ttl: float):
+    _local[key] = (time.monotonic() + ttl, entry)
+    _local.move_to_end(key)
+    while len(_local) > LOCAL_ENTRIES:
+        _local.popitem(last=False)
+
+
+async def _count(tool: str, field: str, amount: int = 1):
+    name = f"{tool}:{field}"
+    redis = await get_redis()
+    if redis:
+        try:
+            await redis.hincrby(STATS_KEY, name, amount)
+            return
+        except Exception:
+            pass
+    _local_stats[name] = _local_stats.get(name, 0) + amount
+
+
+async def peek(tool: str, source: Optional[str], options: Optional[dict] = None) -> Optional[dict]:
+    """The cached result entry, or None — without touching the stats."""
+    if not source:
+        return None
+    key = cache_key(tool, source, options)
+    local = _local.get(key)
+    if local is not None:
+        expires_at, entry = local
+        if time.monotonic() < expires_at:
+            return entry
+        del _local[key]
+    entry = None
+    redis = await get_redis()
+    if redis:
+        try:
+            raw = await redis.get(key)
+            entry = json.loads(raw) if raw else None
+        except Exception as e:
+            logger.warning(f"Media cache lookup failed: {e}")
+    if entry is not None:
+        _remember(key, entry, LOCAL_TTL)
+    return entry
+
+
+async def lookup(tool: str, source: Optional[str], options: Optional[dict] = None) -> Optional[dict]:
+    """The cached result entry, or None (counted as a miss)."""
+    if not source:
+        return None
+    entry = await peek(tool, source, options)
+    await _count(tool, "hits" if entry else "misses")
+    return entry
+
+
+def sent_file(message, kind: str) -> Optional[tuple[str, str, int]]:
+    """(kind, file_id, file_size) of what a send_* call actually delivered.
+
+    Telegram may deliver a different kind than requested (e.g. a video
+    sent as a document), so fall back through the other attributes.
+    """
+    for attr in (kind, *SENDERS):
+        obj = getattr(message, attr, None)
+        if isinstance(obj, list):
+            obj = obj[-1] if obj else None
+        if obj is not None and getattr(obj, "file_id", None):
+            return attr, obj.file_id, obj.file_size or 0
+    return None
+
+
+async def store(
+    tool: str,
+    source: Optional[str],
+    options: Optional[dict],
+    message,
+    kind: str,
+    caption: Optional[str] = None,
+    parse_mode: Optional[str] = None,
+    input_size: int = 0,
+    ttl: int = ENTRY_TTL,
+) -> Optional[dict]:
+    """Remember the result `message` we just sent for (tool, source, options)."""
+    if not source or message is None:
+        return None
+    found = sent_file(message, kind)
+    if not found:
+        return None
+    kind, file_id, output_size = found
+    entry = {
+        "kind": kind,
+        "file_id": file_id,
+        "caption": caption,
+        "parse_mode": parse_mode,
+        "bytes": input_size + output_size,
+    }
+    key = cache_key(tool, source, options)
+    local_ttl = ttl  # standing in for Redis: the entry's own lifetime
+    redis = await get_redis()
+    if redis:
+        try:
+            await redis.set(key, json.dumps(entry, ensure_ascii=False), ex=ttl)
+            local_ttl = min(ttl, LOCAL_TTL)
+        except Exception as e:
+            logger.warning(f"Media cache store failed: {e}")
+    _remember(key, entry, local_ttl)
+    return entry
+
+
+async def send_cached(bot, chat_id: int, tool: str, source: str, options: Optional[dict], entry: dict) -> bool:
+    """Answer from the cache. False (and the entry is dropped) if Telegram rejects the file_id."""
+    method, arg = SENDERS[entry["kind"]]
+    kwargs = {arg: entry["file_id"]}
+    if entry.get("caption") and entry["kind"] != "video_note":
+        kwargs["caption"] = entry["caption"]
+        kwargs["parse_mode"] = entry.get("parse_mode")
+    try:
+        await getattr(bot, method)(chat_id, **kwargs)
+    except Exception as e:
+        if "VOICE_MESSAGES_FORBIDDEN" in str(e):
+            raise  # the user's privacy setting, not a stale entry
+        logger.warning(f"Cached {tool} result rejected, dropping: {e}")
+        await drop(tool, source, options)
+        return False
+    await _count(tool, "bytes_saved", int(entry.get("bytes") or 0))
+    return True
+
+
+async def try_cached(bot, chat_id: int, tool: str, source: Optional[str], options: Optional[dict] = None) -> bool:
+    """lookup + send_cached: True if the user was answered from the cache."""
+    entry = await lookup(tool, source, options)
+    return bool(entry) and await send_cached(bot, chat_id, tool, source, options, entry)
+
+
+async def drop(tool: str, source: str, options: Optional[dict] = None):
+    key = cache_key(tool, source, options)
+    _local.pop(key, None)
+    redis = await get_redis()
+    if redis:
+        try:
+            await redis.delete(key)
+        except Exception:
+            pass
+
+
+# ── Single-flight ────────────────────────────────────────────────────────────
+
+def _inflight_keys(tool: str, source: str) -> tuple[str, str]:
+    return f"media:inflight:{tool}:{source}", f"media:waiters:{tool}:{source}"
+
+
+async def claim_inflight(tool: str, source: str, chat_id: int, message_id: int) -> bool:
+    """True: the caller is the leader and must call finish_inflight() when done.
+    False: another request is already producing this result; the caller's
+    status message was queued and will be answered by the leader.
+    """
+    marker, waiters = _inflight_keys(tool, source)
+    waiter = json.dumps({"chat_id": chat_id, "message_id": message_id})
+    redis = await get_redis()
+    if redis:
+        try:
+            return bool(await redis.eval(_CLAIM_LUA, 2, marker, waiters, chat_id, waiter, INFLIGHT_TTL))
+        except Exception as e:
+            logger.warning(f"Single-flight claim failed, proceeding alone: {e}")
+            return True
+    if marker in _local_inflight:
+        _local_inflight[marker].append(waiter)
+        return False
+    _local_inflight[marker] = []
+    return True
+
+
+async def finish_inflight(
+    bot, tool: str, source: str, entry: Optional[dict], fail_text: str, options: Optional[dict] = None,
+):
+    """Leader is done: answer every waiter from `entry`, or tell them it failed."""
+    marker, waiters = _inflight_keys(tool, source)
+    pending = _local_inflight.pop(marker, [])
+    redis = await get_redis()
+    if redis:
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.lrange(waiters, 0, -1)
+                pipe.delete(waiters, marker)
+                queued, _ = await pipe.execute()
+            pending.extend(queued)
+        except Exception as e:
+            logger.warning(f"Single-flight release failed: {e}")
+
+    for raw in pending:
+        w = json.loads(raw)
+        try:
+            if entry:
+                await _count(tool, "hits")
+                if await send_cached(bot, w["chat_id"], tool, source, options, entry):
+                    await bot.delete_message(w["chat_id"], w["message_id"])
+                    continue
+            await bot.edit_message_text(fail_text, chat_id=w["chat_id"], message_id=w["message_id"])
+        except Exception as e:
+            logger.debug(f"Single-flight waiter {w['chat_id']} not answered: {e}")
+
+
+async def stats() -> dict:
+    """Per-tool hits / misses / hit_rate / bytes_saved."""
+    counters = dict(_local_stats)
+    redis = await get_redis()
+    if redis:
+        try:
+            for name, value in (await redis.hgetall(STATS_KEY)).items():
+                counters[name] = counters.get(name, 0) + int(value)
+        except Exception:
+            pass
+    tools: dict[str, dict] = {}
+    for name, value in counters.items():
+        tool, field = name.rsplit(":", 1)
+        tools.setdefault(tool, {"hits": 0, "misses": 0, "bytes_saved": 0})[field] = value
+    for t in tools.values():
+        t["hit_rate"] = round(t["hits"] / max(t["hits"] + t["misses"], 1), 3)
+    total_hits = sum(t["hits"] for t in tools.values())
+    total_lookups = total_hits + sum(t["misses"] for t in tools.values())
+    return {
+        "hits": total_hits,
+        "misses": total_lookups - total_hits,
+        "hit_rate": round(total_hits / max(total_lookups, 1), 3),
+        "bytes_saved": sum(t["bytes_saved"] for t in tools.values()),
+        "local_entries": len(_local),
+        "tools": tools,
+    }
@@ -0,0 +1,149 @@
+"""Size-targeted video encoding — land under a byte budget on the first try.
+
+    path = await fit_to_size(src, dst, TELEGRAM_TARGET)
+
+1. Already within the budget: returned as is, no ffmpeg at all — except
+   H.264 + AAC/MP3 in another container (MKV/MOV), which is remuxed to
+   MP4 with `-c copy` in seconds so Telegram plays it inline.
+2. Otherwise the video bitrate is computed from the probed duration
+   (budget minus audio minus container overhead) and encoded with
+   two-pass libx264, which hits an average bitrate closely. The
+   resolution steps down when the bitrate is too low for it. Should the
+   result still overshoot, one retry scales the bitrate by the miss.
+
+Without a known duration there is nothing to divide by; a capped CRF
+encode (-maxrate/-bufsize from the budget over a 10-minute guess) is
+used and the size checked.
+
+Returns the path of a file within the budget, or None.
+"""
+import glob
+import logging
+import os
+from typing import Optional
+
+from services.ffmpeg_runner import run_ffmpeg
+from services.media_probe import MediaInfo, ffmpeg_path, probe
+
+logger = logging.getLogger("media_encode")
+
+TELEGRAM_LIMIT = 50 * 1024 * 1024
+TELEGRAM_TARGET = 48 * 1024 * 1024
+MUX_OVERHEAD = 0.98        # MP4 headers / index share of the budget
+AUDIO_KBPS = 96
+MIN_VIDEO_KBPS = 120
+GUESS_DURATION = 600       # seconds, capped-CRF fallback only
+ENCODE_TIMEOUT = 900
+REMUX_TIMEOUT = 120
+
+PLAYABLE_VIDEO = {"h264"}
+PLAYABLE_AUDIO = {"aac", "mp3"}
+
+# (minimum video kbit/s, max output height) — lower bitrates get fewer pixels
+HEIGHT_LADDER = ((2500, 1080), (1200, 720), (600, 480), (0, 360))
+
+
+def _playable(info: MediaInfo) -> bool:
+    return info.video_codec in PLAYABLE_VIDEO and (not info.has_audio or info.audio_codec in PLAYABLE_AUDIO)
+
+
+def _max_height(video_kbps: int) -> int:
+    return next(height for floor, height in HEIGHT_LADDER if video_kbps >= floor)
+
+
+def _fits(path: str, target_bytes: int) -> bool:
+    return os.path.exists(path) and 0 < os.path.getsize(path) <= target_bytes
+
+
+async def remux(src: str, dst: str, ctx=None) -> bool:
+    """Copy streams into MP4 (faststart) without re-encoding."""
+    result = await run_ffmpeg([
+        "-i", src, "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy", "-movflags", "+faststart", dst,
+    ], ctx=ctx, label="remux", timeout=REMUX_TIMEOUT)
+    return result.ok
+
+
+async def _two_pass(src: str, dst: str, info: MediaInfo, video_kbps: int, audio_kbps: int, ctx=None) -> bool:
+    passlog = dst + ".2pass"
+    scale = []
+    height = _max_height(video_kbps)
+    if info.height > height:
+        scale = ["-vf", f"scale=-2:{height}"]
+    common = ["-c:v", "libx264", "-preset", "fast", "-b:v", f"{video_kbps}k", *scale, "-passlogfile", passlog]
+    try:
+        first = await run_ffmpeg(
+            ["-i", src, *common, "-pass", "1", "-an", "-f", "null", os.devnull],
+            ctx=ctx, label="encode:pass1", duration=info.duration, timeout=ENCODE_TIMEOUT,
+            progress_text="🗜 Siqilmoqda (1/2): {percent}%",
+        )
+        if not first.ok:
+            return False
+        audio = ["-c:a", "aac", "-b:a", f"{audio_kbps}k"] if info.has_audio else ["-an"]
+        second = await run_ffmpeg(
+            ["-i", src, *common, "-pass", "2", *audio, "-movflags", "+faststart", dst],
+            ctx=ctx, label="encode:pass2", duration=info.duration, timeout=ENCODE_TIMEOUT,
+            progress_text="🗜 Siqilmoqda (2/2): {percent}%",
+        )
+        return second.ok
+    finally:
+        for f in glob.glob(passlog + "*"):
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+
+async def _capped_crf(src: str, dst: str, info: MediaInfo, target_bytes: int, ctx=None) -> bool:
+    cap = max(int(target_bytes * 8 / 1000 / GUESS_DURATION) - AUDIO_KBPS, MIN_VIDEO_KBPS)
+    audio = ["-c:a", "aac", "-b:a", f"{AUDIO_KBPS}k"] if info.has_audio else ["-an"]
+    result = await run_ffmpeg([
+        "-i", src, "-c:v", "libx264", "-preset", "fast", "-crf", "28",
+        "-maxrate", f"{cap}k", "-bufsize", f"{cap * 2}k", *audio, "-movflags", "+faststart", dst,
+    ], ctx=ctx, label="encode:crf", timeout=ENCODE_TIMEOUT)
+    return result.ok
+
+
+async def fit_to_size(
+    src: str, dst: str, target_bytes: int = TELEGRAM_TARGET, info: Optional[MediaInfo] = None, ctx=None,
+) -> Optional[str]:
+    """`src` if it already fits, else `dst` remuxed/encoded within `target_bytes`; None if impossible.
+
+    With a job `ctx` the encode reports its progress on the status message.
+    """
+    if not ffmpeg_path():
+        return src if _fits(src, target_bytes) else None
+    info = info or await probe(src)
+    if info is None or not info.has_video:
+        return src if _fits(src, target_bytes) else None
+
+    size = os.path.getsize(src)
+    if size <= target_bytes:
+        if not _playable(info) or info.is_mp4:
+            return src  # fits; re-encoding would only cost quality
+        if await remux(src, dst, ctx) and _fits(dst, target_bytes):
+            return dst
+        return src
+
+    if info.duration <= 0:
+        return dst if await _capped_crf(src, dst, info, target_bytes, ctx) and _fits(dst, target_bytes) else None
+
+    total_kbps = int(target_bytes * 8 * MUX_OVERHEAD / 1000 / info.duration)
+    audio_kbps = min(info.audio_bitrate or AUDIO_KBPS, AUDIO_KBPS) if info.has_audio else 0
+    video_kbps = total_kbps - audio_kbps
+    if info.video_bitrate:
+        video_kbps = min(video_kbps, info.video_bitrate)  # never inflate a low-bitrate source
+    if video_kbps < MIN_VIDEO_KBPS:
+        logger.info(f"{src}: {info.duration:.0f}s can't fit {target_bytes} bytes ({video_kbps} kbit/s video)")
+        return None
+
+    for _ in range(2):
+        if not await _two_pass(src, dst, info, video_kbps, audio_kbps, ctx):
+            return None
+        out_size = os.path.getsize(dst)
+        if out_size <= target_bytes:
+            logger.info(f"Encoded {size} → {out_size} bytes at {video_kbps} kbit/s ({info.duration:.0f}s)")
+            return dst
+        video_kbps = int(video_kbps * target_bytes / out_size * 0.95)
+        if video_kbps < MIN_VIDEO_KBPS:
+            break
+    return None
@@ -0,0 +1,534 @@
+"""Media job queue — Superapp tools run in worker processes, not the web loop.
+
+The tool handlers (videonote, mediadown, fileconvert, compressor, scanner,
+bg_remover) only validate input and call `submit()`. The heavy part of
+each tool — ffmpeg, yt-dlp, OpenCV, Pillow, PyMuPDF, LibreOffice — is an
+`async def run_job(ctx, payload)` in the same handler module, executed by
+
+    python -m services.media_worker
+
+which keeps TOOLS[tool].concurrency worker processes per tool, each
+niced and capped by RLIMIT_AS (services/media_worker.py).
+
+Redis layout (all keys expire after JOB_TTL):
+  media:q:<tool>        list of queued job ids (FIFO)
+  media:run:<tool>:<n>  the job worker n has taken (requeued if it died)
+  media:job:<id>        hash: tool, chat_id, message_id, payload, status, ...
+  media:cancel:<id>     set by the ❌ button; the running job watches it
+  media:alive:<tool>    worker heartbeat; no heartbeat → run inline
+
+While queued, the status message shows the queue position and a cancel
+button; while running, the tool edits it per stage via `ctx.stage()`.
+Each job writes into its own scratch directory, admitted against the
+scratch quota with TOOLS[tool].scratch_mb reserved (services/scratch.py).
+Every job has a wall-clock timeout (TOOLS[tool].timeout); timeout and
+cancel kill the job's subprocesses (`run_command`, ffmpeg_runner) and child-process CPU work
+(`ctx.run_sync`).
+
+A tool module may also define `async def on_abandoned(bot, payload)`:
+it runs when a job ends without its run_job ever starting (cancelled in
+the queue or while waiting for a slot, no scratch space, out of worker
+attempts), so whatever the handler claimed at submit time is released.
+
+Without Redis or without a live worker the job runs in this process,
+still bounded by a per-tool semaphore, with CPU-bound Python in child
+processes — so the bot degrades to the old behaviour, never breaks.
+"""
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Callable, NamedTuple, Optional
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.config import settings
+from services import scratch
+
+logger = logging.getLogger("media_jobs")
+
+JOB_TTL = 86400
+HEARTBEAT_TTL = 30       # seconds a worker heartbeat stays valid
+CANCEL_POLL = 1.0        # how often a running job checks the cancel flag
+STAGE_MIN_INTERVAL = 2.0  # Telegram edit throttle for progress updates
+LOCAL_STATUS_KEEP = 500
+REDIS_RETRY = 30         # seconds before a failed Redis connect is tried again
+
+
+class ToolSpec(NamedTuple):
+    module: str        # handler module exposing `async def run_job(ctx, payload)`
+    concurrency: int   # worker processes per tool (and inline semaphore size)
+    timeout: int       # seconds, wall clock, per job
+    scratch_mb: int    # scratch space reserved per job (services/scratch.py)
+
+
+TOOLS: dict[str, ToolSpec] = {
+    "videonote":   ToolSpec("bot.handlers.videonote", 2, 300, 250),
+    "mediadown":   ToolSpec("bot.handlers.mediadown", 2, 900, 1024),
+    "fileconvert": ToolSpec("bot.handlers.fileconvert", 2, 300, 300),
+    "compressor":  ToolSpec("bot.handlers.compressor", 2, 900, 600),
+    "scanner":     ToolSpec("bot.handlers.scanner", 1, 300, 100),
+    "bg_remover":  ToolSpec("bot.handlers.bg_remover", 2, 180, 30),
+}
+
+
+def queue_key(tool: str) -> str:
+    return f"media:q:{tool}"
+
+
+def running_key(tool: str, worker: int) -> str:
+    return f"media:run:{tool}:{worker}"
+
+
+def job_key(job_id: str) -> str:
+    return f"media:job:{job_id}"
+
+
+def cancel_key(job_id: str) -> str:
+    return f"media:cancel:{job_id}"
+
+
+def alive_key(tool: str) -> str:
+    return f"media:alive:{tool}"
+
+
+def cancel_keyboard(job_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Bekor qilish", callback_data=f"mjob:cancel:{job_id}")]
+    ])
+
+
+def queued_text(position: int) -> str:
+    return f"🕒 Navbatdasiz: <b>{position}</b>-o'rin.\nNavbatingiz kelganda ish avtomatik boshlanadi."
+
+
+_redis = None
+_redis_retry_at = 0.0
+
+
+async def get_redis():
+    """Shared redis.asyncio client, or None when Redis is unreachable.
+
+    A failed connect is retried after REDIS_RETRY seconds, so a Redis that
+    was down at startup doesn't leave the process inline for good.
+    """
+    global _redis, _redis_retry_at
+    if _redis is None and time.monotonic() >= _redis_retry_at:
+        _redis_retry_at = time.monotonic() + REDIS_RETRY  # concurrent callers don't pile up on the ping
+        try:
+            import redis.asyncio as aioredis
+            client = aioredis.from_url(settings.get_redis_url, decode_responses=True)
+            await client.ping()
+            _redis = client
+        except Exception as e:
+            logger.warning(f"Redis unavailable for media jobs, running tools inline (retry in {REDIS_RETRY}s): {e}")
+    return _redis
+
+
+# ── Process helpers (used by the tools' run_job) ─────────────────────────────
+
+async def run_command(cmd: list[str], timeout: Optional[float] = None) -> tuple[int, bytes, bytes]:
+    """Run a subprocess; it is killed if the caller is cancelled or times out.
+
+    Returns (returncode, stdout, stderr). Raises asyncio.TimeoutError.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    return proc.returncode, stdout, stderr
+
+
+def _call_in_child(conn, fn: Callable, args: tuple):
+    try:
+        conn.send((True, fn(*args)))
+    except BaseException as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+_mp_context = None
+
+
+def _child_context():
+    """forkserver: children fork from a clean single-threaded server, never from
+    this process — forking the threaded web process can deadlock on locks held
+    by its other threads. The tool modules are preloaded so a child starts fast."""
+    global _mp_context
+    if _mp_context is None:
+        _mp_context = multiprocessing.get_context("forkserver")
+        _mp_context.set_forkserver_preload([spec.module for spec in TOOLS.values()])
+    return _mp_context
+
+
+async def run_sync(fn: Callable, *args) -> Any:
+    """Run CPU-bound `fn(*args)` in a child process.
+
+    Unlike run_in_executor, the work neither holds this process's GIL nor
+    outlives a cancel/timeout: the child is killed. `fn` must be a
+    module-level function, and its args and result picklable (the tools
+    pass paths / image bytes and return bools / bytes / short tuples).
+    """
+    loop = asyncio.get_running_loop()
+    ctx = _child_context()
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_call_in_child, args=(child, fn, args), daemon=True)
+    proc.start()
+    child.close()
+    ready = loop.create_future()
+    loop.add_reader(parent.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+        try:
+            ok, value = parent.recv()
+        except EOFError:
+            proc.join(1)
+            raise RuntimeError(f"media child process died (exit code {proc.exitcode})")
+        if not ok:
+            raise RuntimeError(value)
+        return value
+    finally:
+        loop.remove_reader(parent.fileno())
+        parent.close()
+        if proc.is_alive():
+            proc.kill()
+        proc.join(1)
+
+
+# ── Job context ──────────────────────────────────────────────────────────────
+
+class JobContext:
+    """What a tool's run_job gets: the chat, the status message and helpers."""
+
+    def __init__(self, job_id: str, tool: str, chat_id: int, message_id: Optional[int], bot):
+        self.job_id = job_id
+        self.tool = tool
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.bot = bot
+        self.scratch: Optional[scratch.ScratchDir] = None   # acquired when the job starts
+        self._last_edit = 0.0
+        self._last_text = None
+        self.failure: Optional[str] = None   # set by fail(); the job then ends as "failed"
+        self.started = False                 # run_job was entered (it cleans up after itself)
+
+    run_command = staticmethod(run_command)
+    run_sync = staticmethod(run_sync)
+
+    @property
+    def temp_dir(self) -> str:
+        if self.scratch:
+            return self.scratch.dir
+        return os.path.join(scratch.ROOT, f"job_{self.job_id}")
+
+    def path(self, name: str) -> str:
+        """A path inside this job's private temp dir (removed when the job ends)."""
+        os.makedirs(self.temp_dir, exist_ok=True)
+        return os.path.join(self.temp_dir, name)
+
+    async def edit(self, text: str, parse_mode: Optional[str] = None, final: bool = False):
+        """Edit the status message. Non-final edits keep the cancel button."""
+        if not self.message_id or text == self._last_text:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=self.chat_id, message_id=self.message_id, parse_mode=parse_mode,
+                reply_markup=None if final else cancel_keyboard(self.job_id),
+            )
+            self._last_text = text
+            self._last_edit = time.monotonic()
+        except Exception as e:
+            logger.debug(f"[{self.tool} {self.job_id}] status edit failed: {e}")
+
+    async def stage(self, text: str, parse_mode: Optional[str] = None):
+        """Progress update, throttled to one edit per STAGE_MIN_INTERVAL."""
+        if time.monotonic() - self._last_edit < STAGE_MIN_INTERVAL:
+            return
+        await self.edit(text, parse_mode)
+
+    async def fail(self, text: str, parse_mode: Optional[str] = None):
+        self.failure = text
+        await self.edit(text, parse_mode, final=True)
+
+    async def delete_status(self):
+        if not self.message_id:
+            return
+        try:
+            await self.bot.delete_message(self.chat_id, self.message_id)
+        except Exception:
+            pass
+        self.message_id = None
+
+    def cleanup(self):
+        if self.scratch:
+            self.scratch.release()
+        else:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+# ── Execution ────────────────────────────────────────────────────────────────
+
+def _load_runner(tool: str, name: str = "run_job"):
+    return getattr(importlib.import_module(TOOLS[tool].module), name, None)
+
+
+async def abandon(job: dict, bot):
+    """The job ended before its run_job started: call the tool's on_abandoned hook."""
+    hook = _load_runner(job["tool"], "on_abandoned")
+    if not hook:
+        return
+    payload = json.loads(job["payload"]) if isinstance(job["payload"], str) else job["payload"]
+    try:
+        await hook(bot, payload)
+    except Exception as e:
+        logger.warning(f"[{job['tool']} {job['id']}] on_abandoned failed: {e}")
+
+
+async def _run_tool(ctx: JobContext, payload: dict):
+    # waits (within the job timeout) until the tool's scratch reservation fits
+    ctx.scratch = await scratch.acquire(f"job_{ctx.job_id}", TOOLS[ctx.tool].scratch_mb * scratch.MB)
+    ctx.started = True
+    await _load_runner(ctx.tool)(ctx, payload)
+
+
+async def _watch_cancel(redis, job_id: str, task: asyncio.Task):
+    while not task.done():
+        await asyncio.sleep(CANCEL_POLL)
+        try:
+            if await redis.exists(cancel_key(job_id)):
+                task.cancel(msg="user")
+                return
+        except Exception:
+            pass
+
+
+async def execute(job: dict, bot, redis=None) -> str:
+    """Run one job to completion; returns its final status."""
+    tool, job_id = job["tool"], job["id"]
+    spec = TOOLS[tool]
+    ctx = JobContext(job_id, tool, int(job["chat_id"]), int(job["message_id"]) if job.get("message_id") else None, bot)
+    payload = json.loads(job["payload"]) if isinstance(job["payload"], str) else job["payload"]
+
+    if redis:
+        await redis.hset(job_key(job_id), mapping={"status": "running", "started_at": int(time.time())})
+    else:
+        _remember_status(job, "running")
+    if job.get("position"):
+        await ctx.edit("⚙️ Navbatingiz keldi, ishlanmoqda...")
+
+    started = time.monotonic()
+    task = asyncio.create_task(_run_tool(ctx, payload))
+    _local_tasks[job_id] = task
+    watcher = asyncio.create_task(_watch_cancel(redis, job_id, task)) if redis else None
+    status, error = "done", ""
+    try:
+        await asyncio.wait_for(asyncio.shield(task), spec.timeout)
+    except asyncio.TimeoutError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        status = "timeout"
+        await ctx.fail(f"⌛ Vaqt tugadi ({spec.timeout // 60} daqiqa). Iltimos, kichikroq fayl bilan qayta urinib ko'ring.")
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            task.cancel()  # the worker itself is shutting down
+            raise
+        status = "cancelled"
+        await ctx.fail("❌ Bekor qilindi.")
+    except scratch.ScratchFull as e:
+        status, error = "failed", str(e)
+        logger.warning(f"[{tool} {job_id}] no scratch space: {e}")
+        await ctx.fail("⚠️ Server hozir band. Iltimos, birozdan so'ng qayta urinib ko'ring.")
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"[:500]
+        logger.exception(f"[{tool} {job_id}] job failed")
+        await ctx.fail("❌ Tizimda xatolik yuz berdi. Iltimos keyinroq qayta urinib ko'ring.")
+    finally:
+        _local_tasks.pop(job_id, None)
+        if watcher:
+            watcher.cancel()
+        ctx.cleanup()
+
+    if not ctx.started:  # not reached when the worker itself shuts down: that job is requeued
+        await abandon(job, bot)
+
+    if status == "done" and ctx.failure:
+        status, error = "failed", ctx.failure[:500]  # the tool reported the error itself
+    elapsed = time.monotonic() - started
+    logger.info(f"[{tool} {job_id}] {status} in {elapsed:.1f}s")
+    if not redis:
+        _remember_status(job, status, error)
+    else:
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(job_key(job_id), mapping={"status": status, "error": error, "finished_at": int(time.time())})
+                pipe.delete(cancel_key(job_id))
+                await pipe.execute()
+        except Exception:
+            pass
+    return status
+
+
+# ── Submission / cancellation (web process) ──────────────────────────────────
+
+_local_tasks: dict[str, asyncio.Task] = {}
+_local_owners: dict[str, int] = {}
+_local_status: dict[str, dict] = {}   # job_status() without Redis; last LOCAL_STATUS_KEEP jobs
+
+
+def _remember_status(job: dict, status: str, error: str = ""):
+    _local_status[job["id"]] = {"tool": job["tool"], "chat_id": str(job["chat_id"]), "status": status, "error": error}
+    while len(_local_status) > LOCAL_STATUS_KEEP:
+        _local_status.pop(next(iter(_local_status)))
+
+
+_inline_limits: dict[str, asyncio.Semaphore] = {}
+
+
+async def _workers_alive(redis, tool: str) -> bool:
+    try:
+        return bool(await redis.exists(alive_key(tool)))
+    except Exception:
+        return False
+
+
+async def _run_inline(job: dict, bot, redis=None):
+    sem = _inline_limits.setdefault(job["tool"], asyncio.Semaphore(TOOLS[job["tool"]].concurrency))
+    entered = False
+    try:
+        async with sem:
+            entered = True
+            await execute(job, bot, redis)
+    except asyncio.CancelledError:
+        # cancelled while still waiting for a free slot
+        ctx = JobContext(job["id"], job["tool"], job["chat_id"], job["message_id"] or None, bot)
+        await ctx.fail("❌ Bekor qilindi.")
+        if not entered:
+            await abandon(job, bot)
+    finally:
+        _local_owners.pop(job["id"], None)
+
+
+async def submit(
+    tool: str, bot, chat_id: int, message_id: Optional[int], payload: dict, local: bool = False,
+) -> str:
+    """Queue a media job for `tool`; `message_id` is the status message to edit.
+
+    `local=True` keeps the job in this process — for payloads pointing at
+    files on this machine (Mini App uploads), which a worker on another
+    host couldn't read.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    job = {
+        "id": job_id,
+        "tool": tool,
+        "chat_id": chat_id,
+        "message_id": message_id or "",
+        "payload": json.dumps(payload, ensure_ascii=False),
+        "status": "queued",
+        "created_at": int(time.time()),
+    }
+
+    redis = await get_redis()
+    if redis and not local and await _workers_alive(redis, tool):
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hset(job_key(job_id), mapping=job)
+                pipe.expire(job_key(job_id), JOB_TTL)
+                pipe.rpush(queue_key(tool), job_id)
+                *_, position = await pipe.execute()
+            if message_id:
+                try:
+                    await bot.edit_message_text(
+                        queued_text(position), chat_id=chat_id, message_id=message_id,
+                        parse_mode="HTML", reply_markup=cancel_keyboard(job_id),
+                    )
+                    await redis.hset(job_key(job_id), "position", position)
+                except Exception:
+                    pass
+            logger.info(f"[{tool} {job_id}] queued at position {position}")
+            return job_id
+        except Exception as e:
+            logger.warning(f"[{tool} {job_id}] enqueue failed, running inline: {e}")
+
+    if redis:
+        try:  # the hash backs job_status() for inline jobs too
+            await redis.hset(job_key(job_id), mapping=job)
+            await redis.expire(job_key(job_id), JOB_TTL)
+        except Exception:
+            redis = None
+    if not redis:
+        _remember_status(job, "queued")
+    _local_owners[job_id] = chat_id
+    _local_tasks[job_id] = asyncio.create_task(_run_inline(job, bot, redis))
+    return job_id
+
+
+async def job_status(job_id: str) -> Optional[dict]:
+    """{"tool", "chat_id", "status", "error", ...} of a job, or None if unknown/expired."""
+    redis = await get_redis()
+    if redis:
+        try:
+            job = await redis.hgetall(job_key(job_id))
+            if job:
+                job.pop("payload", None)
+                return job
+        except Exception:
+            pass
+    return _local_status.get(job_id)
+
+
+async def cancel(job_id: str, chat_id: int, bot=None) -> bool:
+    """Cancel a queued or running job owned by `chat_id`. False if not found."""
+    if _local_owners.get(job_id) == chat_id:
+        task = _local_tasks.get(job_id)
+        if task:
+            task.cancel(msg="user")
+        return True
+
+    redis = await get_redis()
+    if not redis:
+        return False
+    job = await redis.hgetall(job_key(job_id))
+    if not job or str(job.get("chat_id")) != str(chat_id):
+        return False
+    if job.get("status") not in ("queued", "running"):
+        return False
+
+    if await redis.lrem(queue_key(job["tool"]), 1, job_id):
+        await redis.hset(job_key(job_id), "status", "cancelled")
+        if bot:
+            await abandon(dict(job, id=job_id), bot)
+        return True
+    await redis.set(cancel_key(job_id), 1, ex=JOB_TTL)
+    return True
+
+
+async def refresh_positions(bot, redis, window: int = 20):
+    """Edit waiting jobs' status messages when their queue position changed."""
+    for tool in TOOLS:
+        ids = await redis.lrange(queue_key(tool), 0, window - 1)
+        for position, job_id in enumerate(ids, start=1):
+            job = await redis.hmget(job_key(job_id), "chat_id", "message_id", "position")
+            chat_id, message_id, shown = job
+            if not chat_id or not message_id or shown == str(position):
+                continue
+            try:
+                await bot.edit_message_text(
+                    queued_text(position), chat_id=int(chat_id), message_id=int(message_id),
+                    parse_mode="HTML", reply_markup=cancel_keyboard(job_id),
+                )
+            except Exception:
+                pass
+            await redis.hset(job_key(job_id), "position", position)
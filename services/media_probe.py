@@ -0,0 +1,161 @@
+"""Media probing shared by the Superapp tools — headers only, never a decode.
+
+`await probe(path)` returns a MediaInfo (duration, size, bitrates, codecs,
+dimensions, fps) read from `ffprobe -print_format json` when ffprobe is on
+PATH, else from the header `ffmpeg -i <file>` prints before it exits for
+lack of an output. The old `ffmpeg -i file -f null -` decoded the whole
+video just to learn its duration.
+
+`ffmpeg_path()` is the single lookup for the ffmpeg binary
+(imageio-ffmpeg's bundled build first, then PATH).
+"""
+import json
+import logging
+import os
+import re
+import shutil
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from services.media_jobs import run_command
+
+logger = logging.getLogger("media_probe")
+
+PROBE_TIMEOUT = 30
+
+
+class MediaInfo(NamedTuple):
+    duration: float = 0.0        # seconds; 0 when unknown
+    size: int = 0                # bytes (container, as reported)
+    bit_rate: int = 0            # kbit/s, whole file
+    format_name: str = ""        # e.g. "mov,mp4,m4a,3gp,3g2,mj2"
+    video_codec: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    video_bitrate: int = 0       # kbit/s; 0 when the container doesn't say
+    pix_fmt: str = ""
+    audio_codec: Optional[str] = None
+    audio_bitrate: int = 0
+
+    @property
+    def has_video(self) -> bool:
+        return self.video_codec is not None
+
+    @property
+    def has_audio(self) -> bool:
+        return self.audio_codec is not None
+
+    @property
+    def is_mp4(self) -> bool:
+        return "mp4" in self.format_name.split(",")
+
+
+@lru_cache(maxsize=1)
+def ffmpeg_path() -> Optional[str]:
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg")
+
+
+@lru_cache(maxsize=1)
+def ffprobe_path() -> Optional[str]:
+    return shutil.which("ffprobe")
+
+
+def _rate(value: str) -> float:
+    """'30000/1001' → 29.97."""
+    try:
+        num, _, den = value.partition("/")
+        return round(float(num) / float(den or 1), 3)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _kbps(value) -> int:
+    try:
+        return int(value) // 1000
+    except (TypeError, ValueError):
+        return 0
+
+
+def _from_ffprobe(data: dict) -> MediaInfo:
+    fmt = data.get("format", {})
+    video = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in data.get("streams", []) if s.get("codec_type") == "audio"), None)
+    return MediaInfo(
+        duration=float(fmt.get("duration") or 0),
+        size=int(fmt.get("size") or 0),
+        bit_rate=_kbps(fmt.get("bit_rate")),
+        format_name=fmt.get("format_name", ""),
+        video_codec=video.get("codec_name") if video else None,
+        width=int(video.get("width") or 0) if video else 0,
+        height=int(video.get("height") or 0) if video else 0,
+        fps=_rate(video.get("avg_frame_rate") or video.get("r_frame_rate") or "0") if video else 0.0,
+        video_bitrate=_kbps(video.get("bit_rate")) if video else 0,
+        pix_fmt=video.get("pix_fmt", "") if video else "",
+        audio_codec=audio.get("codec_name") if audio else None,
+        audio_bitrate=_kbps(audio.get("bit_rate")) if audio else 0,
+    )
+
+
+_DURATION = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_BITRATE = re.compile(r"bitrate:\s*(\d+)\s*kb/s")
+_INPUT = re.compile(r"Input #0, ([\w,]+),")
+_VIDEO = re.compile(r"Stream #0:\d+.*?: Video: (\w+)(.*)")
+_AUDIO = re.compile(r"Stream #0:\d+.*?: Audio: (\w+)(.*)")
+
+
+def _from_header(text: str, size: int) -> MediaInfo:
+    """Parse the banner `ffmpeg -i` prints (it exits before decoding anything)."""
+    fields: dict = {"size": size}
+    if m := _DURATION.search(text):
+        fields["duration"] = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+    if m := _BITRATE.search(text):
+        fields["bit_rate"] = int(m.group(1))
+    if m := _INPUT.search(text):
+        fields["format_name"] = m.group(1)
+    for line in text.splitlines():
+        if "video_codec" not in fields and (m := _VIDEO.search(line)) and "attached pic" not in line:
+            rest = m.group(2)
+            fields["video_codec"] = m.group(1)
+            if dims := re.search(r"\b(\d{2,5})x(\d{2,5})\b", rest):
+                fields["width"], fields["height"] = int(dims.group(1)), int(dims.group(2))
+            if fps := re.search(r"([\d.]+) fps", rest):
+                fields["fps"] = float(fps.group(1))
+            if kbps := re.search(r"(\d+) kb/s", rest):
+                fields["video_bitrate"] = int(kbps.group(1))
+            if pix := re.search(r", (yuv\w+|yuvj\w+|nv\d+|gray\w*|rgb\w*|bgr\w*)[(,]", rest):
+                fields["pix_fmt"] = pix.group(1)
+        elif "audio_codec" not in fields and (m := _AUDIO.search(line)):
+            fields["audio_codec"] = m.group(1)
+            if kbps := re.search(r"(\d+) kb/s", m.group(2)):
+                fields["audio_bitrate"] = int(kbps.group(1))
+    return MediaInfo(**fields)
+
+
+async def probe(path: str) -> Optional[MediaInfo]:
+    """MediaInfo for `path`, or None if neither ffprobe nor ffmpeg can read it."""
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+
+    if ffprobe_path():
+        returncode, stdout, _ = await run_command([
+            ffprobe_path(), "-v", "error", "-print_format", "json",
+            "-show_format", "-show_streams", path,
+        ], timeout=PROBE_TIMEOUT)
+        if returncode == 0:
+            try:
+                info = _from_ffprobe(json.loads(stdout))
+                return info._replace(size=info.size or size)
+            except (ValueError, KeyError) as e:
+                logger.warning(f"ffprobe output not understood for {path}: {e}")
+
+    if ffmpeg_path():
+        _, _, stderr = await run_command([ffmpeg_path(), "-hide_banner", "-i", path], timeout=PROBE_TIMEOUT)
+        text = stderr.decode(errors="ignore")
+        if "Input #0" in text:
+            return _from_header(text, size)
+    return None
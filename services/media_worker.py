@@ -0,0 +1,170 @@
+"""Media worker processes — run the queued Superapp tool jobs.
+
+    python -m services.media_worker [--tools videonote,compressor]
+
+starts TOOLS[tool].concurrency processes per tool (services/media_jobs.py).
+Each process takes one job at a time, BLMOVE-ing its id from
+`media:q:<tool>` into its own `media:run:<tool>:<n>` list, so per-tool
+concurrency is exactly the process count and a crashed worker's job is
+found again: the replacement process for slot n requeues it on start
+(at most MAX_ATTEMPTS times — a job that keeps killing workers is failed).
+
+Every worker lowers its CPU priority (MEDIA_WORKER_NICE) and caps its
+address space (MEDIA_WORKER_MEMORY_MB). Both are inherited by the
+ffmpeg / yt-dlp / soffice children, so a runaway encode is killed
+instead of starving the webhook process.
+
+The supervisor restarts workers that exit and sweeps stale scratch
+files (services/scratch.py); workers keep
+`media:alive:<tool>` fresh so the web process knows to enqueue instead
+of running the tool inline.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from bot.config import settings
+from services import scratch
+from services.media_jobs import (
+    HEARTBEAT_TTL, TOOLS, abandon, alive_key, execute, get_redis, job_key,
+    queue_key, refresh_positions, running_key,
+)
+
+logger = logging.getLogger("media_worker")
+
+POP_TIMEOUT = 5          # seconds; BLMOVE wakes up this often
+POSITIONS_INTERVAL = 5   # seconds between queue-position edits
+MAX_ATTEMPTS = 2
+SUPERVISE_INTERVAL = 5
+
+
+async def _heartbeat(redis, bot, tool: str):
+    while True:
+        try:
+            await redis.set(alive_key(tool), 1, ex=HEARTBEAT_TTL)
+            # one process across all workers refreshes queue positions
+            if await redis.set("media:positions:lock", 1, nx=True, ex=POSITIONS_INTERVAL):
+                await refresh_positions(bot, redis)
+        except Exception as e:
+            logger.warning(f"Media worker heartbeat failed: {e}")
+        await asyncio.sleep(POSITIONS_INTERVAL)
+
+
+async def _requeue_leftover(redis, tool: str, mine: str):
+    """Put back a job the previous process in this slot was running when it died."""
+    while True:
+        job_id = await redis.lmove(mine, queue_key(tool), "RIGHT", "LEFT")
+        if not job_id:
+            return
+        logger.warning(f"[{tool} {job_id}] requeued after a worker crash")
+
+
+async def _fail_poisoned(bot, job: dict):
+    try:
+        await bot.edit_message_text(
+            "❌ Bu faylni qayta ishlab bo'lmadi (server resurslari yetmadi). Iltimos, kichikroq fayl yuboring.",
+            chat_id=int(job["chat_id"]), message_id=int(job["message_id"]),
+        )
+    except Exception:
+        pass
+
+
+async def run_worker(tool: str, worker: int = 0):
+    """Take jobs for `tool` forever, one at a time."""
+    from bot.utils.bot_registry import get_bot
+
+    redis = await get_redis()
+    if not redis:
+        raise SystemExit("Redis is required for media workers")
+    bot = get_bot()
+    mine = running_key(tool, worker)
+    await _requeue_leftover(redis, tool, mine)
+    heartbeat = asyncio.create_task(_heartbeat(redis, bot, tool))
+    logger.info(f"🎬 Media worker {tool}/{worker} waiting on {queue_key(tool)}")
+
+    try:
+        while True:
+            try:
+                job_id = await redis.blmove(queue_key(tool), mine, POP_TIMEOUT, "LEFT", "RIGHT")
+            except Exception as e:
+                logger.error(f"Media worker {tool}/{worker}: queue error: {e}")
+                await asyncio.sleep(POP_TIMEOUT)
+                continue
+            if not job_id:
+                continue
+            try:
+                job = await redis.hgetall(job_key(job_id))
+                if not job or job.get("status") not in ("queued", "running"):
+                    continue  # expired or cancelled while queued
+                job["id"] = job_id
+                if await redis.hincrby(job_key(job_id), "attempts", 1) > MAX_ATTEMPTS:
+                    await redis.hset(job_key(job_id), "status", "failed")
+                    await _fail_poisoned(bot, job)
+                    await abandon(job, bot)
+                    continue
+                await execute(job, bot, redis)
+            finally:
+                await redis.lrem(mine, 0, job_id)
+    finally:
+        heartbeat.cancel()
+
+
+def _apply_limits():
+    if settings.MEDIA_WORKER_NICE:
+        os.nice(settings.MEDIA_WORKER_NICE)
+    if settings.MEDIA_WORKER_MEMORY_MB:
+        import resource
+        limit = settings.MEDIA_WORKER_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(tool: str, worker: int):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    _apply_limits()
+    try:
+        asyncio.run(run_worker(tool, worker))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Superapp media worker processes")
+    parser.add_argument("--tools", default=",".join(TOOLS), help="comma-separated tool names")
+    args = parser.parse_args()
+    tools = [t.strip() for t in args.tools.split(",") if t.strip()]
+    unknown = set(tools) - set(TOOLS)
+    if unknown:
+        parser.error(f"unknown tools: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    ctx = multiprocessing.get_context("spawn")
+    slots = [(tool, n) for tool in tools for n in range(TOOLS[tool].concurrency)]
+    procs = {}
+
+    def start(slot):
+        p = ctx.Process(target=_worker_main, args=slot, name=f"media-{slot[0]}-{slot[1]}")
+        p.start()
+        procs[slot] = p
+
+    scratch.sweep()  # what the previous deploy / crashed workers left behind
+    for slot in slots:
+        start(slot)
+    logger.info(f"🎬 Media workers started: {', '.join(f'{t}×{TOOLS[t].concurrency}' for t in tools)}")
+    last_sweep = time.monotonic()
+    try:
+        while True:
+            time.sleep(SUPERVISE_INTERVAL)
+            for slot, p in list(procs.items()):
+                if not p.is_alive():
+                    logger.warning(f"Media worker {slot[0]}/{slot[1]} exited ({p.exitcode}), restarting")
+                    start(slot)
+            if time.monotonic() - last_sweep >= scratch.SWEEP_INTERVAL:
+                scratch.sweep()
+                last_sweep = time.monotonic()
+    except KeyboardInterrupt:
+        for p in procs.values():
+            p.terminate()
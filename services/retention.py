@@ -0,0 +1,352 @@
+"""Retention & compaction — keeps the high-volume event tables bounded.
+
+Nightly job (same asyncio-loop pattern as services/daily_cron.py):
+
+  1. Rows older than the configured horizon are rolled up into
+     `daily_event_rollups` (per day / event_type / dimension counts) and
+     deleted in bounded batches. Each batch is its own short transaction —
+     the rollup upsert and the DELETE commit together, so a crash never
+     double-counts or loses a batch, and writers are never blocked for long.
+  2. If EVENTS_PARTITIONED is on and `events` is a partitioned table, the
+     next months' partitions are created ahead of time and partitions past
+     the horizon are detached, rolled up and dropped.
+  3. The run's report (rows rolled up / deleted per table, partitions
+     created / dropped, duration) is logged and saved to `retention_runs`.
+
+Funnel-milestone events (services.analytics EVT_* used by has_event() and
+the /funnel stats) are never compacted — only high-volume click/open
+events age out of `events`.
+
+One-off conversion of `events` to a partitioned table:
+    python -m services.retention --partition-events
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, literal, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from bot.config import settings
+from db.database import async_session, engine, is_sqlite
+from db.models import (
+    AgencyEvent, CourseLandingEvent, DailyEventRollup, Event, GroupWarning,
+    QuizEvent, RetentionRun,
+)
+from services import analytics
+
+logger = logging.getLogger("retention")
+
+BATCH_SIZE = 5000            # rows per delete transaction
+MAX_BATCHES_PER_TABLE = 200  # ≤ 1M rows per table per run; the rest waits for tomorrow
+BATCH_PAUSE_SECONDS = 0.2    # yield to foreground writers between batches
+PARTITION_MONTHS_AHEAD = 2
+RUN_AT_HOUR, RUN_AT_MINUTE = 3, 30
+
+# Funnel milestones — read by has_event() and all-time funnel stats, never compacted.
+KEEP_FOREVER_EVENTS = frozenset({
+    analytics.EVT_LEAD, analytics.EVT_REGISTRATION_COMPLETE, analytics.EVT_LEAD_MAGNET_OPEN,
+    analytics.EVT_VSL_VIEW, analytics.EVT_VSL_50, analytics.EVT_VSL_90,
+    analytics.EVT_OFFER_CLICK, analytics.EVT_PAYMENT_OPEN, analytics.EVT_PAYMENT_SUCCESS,
+    analytics.EVT_PAYMENT_FAIL, analytics.EVT_CHURN,
+    analytics.EVT_REFERRAL_VALID, analytics.EVT_REFERRAL_PAID,
+})
+
+
+def _table_specs() -> list:
+    """(source name, model, event_type column, dimension column, horizon days, extra filter)."""
+    landing_days = settings.RETENTION_LANDING_EVENTS_DAYS
+    return [
+        ("events", Event, Event.event_type, None, settings.RETENTION_EVENTS_DAYS,
+         Event.event_type.not_in(KEEP_FOREVER_EVENTS)),
+        ("quiz_events", QuizEvent, QuizEvent.event_type, QuizEvent.utm_source, landing_days, None),
+        ("course_landing_events", CourseLandingEvent, CourseLandingEvent.event_type,
+         CourseLandingEvent.utm_source, landing_days, None),
+        ("agency_events", AgencyEvent, AgencyEvent.event_type, AgencyEvent.utm_source, landing_days, None),
+        ("group_warnings", GroupWarning, None, GroupWarning.group_id,
+         settings.RETENTION_GROUP_WARNINGS_DAYS, None),
+    ]
+
+
+# ── Rollups ──────────────────────────────────────────────────────────────────
+
+async def _upsert_rollups(session, source: str, counts: Counter):
+    """Add counts into daily_event_rollups (multi-row INSERT … ON CONFLICT)."""
+    if not counts:
+        return
+    stmt = pg_insert(DailyEventRollup).values([
+        {"source": source, "day": day, "event_type": evt, "dimension": dim, "count": n}
+        for (day, evt, dim), n in counts.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_daily_event_rollup_key",
+        set_={"count": DailyEventRollup.count + stmt.excluded.count},
+    )
+    await session.execute(stmt)
+
+
+async def _compact_table(source, model, type_col, dim_col, horizon_days, extra_filter, dry_run=False) -> dict:
+    """Roll up + delete rows older than the horizon in BATCH_SIZE transactions.
+
+    dry_run only counts what would be removed.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=horizon_days)
+    report = {"horizon_days": horizon_days, "cutoff": cutoff.date().isoformat(), "rolled_up": 0, "deleted": 0, "batches": 0}
+
+    if dry_run:
+        async with async_session() as session:
+            q = select(func.count()).select_from(model).where(model.created_at < cutoff)
+            if extra_filter is not None:
+                q = q.where(extra_filter)
+            report["would_delete"] = (await session.execute(q)).scalar() or 0
+        return report
+
+    for _ in range(MAX_BATCHES_PER_TABLE):
+        async with async_session() as session:
+            q = select(
+                model.id,
+                model.created_at,
+                type_col if type_col is not None else literal("warning"),
+                dim_col if dim_col is not None else literal(""),
+            ).where(model.created_at < cutoff)
+            if extra_filter is not None:
+                q = q.where(extra_filter)
+            rows = (await session.execute(q.order_by(model.created_at).limit(BATCH_SIZE))).all()
+            if not rows:
+                break
+
+            counts = Counter(
+                (created_at.date(), str(evt)[:60], str(dim or "")[:100])
+                for _id, created_at, evt, dim in rows
+            )
+            await _upsert_rollups(session, source, counts)
+            result = await session.execute(delete(model).where(model.id.in_([r[0] for r in rows])))
+            await session.commit()
+
+        report["rolled_up"] += len(rows)
+        report["deleted"] += result.rowcount or 0
+        report["batches"] += 1
+        if len(rows) < BATCH_SIZE:
+            break
+        await asyncio.sleep(BATCH_PAUSE_SECONDS)
+    else:
+        report["truncated"] = True  # hit MAX_BATCHES_PER_TABLE — remainder next run
+
+    return report
+
+
+# ── Monthly partitions for `events` ──────────────────────────────────────────
+
+def _month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def _add_months(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"events_{month.year:04d}_{month.month:02d}"
+
+
+async def _events_is_partitioned(conn) -> bool:
+    result = await conn.execute(text(
+        "SELECT EXISTS(SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'events')"
+    ))
+    return bool(result.scalar())
+
+
+async def _create_partition(conn, month: date) -> bool:
+    name = _partition_name(month)
+    exists = (await conn.execute(text("SELECT to_regclass(:n) IS NOT NULL"), {"n": name})).scalar()
+    if exists:
+        return False
+    await conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF events "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    ))
+    return True
+
+
+async def _maintain_event_partitions(dry_run=False) -> dict:
+    """Create upcoming monthly partitions; roll up + drop ones past the horizon."""
+    report = {"created": [], "dropped": []}
+    this_month = _month_start(datetime.now(timezone.utc).date())
+    horizon_month = _month_start(
+        datetime.now(timezone.utc).date() - timedelta(days=settings.RETENTION_EVENTS_DAYS)
+    )
+
+    async with engine.begin() as conn:
+        if not await _events_is_partitioned(conn):
+            report["skipped"] = "events is not partitioned (run: python -m services.retention --partition-events)"
+            return report
+        for i in range(PARTITION_MONTHS_AHEAD + 1):
+            month = _add_months(this_month, i)
+            if not dry_run and await _create_partition(conn, month):
+                report["created"].append(_partition_name(month))
+
+        rows = await conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'events' AND c.relname ~ '^events_[0-9]{4}_[0-9]{2}$'"
+        ))
+        old = sorted(
+            name for (name,) in rows.all()
+            if date(int(name[7:11]), int(name[12:14]), 1) < horizon_month
+        )
+
+    keep = tuple(sorted(KEEP_FOREVER_EVENTS))
+    for name in old:
+        if dry_run:
+            report["dropped"].append(name)
+            continue
+        # Detach → roll up compactable rows → re-route milestones to the DEFAULT
+        # partition (no range covers that month any more) → drop. One transaction.
+        async with engine.begin() as conn:
+            await conn.execute(text(f"ALTER TABLE events DETACH PARTITION {name}"))
+            await conn.execute(text(
+                "INSERT INTO daily_event_rollups (source, day, event_type, dimension, count) "
+                f"SELECT 'events', CAST(created_at AS DATE), event_type, '', COUNT(*) FROM {name} "
+                "WHERE event_type <> ALL(:keep) GROUP BY 1, 2, 3, 4 "
+                "ON CONFLICT ON CONSTRAINT uq_daily_event_rollup_key "
+                "DO UPDATE SET count = daily_event_rollups.count + EXCLUDED.count"
+            ), {"keep": list(keep)})
+            await conn.execute(
+                text(f"INSERT INTO events SELECT * FROM {name} WHERE event_type = ANY(:keep)"),
+                {"keep": list(keep)},
+            )
+            await conn.execute(text(f"DROP TABLE {name}"))
+        report["dropped"].append(name)
+
+    return report
+
+
+async def partition_events_table():
+    """One-off: rebuild `events` as a table range-partitioned by month on created_at.
+
+    Copies all rows inside one transaction (takes an ACCESS EXCLUSIVE lock on
+    events for the duration — run it off-peak). The id sequence is kept, so
+    new ids continue where the old table stopped.
+    """
+    async with engine.begin() as conn:
+        if await _events_is_partitioned(conn):
+            logger.info("events is already partitioned — nothing to do")
+            return
+        bounds = (await conn.execute(text("SELECT MIN(created_at), MAX(created_at) FROM events"))).one()
+        first = _month_start((bounds[0] or datetime.now(timezone.utc)).date())
+        last = _add_months(_month_start(datetime.now(timezone.utc).date()), PARTITION_MONTHS_AHEAD)
+
+        await conn.execute(text("ALTER TABLE events RENAME TO events_unpartitioned"))
+        await conn.execute(text("ALTER SEQUENCE events_id_seq OWNED BY NONE"))
+        await conn.execute(text(
+            "CREATE TABLE events (LIKE events_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"
+        ))
+        await conn.execute(text("ALTER TABLE events ADD PRIMARY KEY (id, created_at)"))
+        await conn.execute(text("ALTER TABLE events ADD FOREIGN KEY (user_id) REFERENCES users(id)"))
+        await conn.execute(text("ALTER SEQUENCE events_id_seq OWNED BY events.id"))
+        await conn.execute(text("CREATE TABLE events_default PARTITION OF events DEFAULT"))
+        month = first
+        while month <= last:
+            await _create_partition(conn, month)
+            month = _add_months(month, 1)
+
+        await conn.execute(text("INSERT INTO events SELECT * FROM events_unpartitioned"))
+        await conn.execute(text("DROP TABLE events_unpartitioned"))
+        for name, cols in (
+            ("ix_events_event_type", "event_type"),
+            ("ix_events_user_created", "user_id, created_at"),
+            ("ix_events_created_at", "created_at"),
+        ):
+            await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON events ({cols})"))
+    logger.info(f"✅ events partitioned monthly from {first} to {last}")
+
+
+# ── Run ──────────────────────────────────────────────────────────────────────
+
+async def run_retention(dry_run: bool = False) -> dict:
+    """Run one compaction pass over every table; returns the report."""
+    started = time.perf_counter()
+    report = {"dry_run": dry_run, "tables": {}}
+
+    run_id = None
+    if not dry_run:
+        async with async_session() as session:
+            run = RetentionRun(status="running")
+            session.add(run)
+            await session.commit()
+            run_id = run.id
+
+    status = "completed"
+    try:
+        for source, model, type_col, dim_col, days, extra in _table_specs():
+            try:
+                report["tables"][source] = await _compact_table(
+                    source, model, type_col, dim_col, days, extra, dry_run=dry_run,
+                )
+            except Exception as e:
+                status = "failed"
+                logger.error(f"Retention: {source} failed: {e}")
+                report["tables"][source] = {"error": str(e)[:300]}
+
+        if settings.EVENTS_PARTITIONED and not is_sqlite:
+            try:
+                report["partitions"] = await _maintain_event_partitions(dry_run=dry_run)
+            except Exception as e:
+                status = "failed"
+                logger.error(f"Retention: partition maintenance failed: {e}")
+                report["partitions"] = {"error": str(e)[:300]}
+    finally:
+        report["duration_s"] = round(time.perf_counter() - started, 2)
+        if run_id is not None:
+            async with async_session() as session:
+                await session.execute(
+                    update(RetentionRun).where(RetentionRun.id == run_id).values(
+                        status=status,
+                        report=report,
+                        finished_at=datetime.now(timezone.utc),
+                    )
+                )
+                await session.commit()
+
+    deleted = sum(t.get("deleted", 0) for t in report["tables"].values())
+    logger.info(f"Retention run {status}: deleted={deleted} in {report['duration_s']}s — {report}")
+    return report
+
+
+async def _cron_loop():
+    while True:
+        now = datetime.now()
+        target = datetime(now.year, now.month, now.day, RUN_AT_HOUR, RUN_AT_MINUTE)
+        if now > target:
+            target += timedelta(days=1)
+        wait_seconds = (target - now).total_seconds()
+        logger.info(f"Retention scheduled at {target} (in {wait_seconds:.0f} seconds)")
+        await asyncio.sleep(wait_seconds)
+        try:
+            await run_retention()
+        except Exception as e:
+            logger.error(f"Error executing retention cron: {e}")
+
+
+def start_cron():
+    """Starts the nightly retention loop in the background."""
+    if not settings.RETENTION_ENABLED:
+        logger.info("Retention disabled (RETENTION_ENABLED=false)")
+        return
+    asyncio.create_task(_cron_loop())
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    if "--partition-events" in sys.argv:
+        asyncio.run(partition_events_table())
+    else:
+        asyncio.run(run_retention(dry_run="--dry-run" in sys.argv))
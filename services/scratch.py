@@ -0,0 +1,274 @@
+"""Scratch space for the media tools — budgets, admission, sweeping.
+
+    job_dir = await scratch.acquire("job_ab12", expected=200 * MB)
+    path = job_dir.path("input.mp4")
+    ...
+    job_dir.release()
+
+or `async with scratch.session("voicer", expected=5 * MB) as job_dir:`.
+
+- Every job gets its own directory under SCRATCH_DIR (default
+  ./temp) with a byte budget (SCRATCH_JOB_MB); ffmpeg children of a job
+  get it as RLIMIT_FSIZE, so a runaway output is killed at the budget.
+- Admission: `acquire` reserves `expected` bytes against the global
+  SCRATCH_QUOTA_MB (what is on disk + what this process has reserved but
+  not written yet) and SCRATCH_MIN_FREE_MB of free disk; it waits up to
+  ADMISSION_TIMEOUT for room, then raises ScratchFull.
+- Small jobs (expected ≤ TMPFS_SMALL) go to SCRATCH_TMPFS_DIR (/dev/shm)
+  while SCRATCH_TMPFS_MB allows — no disk I/O for voice clips and photos.
+- The sweeper removes anything under both roots untouched for
+  SCRATCH_STALE_HOURS: what crashes, OOM kills and deploys left behind.
+  The web process runs it as a task, the media worker supervisor inline.
+- `usage()` → GET /api/admin/scratch.
+
+Usage comes from a walk of the root, run in a thread at most every
+USAGE_REFRESH seconds — admission polls and the Mini App's upload checks
+reuse the snapshot. Between walks, this process's active dirs count as
+their full reservation minus what the snapshot already saw of them, and a
+released dir's snapshot bytes are subtracted at once; so writes within a
+reservation are never undercounted. Other processes' jobs count once
+their files show up in a walk. Disk-free checks are global by nature.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from bot.config import settings
+
+logger = logging.getLogger("scratch")
+
+MB = 1024 * 1024
+TMPFS_SMALL = 32 * MB       # expected size up to which a job may use tmpfs
+ADMISSION_TIMEOUT = 120     # seconds a job waits for scratch space
+ADMISSION_POLL = 2.0
+USAGE_REFRESH = 5.0         # seconds between walks of a scratch root
+SWEEP_INTERVAL = 600
+
+ROOT = settings.SCRATCH_DIR or os.path.join(os.getcwd(), "temp")
+TMPFS_ROOT = os.path.join(settings.SCRATCH_TMPFS_DIR, "superapp") if settings.SCRATCH_TMPFS_DIR else ""
+
+
+class ScratchFull(Exception):
+    """No scratch space became available within ADMISSION_TIMEOUT."""
+
+
+class ScratchDir:
+    def __init__(self, root: str, name: str, reserved: int, budget: int):
+        self.dir = os.path.join(root, name)
+        self.root = root
+        self.reserved = reserved
+        self.budget = budget
+        os.makedirs(self.dir, exist_ok=True)
+        _active[self.dir] = self
+
+    @property
+    def on_tmpfs(self) -> bool:
+        return self.root == TMPFS_ROOT
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def used(self) -> int:
+        return _tree_size(self.dir)
+
+    def release(self):
+        if _active.pop(self.dir, None) is not None:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            snap = _snapshots.get(self.root)
+            if snap:  # its bytes are gone — no need to wait for the next walk
+                snap.total -= snap.dirs.pop(self.dir, 0)
+            _wake()
+
+
+class _Snapshot:
+    def __init__(self, taken: float, total: int, dirs: dict[str, int]):
+        self.taken = taken
+        self.total = total
+        self.dirs = dirs   # active dir → bytes it had at the walk
+
+
+_active: dict[str, ScratchDir] = {}
+_snapshots: dict[str, _Snapshot] = {}
+_room: Optional[asyncio.Event] = None
+_swept = {"runs": 0, "files": 0, "bytes": 0, "last": 0}
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(dirpath, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _walk(root: str) -> tuple[int, dict[str, int]]:
+    """Bytes under `root`, and per active dir. Runs in a thread."""
+    total, dirs = 0, {}
+    if not os.path.isdir(root):
+        return 0, dirs
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            size = _tree_size(path) if os.path.isdir(path) else os.lstat(path).st_size
+        except OSError:
+            continue
+        total += size
+        if path in _active:
+            dirs[path] = size
+    return total, dirs
+
+
+async def _usage(root: str) -> tuple[int, int]:
+    """(bytes on disk, bytes reserved by this process but not written yet)."""
+    snap = _snapshots.get(root)
+    if snap is None or time.monotonic() - snap.taken > USAGE_REFRESH:
+        total, dirs = await asyncio.to_thread(_walk, root)
+        snap = _snapshots[root] = _Snapshot(time.monotonic(), total, dirs)
+    pending = sum(max(d.reserved - snap.dirs.get(d.dir, 0), 0) for d in _active.values() if d.root == root)
+    return snap.total, pending
+
+
+async def _fits(root: str, quota: int, need: int) -> bool:
+    os.makedirs(root, exist_ok=True)
+    used, pending = await _usage(root)
+    if used + pending + need > quota:
+        return False
+    free = shutil.disk_usage(root).free
+    reserve_free = 0 if root == TMPFS_ROOT else settings.SCRATCH_MIN_FREE_MB * MB
+    return free - need >= reserve_free
+
+
+async def has_room(need: int) -> bool:
+    """Whether `need` bytes would be admitted on the disk root right now."""
+    return await _fits(ROOT, settings.SCRATCH_QUOTA_MB * MB, need)
+
+
+def _wake():
+    if _room is not None:
+        _room.set()
+
+
+async def acquire(owner: str, expected: int = 0, timeout: float = ADMISSION_TIMEOUT) -> ScratchDir:
+    """A fresh directory for `owner`, once `expected` bytes fit the quota."""
+    global _room
+    if _room is None:
+        _room = asyncio.Event()
+    budget = settings.SCRATCH_JOB_MB * MB
+    need = min(max(expected, 0), budget)
+    name = f"{owner}_{uuid.uuid4().hex[:6]}"
+
+    if TMPFS_ROOT and need <= TMPFS_SMALL and await _fits(TMPFS_ROOT, settings.SCRATCH_TMPFS_MB * MB, need):
+        return ScratchDir(TMPFS_ROOT, name, need, min(budget, settings.SCRATCH_TMPFS_MB * MB))
+
+    deadline = time.monotonic() + timeout
+    while not await _fits(ROOT, settings.SCRATCH_QUOTA_MB * MB, need):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise ScratchFull(f"{owner}: {need // MB} MB not available in {ROOT}")
+        _room.clear()
+        try:  # released dirs wake us; other processes' cleanup shows up on the next poll
+            await asyncio.wait_for(_room.wait(), min(left, ADMISSION_POLL))
+        except asyncio.TimeoutError:
+            pass
+    return ScratchDir(ROOT, name, need, budget)
+
+
+@asynccontextmanager
+async def session(owner: str, expected: int = 0):
+    job_dir = await acquire(owner, expected)
+    try:
+        yield job_dir
+    finally:
+        job_dir.release()
+
+
+# ── Sweeper ──────────────────────────────────────────────────────────────────
+
+def _newest_mtime(path: str) -> float:
+    newest = os.lstat(path).st_mtime
+    if os.path.isdir(path):
+        for dirpath, _, files in os.walk(path):
+            for f in files:
+                try:
+                    newest = max(newest, os.lstat(os.path.join(dirpath, f)).st_mtime)
+                except OSError:
+                    pass
+    return newest
+
+
+def sweep(max_age: Optional[float] = None) -> tuple[int, int]:
+    """Remove entries untouched for `max_age` seconds; returns (entries, bytes)."""
+    max_age = settings.SCRATCH_STALE_HOURS * 3600 if max_age is None else max_age
+    cutoff = time.time() - max_age
+    removed = freed = 0
+    for root in filter(None, (ROOT, TMPFS_ROOT)):
+        if not os.path.isdir(root):
+            continue
+        for top in (root, os.path.join(root, "uploads")):
+            if not os.path.isdir(top):
+                continue
+            for name in os.listdir(top):
+                path = os.path.join(top, name)
+                if path in _active or path == os.path.join(root, "uploads"):
+                    continue
+                try:
+                    if _newest_mtime(path) >= cutoff:
+                        continue
+                    size = _tree_size(path) if os.path.isdir(path) else os.lstat(path).st_size
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    removed, freed = removed + 1, freed + size
+                except OSError:
+                    pass
+    _swept["runs"] += 1
+    _swept["files"] += removed
+    _swept["bytes"] += freed
+    _swept["last"] = int(time.time())
+    if removed:
+        logger.info(f"🧹 Scratch sweeper removed {removed} stale entries ({freed // MB} MB)")
+    return removed, freed
+
+
+async def _sweep_loop():
+    while True:
+        try:
+            await asyncio.to_thread(sweep)
+        except Exception as e:
+            logger.warning(f"Scratch sweep failed: {e}")
+        await asyncio.sleep(SWEEP_INTERVAL)
+
+
+def start_sweeper():
+    """Starts the stale scratch sweeper in the background."""
+    asyncio.create_task(_sweep_loop())
+
+
+# ── Metrics ──────────────────────────────────────────────────────────────────
+
+async def usage() -> dict:
+    roots = {}
+    for label, root, quota in (("disk", ROOT, settings.SCRATCH_QUOTA_MB), ("tmpfs", TMPFS_ROOT, settings.SCRATCH_TMPFS_MB)):
+        if not root or not os.path.isdir(root):
+            continue
+        fs = shutil.disk_usage(root)
+        used, pending = await _usage(root)
+        roots[label] = {
+            "path": root,
+            "used_mb": round(used / MB, 1),
+            "reserved_mb": round(pending / MB, 1),
+            "quota_mb": quota,
+            "fs_free_mb": fs.free // MB,
+            "fs_total_mb": fs.total // MB,
+            "active_dirs": sum(1 for d in _active.values() if d.root == root),
+        }
+    return {"roots": roots, "sweeper": dict(_swept, freed_mb=_swept["bytes"] // MB)}
@@ -0,0 +1,421 @@
+"""Audience segments — one filter definition, SQL and bitmap evaluation.
+
+A segment spec is the broadcast `filters` dict, optionally nested:
+
+    {"source": "instagram", "lead_score_min": 30}          # keys are ANDed
+    {"or": [{"lead_segment": "hot"}, {"paid": True}]}
+    {"level_tag": "business", "not": {"paid": True}}
+    {"and": [...]}
+
+Leaf keys: source, campaign, level_tag, user_status, lead_segment,
+lead_score_min, lead_score_max, paid, is_active. Falsy values are ignored,
+matching the historical `_apply_filters` behaviour.
+
+`events` is a list of event predicates, all of which must hold:
+
+    {"events": [
+        {"event": "vsl_50"},                                     # has it, ever
+        {"event": "payment_open", "has": False, "within_days": 7},  # not in the last 7 days
+        {"event": "offer_click", "min_count": 3},
+    ]}
+
+`min_count` / `max_count` are lifetime counts; `within_days` tests the most
+recent occurrence. Predicates read `user_event_summaries` (one row per user
+and event type, kept current by AnalyticsService.track), never `events`.
+
+`validate_spec(spec)` checks a spec against this grammar and raises
+SpecError naming the offending key; the admin API runs it on every spec
+it accepts, so a malformed one is a 400 rather than a compiler crash.
+
+Two evaluators share that grammar:
+
+  * `compile_spec(spec)` → a SQLAlchemy WHERE clause (cached per spec),
+    used by `CRMService._apply_filters` and everything built on it.
+  * `SegmentIndex` — a materialized snapshot of every user as bitsets
+    (Python ints, bit n = users.id n) per attribute value. AND/OR/NOT of
+    any spec is a handful of big-int operations, so the composer's counts
+    come back without touching the DB, and broadcasts walk the resulting
+    bitmap instead of re-filtering in SQL page by page
+    (`BroadcastService.count_recipients` / `resolve_recipients`).
+
+The index is rebuilt with one narrow scan of `users` + active
+subscriptions when older than SEGMENT_INDEX_TTL (SEGMENT_INDEX_SEND_TTL for
+broadcasts, which also re-check is_active per chunk at send time).
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Iterator, Optional
+
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, exists, func, not_, or_, select, true
+
+from db.models import Subscription, User, UserEventSummary
+
+logger = logging.getLogger("segments")
+
+SEGMENT_INDEX_TTL = 300        # seconds — composer counts may be a few minutes stale
+SEGMENT_INDEX_SEND_TTL = 60    # broadcasts rebuild anything older than this
+_SCAN_BATCH = 20_000
+
+# Leaf keys that are plain equality on a users column
+_EQ_KEYS = {
+    "source": User.source,
+    "campaign": User.campaign,
+    "level_tag": User.level_tag,
+    "user_status": User.user_status,
+    "lead_segment": User.lead_segment,
+}
+LEAF_KEYS = (*_EQ_KEYS, "lead_score_min", "lead_score_max", "paid", "is_active", "events")
+
+
+def _spec_key(spec: dict) -> str:
+    return json.dumps(spec or {}, sort_keys=True, default=str)
+
+
+def _event_predicates(spec: dict) -> list[dict]:
+    return [p for p in (spec.get("events") or []) if isinstance(p, dict) and p.get("event")]
+
+
+# ── Validation ──────────────────────────────────────────────────
+class SpecError(ValueError):
+    """A segment spec that doesn't follow the grammar; `key` is the offending path."""
+
+    def __init__(self, key: str, message: str):
+        super().__init__(f"{key}: {message}")
+        self.key = key
+
+
+_INT_KEYS = ("lead_score_min", "lead_score_max")
+_BOOL_KEYS = ("paid", "is_active")
+_EVENT_KEYS = {"event": str, "has": bool, "min_count": int, "max_count": int, "within_days": int}
+
+
+def _check_type(key: str, value, kind: type):
+    # bool is an int subclass; a JSON true where a count belongs is still a mistake
+    if value is not None and (not isinstance(value, kind) or (kind is int and isinstance(value, bool))):
+        raise SpecError(key, f"expected {kind.__name__}, got {type(value).__name__}")
+
+
+def validate_spec(spec, path: str = "") -> None:
+    """Raise SpecError unless `spec` follows the grammar in the module docstring."""
+    if spec is None:
+        return
+    if not isinstance(spec, dict):
+        raise SpecError(path or "spec", f"expected an object, got {type(spec).__name__}")
+    for key, value in spec.items():
+        where = f"{path}.{key}" if path else key
+        if key in _EQ_KEYS:
+            _check_type(where, value, str)
+        elif key in _INT_KEYS:
+            _check_type(where, value, int)
+        elif key in _BOOL_KEYS:
+            _check_type(where, value, bool)
+        elif key == "events":
+            _check_type(where, value, list)
+            for n, pred in enumerate(value or []):
+                if not isinstance(pred, dict):
+                    raise SpecError(f"{where}[{n}]", "expected an object")
+                for pkey, pvalue in pred.items():
+                    if pkey not in _EVENT_KEYS:
+                        raise SpecError(f"{where}[{n}].{pkey}", "unknown key")
+                    _check_type(f"{where}[{n}].{pkey}", pvalue, _EVENT_KEYS[pkey])
+                if not pred.get("event"):
+                    raise SpecError(f"{where}[{n}].event", "required")
+        elif key in ("and", "or"):
+            _check_type(where, value, list)
+            for n, sub in enumerate(value or []):
+                validate_spec(sub, f"{where}[{n}]")
+        elif key == "not":
+            validate_spec(value, where)
+        else:
+            raise SpecError(where, "unknown key")
+
+
+# ── SQL compilation ─────────────────────────────────────────────
+def _compile_event(pred: dict):
+    s = UserEventSummary
+    conds = [s.user_id == User.id, s.event_type == pred["event"]]
+    if pred.get("min_count"):
+        conds.append(s.count >= pred["min_count"])
+    if pred.get("max_count"):
+        conds.append(s.count <= pred["max_count"])
+    if pred.get("within_days"):
+        # relative to execution time, so the cached clause never goes stale
+        conds.append(s.last_at >= func.now() - timedelta(days=pred["within_days"]))
+    clause = exists().where(*conds)
+    return clause if pred.get("has", True) else not_(clause)
+
+
+def _compile(spec: dict):
+    clauses = []
+    for key, column in _EQ_KEYS.items():
+        if spec.get(key):
+            clauses.append(column == spec[key])
+    if spec.get("lead_score_min"):
+        clauses.append(User.lead_score >= spec["lead_score_min"])
+    if spec.get("lead_score_max"):
+        clauses.append(User.lead_score <= spec["lead_score_max"])
+    if spec.get("paid"):
+        active_sub_sq = (
+            select(Subscription.user_id)
+            .where(Subscription.status == "active")
+            .scalar_subquery()
+        )
+        clauses.append(User.id.in_(active_sub_sq))
+    if spec.get("is_active") is not None:
+        clauses.append(User.is_active.isnot(False) if spec["is_active"] else User.is_active == False)  # noqa: E712
+    for pred in _event_predicates(spec):
+        clauses.append(_compile_event(pred))
+    for sub in spec.get("and") or []:
+        clauses.append(_compile(sub))
+    if spec.get("or"):
+        clauses.append(or_(*[_compile(sub) for sub in spec["or"]]))
+    if spec.get("not"):
+        clauses.append(not_(_compile(spec["not"])))
+    return and_(*clauses) if clauses else true()
+
+
+_compiled: dict[str, object] = {}
+
+
+def compile_spec(spec: Optional[dict]):
+    """WHERE clause for a segment spec. Compiled once per distinct spec."""
+    key = _spec_key(spec)
+    clause = _compiled.get(key)
+    if clause is None:
+        clause = _compile(spec or {})
+        if len(_compiled) > 1000:
+            _compiled.clear()
+        _compiled[key] = clause
+    return clause
+
+
+# ── Bitmap index ────────────────────────────────────────────────
+def iter_bits(bitmap: int) -> Iterator[int]:
+    """Yield set bit positions (= user ids) in ascending order."""
+    s = bin(bitmap)[:1:-1]  # little-endian bit string
+    i = s.find("1")
+    while i != -1:
+        yield i
+        i = s.find("1", i + 1)
+
+
+def range_mask(lo: int, hi: Optional[int]) -> int:
+    """Bitmap with bits [lo, hi) set; hi=None means 'up to any id'."""
+    if hi is None:
+        return -1 << lo  # & with a non-negative bitmap keeps every bit >= lo
+    return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+
+def split_bits(bitmap: int, parts: int) -> list[tuple[int, Optional[int]]]:
+    """Cut the id space into `parts` contiguous [lo, hi) ranges holding ~equal set bits.
+
+    The first range starts at 0 and the last is open-ended (hi=None), so
+    together they cover every id even if the bitmap changes afterwards.
+    """
+    total = bitmap.bit_count()
+    parts = max(1, min(parts, total))
+    cuts: list[int] = []
+    if parts > 1:
+        step = total / parts
+        next_cut = step
+        for n, uid in enumerate(iter_bits(bitmap)):
+            if n >= next_cut:
+                cuts.append(uid)
+                if len(cuts) == parts - 1:
+                    break
+                next_cut += step
+    bounds = [0, *cuts]
+    return [(lo, hi) for lo, hi in zip(bounds, [*cuts, None])]
+
+
+class SegmentIndex:
+    """In-memory bitmaps of user ids per attribute value."""
+
+    def __init__(self):
+        self.universe = 0
+        self.values: dict[str, dict] = {k: defaultdict(int) for k in _EQ_KEYS}
+        self.by_score: dict[int, int] = defaultdict(int)
+        self.paid = 0
+        self.inactive = 0
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+        self._range_cache: dict[tuple, int] = {}
+        # event_type -> (has-it bitmap, {count: bitmap}, last_at timestamps asc, matching uids)
+        self.events: dict[str, tuple[int, dict, list, list]] = {}
+
+    @classmethod
+    async def build(cls, session) -> "SegmentIndex":
+        started = time.monotonic()
+        idx = cls()
+        # Accumulate bit positions per value, OR them in once at the end —
+        # setting bits one at a time on a growing int is quadratic.
+        pos: dict[tuple, list] = defaultdict(list)
+        result = await session.stream(
+            select(
+                User.id, User.source, User.campaign, User.level_tag, User.user_status,
+                User.lead_segment, User.lead_score, User.is_active,
+            ).execution_options(yield_per=_SCAN_BATCH)
+        )
+        async for part in result.partitions(_SCAN_BATCH):
+            for uid, source, campaign, level_tag, user_status, lead_segment, score, is_active in part:
+                pos[("*",)].append(uid)
+                for key, val in (
+                    ("source", source), ("campaign", campaign), ("level_tag", level_tag),
+                    ("user_status", user_status), ("lead_segment", lead_segment),
+                ):
+                    if val:
+                        pos[(key, val)].append(uid)
+                pos[("score", score or 0)].append(uid)
+                if is_active is False:
+                    pos[("inactive",)].append(uid)
+            await asyncio.sleep(0)
+
+        ev_rows: dict[str, list] = defaultdict(list)
+        result = await session.stream(
+            select(
+                UserEventSummary.event_type, UserEventSummary.last_at,
+                UserEventSummary.user_id, UserEventSummary.count,
+            ).execution_options(yield_per=_SCAN_BATCH)
+        )
+        async for part in result.partitions(_SCAN_BATCH):
+            for event_type, last_at, uid, count in part:
+                ev_rows[event_type].append((last_at.timestamp(), uid, count))
+            await asyncio.sleep(0)
+        for event_type, rows in ev_rows.items():
+            rows.sort()
+            by_count: dict[int, list] = defaultdict(list)
+            for _, uid, count in rows:
+                by_count[count].append(uid)
+            idx.events[event_type] = (
+                _bitmap_of([uid for _, uid, _ in rows]),
+                {c: _bitmap_of(uids) for c, uids in by_count.items()},
+                [ts for ts, _, _ in rows],
+                [uid for _, uid, _ in rows],
+            )
+
+        paid_ids = (await session.execute(
+            select(Subscription.user_id).where(Subscription.status == "active")
+        )).scalars().all()
+        pos[("paid",)] = list(paid_ids)
+
+        for key, ids in pos.items():
+            bm = _bitmap_of(ids)
+            if key == ("*",):
+                idx.universe = bm
+            elif key == ("inactive",):
+                idx.inactive = bm
+            elif key == ("paid",):
+                idx.paid = bm & idx.universe
+            elif key[0] == "score":
+                idx.by_score[key[1]] = bm
+            else:
+                idx.values[key[0]][key[1]] = bm
+
+        idx.built_at = time.monotonic()
+        idx.build_seconds = idx.built_at - started
+        logger.info(f"🧮 Segment index built: {idx.count({})} users in {idx.build_seconds:.2f}s")
+        return idx
+
+    def _score_range(self, lo: Optional[int], hi: Optional[int]) -> int:
+        key = (lo, hi)
+        bm = self._range_cache.get(key)
+        if bm is None:
+            bm = 0
+            for score, score_bm in self.by_score.items():
+                if (lo is None or score >= lo) and (hi is None or score <= hi):
+                    bm |= score_bm
+            self._range_cache[key] = bm
+        return bm
+
+    def _event_match(self, pred: dict) -> int:
+        entry = self.events.get(pred["event"])
+        if entry is None:
+            return 0
+        has_bm, by_count, last_ts, uids = entry
+        bm = has_bm
+        lo, hi = pred.get("min_count") or None, pred.get("max_count") or None
+        if lo is not None or hi is not None:
+            cnt_bm = 0
+            for count, count_bm in by_count.items():
+                if (lo is None or count >= lo) and (hi is None or count <= hi):
+                    cnt_bm |= count_bm
+            bm &= cnt_bm
+        if pred.get("within_days"):
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=pred["within_days"])).timestamp()
+            bm &= _bitmap_of(uids[bisect_left(last_ts, cutoff):])
+        return bm
+
+    def evaluate(self, spec: Optional[dict]) -> int:
+        """Bitmap of user ids matching `spec` (same semantics as compile_spec)."""
+        spec = spec or {}
+        bm = self.universe
+        for key in _EQ_KEYS:
+            if spec.get(key):
+                bm &= self.values[key].get(spec[key], 0)
+        lo, hi = spec.get("lead_score_min") or None, spec.get("lead_score_max") or None
+        if lo is not None or hi is not None:
+            bm &= self._score_range(lo, hi)
+        if spec.get("paid"):
+            bm &= self.paid
+        if spec.get("is_active") is not None:
+            bm &= (self.universe & ~self.inactive) if spec["is_active"] else self.inactive
+        for pred in _event_predicates(spec):
+            match = self._event_match(pred)
+            bm &= match if pred.get("has", True) else ~match
+        for sub in spec.get("and") or []:
+            bm &= self.evaluate(sub)
+        if spec.get("or"):
+            any_bm = 0
+            for sub in spec["or"]:
+                any_bm |= self.evaluate(sub)
+            bm &= any_bm
+        if spec.get("not"):
+            bm &= ~self.evaluate(spec["not"])
+        return bm
+
+    def count(self, spec: Optional[dict]) -> int:
+        return self.evaluate(spec).bit_count()
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.built_at
+
+
+def _bitmap_of(ids) -> int:
+    """Build an int bitset from ids via a bytearray (linear, unlike repeated |=)."""
+    ids = [i for i in ids if i is not None and i >= 0]
+    if not ids:
+        return 0
+    buf = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+_index: Optional[SegmentIndex] = None
+_index_lock = asyncio.Lock()
+
+
+async def get_index(max_age: float = SEGMENT_INDEX_TTL) -> SegmentIndex:
+    """Shared process-wide index, rebuilt (once, under a lock) when stale."""
+    global _index
+    if _index is not None and _index.age <= max_age:
+        return _index
+    async with _index_lock:
+        if _index is None or _index.age > max_age:
+            from db.database import async_session
+            async with async_session() as session:
+                _index = await SegmentIndex.build(session)
+    return _index
+
+
+def invalidate_index():
+    """Force the next get_index() to rebuild (e.g. after bulk user changes)."""
+    global _index
+    _index = None
@@ -0,0 +1,239 @@
+"""Streaming user export — CSV, gzip'd CSV and Parquet.
+
+Rows are read through a server-side cursor (`AsyncSession.stream` +
+`yield_per`) selecting only the requested columns, and encoded batch by
+batch, so memory stays flat no matter how many users there are.
+
+Filters are the broadcast segment filters (see `CRMService._apply_filters`),
+so "export this audience" and "broadcast to this audience" select the same
+people.
+"""
+import csv
+import io
+import logging
+import zlib
+from typing import AsyncIterator, Callable, Optional
+
+from sqlalchemy import select
+
+from db.database import async_session
+from db.models import Subscription, User
+from services.crm import CRMService
+
+logger = logging.getLogger("user_export")
+
+FETCH_BATCH = 2000
+
+FORMAT_CSV = "csv"
+FORMAT_CSV_GZIP = "csv.gz"
+FORMAT_PARQUET = "parquet"
+FORMATS = (FORMAT_CSV, FORMAT_CSV_GZIP, FORMAT_PARQUET)
+
+MEDIA_TYPES = {
+    FORMAT_CSV: "text/csv",
+    FORMAT_CSV_GZIP: "application/gzip",
+    FORMAT_PARQUET: "application/vnd.apache.parquet",
+}
+
+# Broadcast filter keys accepted by CRMService._apply_filters
+FILTER_KEYS = (
+    "source", "campaign", "level_tag", "lead_score_min", "lead_score_max",
+    "user_status", "lead_segment", "paid",
+)
+
+
+def _dt_str(v) -> str:
+    return v.strftime("%d.%m.%Y %H:%M") if v else ""
+
+
+def _paid_status(user_status, sub_status) -> str:
+    if sub_status == "active":
+        return "To'lagan"
+    if user_status == "registered":
+        return "Ro'yxatdan o'tgan"
+    return "Ro'yxatdan o'tmagan"
+
+
+# key -> (CSV header, selected SQL columns, CSV formatter, parquet type name)
+# Formatters get the selected values positionally; the CSV keeps the legacy
+# human-readable shape, Parquet gets the raw typed values.
+COLUMNS: dict[str, tuple[str, tuple, Callable, str]] = {
+    "id":            ("ID", (User.id,), lambda v: v, "int64"),
+    "telegram_id":   ("Telegram ID", (User.telegram_id,), lambda v: v, "int64"),
+    "name":          ("Ism", (User.name,), lambda v: v or "", "string"),
+    "username":      ("Username", (User.username,), lambda v: v or "", "string"),
+    "phone":         ("Telefon", (User.phone,), lambda v: v or "", "string"),
+    "status":        ("Status", (User.user_status, Subscription.status), _paid_status, "string"),
+    "source":        ("Manba", (User.source,), lambda v: v or "organik", "string"),
+    "campaign":      ("Kampaniya", (User.campaign,), lambda v: v or "", "string"),
+    "level_tag":     ("Daraja", (User.level_tag,), lambda v: v or "", "string"),
+    "goal_tag":      ("Maqsad", (User.goal_tag,), lambda v: v or "", "string"),
+    "lead_segment":  ("Segment", (User.lead_segment,), lambda v: v or "", "string"),
+    "lead_score":    ("Lead Score", (User.lead_score,), lambda v: v or 0, "int64"),
+    "is_active":     ("Aktiv", (User.is_active,), lambda v: "Ha" if v else "Yo'q", "bool"),
+    "registered_at": ("Ro'yxatdan o'tgan sana", (User.registered_at,), _dt_str, "timestamp"),
+    "created_at":    ("Qo'shilgan sana", (User.created_at,), _dt_str, "timestamp"),
+}
+
+DEFAULT_COLUMNS = [
+    "id", "telegram_id", "name", "username", "phone", "status", "source",
+    "campaign", "lead_score", "is_active", "registered_at", "created_at",
+]
+
+
+def parse_columns(raw: Optional[str]) -> list[str]:
+    """Validate a comma-separated column list. Raises ValueError on unknown keys."""
+    if not raw:
+        return list(DEFAULT_COLUMNS)
+    cols = [c.strip() for c in raw.split(",") if c.strip()]
+    unknown = [c for c in cols if c not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return cols
+
+
+class UserExporter:
+    """Streams a filtered user export in one of FORMATS."""
+
+    def __init__(self, filters: dict, columns: list[str], active_only: bool = False):
+        self.filters = {k: v for k, v in (filters or {}).items() if k in FILTER_KEYS and v not in (None, "")}
+        self.columns = columns
+        self.active_only = active_only
+
+    def _query(self):
+        selected = []
+        for key in self.columns:
+            selected.extend(COLUMNS[key][1])
+        q = select(*selected).select_from(User)
+        if "status" in self.columns:
+            q = q.outerjoin(Subscription, Subscription.user_id == User.id)
+        if self.active_only:
+            q = q.where(User.is_active.isnot(False))
+        # _apply_filters is pure query-building; the session is never touched
+        q = CRMService(None)._apply_filters(q, self.filters)
+        return q.order_by(User.id).execution_options(yield_per=FETCH_BATCH)
+
+    async def _batches(self) -> AsyncIterator[list]:
+        """Yield lists of raw value tuples straight off a server-side cursor."""
+        rows_total = 0
+        async with async_session() as session:
+            result = await session.stream(self._query())
+            async for partition in result.partitions(FETCH_BATCH):
+                rows_total += len(partition)
+                yield partition
+        logger.info(f"📤 User export: {rows_total} rows, filters={self.filters}, cols={len(self.columns)}")
+
+    def _split(self, row) -> list[tuple]:
+        """Regroup a flat result row into per-column argument tuples."""
+        out, i = [], 0
+        for key in self.columns:
+            n = len(COLUMNS[key][1])
+            out.append(tuple(row[i:i + n]))
+            i += n
+        return out
+
+    # ── CSV / gzip ─────────────────────────────
+    async def iter_csv(self, compress: bool = False) -> AsyncIterator[bytes]:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        # gzip container via zlib (wbits=31) so we can flush per batch
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+        def _drain() -> bytes:
+            data = buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            return gz.compress(data) if gz else data
+
+        writer.writerow([COLUMNS[k][0] for k in self.columns])
+        formatters = [COLUMNS[k][2] for k in self.columns]
+        async for batch in self._batches():
+            for row in batch:
+                writer.writerow([f(*args) for f, args in zip(formatters, self._split(row))])
+            chunk = _drain()
+            if chunk:
+                yield chunk
+        tail = _drain()
+        if gz:
+            tail += gz.flush()
+        if tail:
+            yield tail
+
+    # ── Parquet ────────────────────────────────
+    async def iter_parquet(self) -> AsyncIterator[bytes]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        type_map = {
+            "int64": pa.int64(), "string": pa.string(), "bool": pa.bool_(),
+            "timestamp": pa.timestamp("us", tz="UTC"),
+        }
+        fields, raw_getters = [], []
+        for key in self.columns:
+            _, _, fmt, type_name = COLUMNS[key]
+            if key == "status":
+                # derived column — keep the human label
+                raw_getters.append(fmt)
+            else:
+                raw_getters.append(lambda v: v)
+            fields.append(pa.field(key, type_map[type_name]))
+        schema = pa.schema(fields)
+
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        try:
+            async for batch in self._batches():
+                columns = [[] for _ in self.columns]
+                for row in batch:
+                    for i, (get, args) in enumerate(zip(raw_getters, self._split(row))):
+                        columns[i].append(get(*args))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(c, type=f.type) for c, f in zip(columns, fields)], schema=schema,
+                ))
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        finally:
+            writer.close()
+        tail = sink.drain()
+        if tail:
+            yield tail
+
+    def stream(self, fmt: str) -> AsyncIterator[bytes]:
+        if fmt == FORMAT_PARQUET:
+            return self.iter_parquet()
+        return self.iter_csv(compress=(fmt == FORMAT_CSV_GZIP))
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands accumulated bytes back on drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
@@ -0,0 +1,94 @@
+"""Video note conversion planner — do the least work that yields a valid note.
+
+A Telegram video note is a square H.264/AAC MP4, at most NOTE_SIZE px and
+MAX_SECONDS long. Many uploads (round videos re-sent, phone clips already
+cropped) are most of the way there, so the input is probed first and one
+of three plans picked:
+
+  remux      square, ≤ NOTE_SIZE, H.264 yuv420p, AAC or silent
+             → stream copy (+faststart, trimmed to MAX_SECONDS)
+  crop       H.264 at ≤ 1080p / ≤ 30 fps that just isn't square or small
+             → crop+scale with a fast x264 preset, AAC copied when possible
+  transcode  anything else (HEVC, VP9, 4K, 60 fps, odd pixel formats)
+             → frame rate capped and the frame cropped/scaled before x264
+
+Trimming is an input option (-t before -i), so the decoder stops at
+MAX_SECONDS instead of reading the whole file. Threads per conversion are
+the CPU count shared by the videonote worker slots (TOOLS concurrency),
+at most MAX_THREADS — x264 at 640×640 gains nothing past that.
+
+`python -m benchmarks.videonote_bench` reports the median conversion time
+per input class.
+"""
+import os
+from typing import NamedTuple, Optional
+
+from services.ffmpeg_runner import FFmpegResult, run_ffmpeg
+from services.media_jobs import TOOLS
+from services.media_probe import MediaInfo, probe
+
+NOTE_SIZE = 640
+MAX_SECONDS = 60
+MAX_FPS = 30
+MAX_THREADS = 4
+CROP_MAX_HEIGHT = 1080  # above this the full transcode path (fps cap) pays off
+
+REMUX, CROP, TRANSCODE = "remux", "crop", "transcode"
+
+_SQUARE = f"crop='min(iw,ih)':'min(iw,ih)',scale={NOTE_SIZE}:{NOTE_SIZE}"
+
+
+class Plan(NamedTuple):
+    kind: str
+    args: list   # run_ffmpeg args, output last
+
+
+def _threads() -> int:
+    return max(1, min((os.cpu_count() or 2) // TOOLS["videonote"].concurrency, MAX_THREADS))
+
+
+def _h264_ok(info: MediaInfo) -> bool:
+    return info.video_codec == "h264" and info.pix_fmt in ("yuv420p", "yuvj420p", "")
+
+
+def plan(info: Optional[MediaInfo], src: str, dst: str) -> Plan:
+    """Pick remux / crop / transcode for `info` and build the ffmpeg args."""
+    trim = ["-t", str(MAX_SECONDS), "-i", src]
+    aac_ok = info is not None and info.audio_codec in ("aac", None)
+    audio = ["-c:a", "copy"] if aac_ok else ["-c:a", "aac", "-b:a", "128k"]
+
+    if info and _h264_ok(info) and aac_ok and info.width == info.height and 0 < info.width <= NOTE_SIZE:
+        return Plan(REMUX, [*trim, "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+                            "-movflags", "+faststart", dst])
+
+    if info and _h264_ok(info) and 0 < min(info.width, info.height) <= CROP_MAX_HEIGHT and info.fps <= MAX_FPS:
+        return Plan(CROP, [*trim, "-vf", _SQUARE,
+                           "-c:v", "libx264", "-crf", "26", "-preset", "superfast",
+                           *audio, "-movflags", "+faststart", dst])
+
+    # fps cap first, then crop (no pixel work) and scale the square down — the
+    # expensive filters only ever see MAX_FPS frames of at most NOTE_SIZE²
+    fps = f"fps={MAX_FPS}," if info and info.fps > MAX_FPS else ""
+    return Plan(TRANSCODE, [*trim, "-vf", f"{fps}{_SQUARE}",
+                            "-c:v", "libx264", "-crf", "26", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                            "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", dst])
+
+
+async def convert(
+    src: str, dst: str, ctx=None, progress_text: Optional[str] = None, label: str = "videonote",
+) -> tuple[Plan, FFmpegResult]:
+    """Probe `src`, run the cheapest valid plan into `dst`.
+
+    A failed remux (odd container, broken timestamps) falls back to a
+    full transcode once.
+    """
+    info = await probe(src)
+    chosen = plan(info, src, dst)
+    duration = min(info.duration, MAX_SECONDS) if info else 0
+    result = await run_ffmpeg(chosen.args, ctx=ctx, label=f"{label}:{chosen.kind}", duration=duration,
+                              progress_text=progress_text, threads=_threads())
+    if not result.ok and chosen.kind == REMUX:
+        chosen = plan(info._replace(video_codec=None), src, dst)
+        result = await run_ffmpeg(chosen.args, ctx=ctx, label=f"{label}:{chosen.kind}", duration=duration,
+                                  progress_text=progress_text, threads=_threads())
+    return chosen, result
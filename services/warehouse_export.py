@@ -0,0 +1,320 @@
+"""Incremental analytics export — append-only files for off-OLTP analysis.
+
+Copies new rows of `events`, `payments`, `purchases` and the landing event
+tables into date-partitioned files under WAREHOUSE_DIR:
+
+    <WAREHOUSE_DIR>/<table>/dt=YYYY-MM-DD/part-<first id>.parquet   (or .ndjson.gz)
+    <WAREHOUSE_DIR>/_manifest.json
+
+Each table has an id watermark in the manifest. A run reads rows with
+id > watermark in id order (server-side cursor, EXPORT_BATCH rows at a
+time), writes one file per day touched by the batch, and only then
+advances the watermark — files are written to a temp name and renamed,
+the manifest is replaced atomically. A crash loses at most the in-flight
+batch; the next run deletes any part files the manifest doesn't know
+about and re-exports from the watermark, so runs are resumable and never
+duplicate rows.
+
+Every table stops short of rows younger than COMMIT_LAG: ids are handed
+out at insert, so a transaction holding a lower id can commit after a
+higher one was already visible — exporting right up to the newest row
+would move the watermark past it and skip it forever. `payments` and
+`purchases` rows also change status after insert, so they wait for
+WAREHOUSE_SETTLE_HOURS instead (pending → success / failed has happened
+by then).
+
+Parquet files use per-column codecs (JSON payloads zstd, ids/enums snappy
+with dictionary encoding); NDJSON is gzip'd per file. Parquet needs
+pyarrow; without it the run falls back to NDJSON.
+
+Nightly at 03:00 (before the 03:30 retention run), or by hand:
+    python -m services.warehouse_export [--table events] [--format ndjson]
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from bot.config import settings
+from db.database import async_session
+from db.models import AgencyEvent, CourseLandingEvent, Event, Payment, Purchase, QuizEvent
+
+logger = logging.getLogger("warehouse_export")
+
+EXPORT_BATCH = 50_000
+MANIFEST_NAME = "_manifest.json"
+RUN_AT_HOUR, RUN_AT_MINUTE = 3, 0
+COMMIT_LAG = timedelta(minutes=5)  # rows younger than this may still have an uncommitted lower id
+
+FORMAT_PARQUET = "parquet"
+FORMAT_NDJSON = "ndjson"
+
+# column -> (arrow type name, parquet codec)
+_LANDING_COLUMNS = {
+    "id": ("int64", "snappy"),
+    "session_id": ("string", "zstd"),
+    "event_type": ("string", "snappy"),
+    "utm_source": ("string", "snappy"),
+    "utm_campaign": ("string", "snappy"),
+    "created_at": ("timestamp", "snappy"),
+}
+
+# table -> (model, columns, settle before export)
+TABLES = {
+    "events": (Event, {
+        "id": ("int64", "snappy"),
+        "user_id": ("int64", "snappy"),
+        "event_type": ("string", "snappy"),
+        "payload": ("json", "zstd"),
+        "created_at": ("timestamp", "snappy"),
+    }, False),
+    "payments": (Payment, {
+        "id": ("int64", "snappy"),
+        "user_id": ("int64", "snappy"),
+        "amount": ("int64", "snappy"),
+        "referral_discount": ("int64", "snappy"),
+        "provider": ("string", "snappy"),
+        "status": ("string", "snappy"),
+        "transaction_id": ("string", "zstd"),
+        "created_at": ("timestamp", "snappy"),
+    }, True),
+    "purchases": (Purchase, {
+        "id": ("int64", "snappy"),
+        "user_id": ("int64", "snappy"),
+        "product_id": ("int64", "snappy"),
+        "amount": ("int64", "snappy"),
+        "provider": ("string", "snappy"),
+        "status": ("string", "snappy"),
+        "payment_id": ("int64", "snappy"),
+        "created_at": ("timestamp", "snappy"),
+        "paid_at": ("timestamp", "snappy"),
+    }, True),
+    "quiz_events": (QuizEvent, _LANDING_COLUMNS, False),
+    "course_landing_events": (CourseLandingEvent, _LANDING_COLUMNS, False),
+    "agency_events": (AgencyEvent, _LANDING_COLUMNS, False),
+}
+
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# ── Manifest ───────────────────────────────────
+def _load_manifest(root: str) -> dict:
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"version": 1, "tables": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(root: str, manifest: dict):
+    path = os.path.join(root, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _remove_orphans(root: str, table: str, known: set) -> int:
+    """Delete part files (and stale temp files) the manifest doesn't list —
+    leftovers of a batch that crashed before its manifest update."""
+    removed = 0
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return 0
+    for dirpath, _, filenames in os.walk(table_dir):
+        for name in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, name), root)
+            if rel not in known:
+                os.remove(os.path.join(dirpath, name))
+                removed += 1
+    return removed
+
+
+# ── Encoding ───────────────────────────────────
+def _to_plain(kind: str, value):
+    if value is None:
+        return None
+    if kind == "json":
+        return json.dumps(value, ensure_ascii=False, default=str)
+    if kind == "timestamp":
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+    return value
+
+
+def _write_parquet(path: str, columns: dict, rows: list):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    type_map = {
+        "int64": pa.int64(), "string": pa.string(), "json": pa.string(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }
+    names = list(columns)
+    arrays = [
+        pa.array([_to_plain(columns[n][0], r[i]) for r in rows], type=type_map[columns[n][0]])
+        for i, n in enumerate(names)
+    ]
+    table = pa.Table.from_arrays(arrays, names=names)
+    pq.write_table(
+        table, path,
+        compression={n: columns[n][1] for n in names},
+        use_dictionary=[n for n in names if columns[n][0] == "string"],
+    )
+
+
+def _write_ndjson(path: str, columns: dict, rows: list):
+    names = list(columns)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for r in rows:
+            rec = {}
+            for i, n in enumerate(names):
+                v = r[i]
+                if columns[n][0] == "timestamp" and v is not None:
+                    v = _to_plain("timestamp", v).isoformat()
+                rec[n] = v
+            f.write(json.dumps(rec, ensure_ascii=False, default=str))
+            f.write("\n")
+
+
+def _write_batch(root: str, table: str, columns: dict, fmt: str, rows: list) -> list[dict]:
+    """Write one batch as one file per day. Returns manifest file entries."""
+    by_day: dict[date, list] = defaultdict(list)
+    created_idx = list(columns).index("created_at")
+    for r in rows:
+        created = r[created_idx]
+        by_day[created.date() if created else date(1970, 1, 1)].append(r)
+
+    ext = "parquet" if fmt == FORMAT_PARQUET else "ndjson.gz"
+    entries = []
+    for day, day_rows in sorted(by_day.items()):
+        rel = os.path.join(table, f"dt={day.isoformat()}", f"part-{day_rows[0][0]:012d}.{ext}")
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        if fmt == FORMAT_PARQUET:
+            _write_parquet(tmp, columns, day_rows)
+        else:
+            _write_ndjson(tmp, columns, day_rows)
+        os.replace(tmp, path)
+        entries.append({
+            "path": rel, "rows": len(day_rows), "day": day.isoformat(),
+            "min_id": day_rows[0][0], "max_id": day_rows[-1][0], "bytes": os.path.getsize(path),
+        })
+    return entries
+
+
+# ── Export ─────────────────────────────────────
+async def _upper_bound(session, model, watermark: int, settle: bool) -> Optional[int]:
+    """First id that must NOT be exported yet (too recent or still settling), or None."""
+    lag = max(timedelta(hours=settings.WAREHOUSE_SETTLE_HOURS), COMMIT_LAG) if settle else COMMIT_LAG
+    cutoff = datetime.now(timezone.utc) - lag
+    return (await session.execute(
+        select(func.min(model.id)).where(model.id > watermark, model.created_at >= cutoff)
+    )).scalar()
+
+
+async def export_table(root: str, table: str, manifest: dict, fmt: str) -> dict:
+    model, columns, settle = TABLES[table]
+    state = manifest["tables"].setdefault(table, {"watermark": 0, "files": []})
+    removed = _remove_orphans(root, table, {f["path"] for f in state["files"]})
+    if removed:
+        logger.warning(f"📦 {table}: removed {removed} orphaned part files from an interrupted run")
+
+    exported = 0
+    async with async_session() as session:
+        bound = await _upper_bound(session, model, state["watermark"], settle)
+        q = select(*[getattr(model, c) for c in columns]).where(model.id > state["watermark"])
+        if bound is not None:
+            q = q.where(model.id < bound)
+        q = q.order_by(model.id).execution_options(yield_per=EXPORT_BATCH)
+        result = await session.stream(q)
+        async for batch in result.partitions(EXPORT_BATCH):
+            entries = await asyncio.to_thread(_write_batch, root, table, columns, fmt, batch)
+            state["files"].extend(entries)
+            state["watermark"] = batch[-1][0]
+            state["updated_at"] = datetime.now(timezone.utc).isoformat()
+            _save_manifest(root, manifest)
+            exported += len(batch)
+
+    return {"rows": exported, "watermark": state["watermark"], "orphans_removed": removed}
+
+
+async def run_export(tables: Optional[list[str]] = None, fmt: Optional[str] = None) -> dict:
+    """Export every table (or `tables`) since its watermark. Returns a per-table report."""
+    root = settings.WAREHOUSE_DIR
+    os.makedirs(root, exist_ok=True)
+    fmt = fmt or settings.WAREHOUSE_FORMAT
+    if fmt == FORMAT_PARQUET and not _parquet_available():
+        logger.warning("📦 pyarrow not installed — falling back to NDJSON")
+        fmt = FORMAT_NDJSON
+
+    manifest = _load_manifest(root)
+    started = time.monotonic()
+    report = {}
+    for table in tables or list(TABLES):
+        try:
+            report[table] = await export_table(root, table, manifest, fmt)
+        except Exception as e:
+            # Watermark only moved for batches that were fully written.
+            logger.error(f"📦 Warehouse export of {table} failed: {e}")
+            report[table] = {"error": str(e)}
+    manifest["last_run"] = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "format": fmt,
+        "duration_s": round(time.monotonic() - started, 1),
+        "report": report,
+    }
+    _save_manifest(root, manifest)
+    logger.info(f"📦 Warehouse export done: {report}")
+    return report
+
+
+async def _cron_loop():
+    while True:
+        now = datetime.now()
+        target = datetime(now.year, now.month, now.day, RUN_AT_HOUR, RUN_AT_MINUTE)
+        if now > target:
+            target += timedelta(days=1)
+        wait_seconds = (target - now).total_seconds()
+        logger.info(f"Warehouse export scheduled at {target} (in {wait_seconds:.0f} seconds)")
+        await asyncio.sleep(wait_seconds)
+        try:
+            await run_export()
+        except Exception as e:
+            logger.error(f"Error executing warehouse export cron: {e}")
+
+
+def start_cron():
+    """Starts the nightly warehouse export loop in the background."""
+    if not settings.WAREHOUSE_EXPORT_ENABLED:
+        logger.info("Warehouse export disabled (WAREHOUSE_EXPORT_ENABLED=false)")
+        return
+    asyncio.create_task(_cron_loop())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Incremental analytics warehouse export")
+    parser.add_argument("--table", action="append", choices=list(TABLES), help="export only this table (repeatable)")
+    parser.add_argument("--format", choices=[FORMAT_PARQUET, FORMAT_NDJSON], default=None)
+    args = parser.parse_args()
+    asyncio.run(run_export(args.table, args.format))
@@ -0,0 +1,328 @@
+"""Warm yt-dlp worker processes — no interpreter start per download.
+
+The `yt-dlp` CLI paid Python startup plus the import of ~1800 extractors
+(hundreds of ms, tens of MB) on every link. Here a few child processes
+import `yt_dlp` once and then serve downloads over a pipe:
+
+    info = await get_pool().download(url, outtmpl, platform="TikTok", on_progress=cb)
+
+- `on_progress(dict)` gets {"downloaded", "total", "speed", "eta"} at most
+  every PROGRESS_INTERVAL, then {"stage": "processing"} once the download
+  is done and ffmpeg merge/recode runs.
+- Failures raise YtdlpError with a `code` (LOGIN_REQUIRED, PRIVATE,
+  NOT_FOUND, UNSUPPORTED, GEO_BLOCKED, RATE_LIMITED, FAILED) classified
+  once, in the child, from yt-dlp's exception types.
+- Cancelling the awaiting task kills that child — and, as each child
+  leads its own process group, the ffmpeg merge/recode it started — and
+  starts a fresh one.
+- PLATFORM_LIMITS caps concurrent downloads per platform across all
+  processes (Redis lease set; per-process semaphores without Redis), so
+  one viral TikTok wave can't get the server IP throttled. A holder renews
+  its lease every LEASE_RENEW while it downloads; a crashed one's slot
+  frees after PLATFORM_LEASE.
+
+YTDLP_POOL_SIZE children per process (each mediadown media worker owns
+its own warm pool).
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("ytdlp_pool")
+
+PROGRESS_INTERVAL = 1.0
+PLATFORM_LEASE = 120     # seconds; a crashed holder's slot frees after this
+LEASE_RENEW = 40         # seconds between lease renewals while downloading
+SLOT_POLL = 1.0
+PLATFORM_LIMITS = {
+    "TikTok": 3,
+    "Pinterest": 2,
+    "Snapchat": 2,
+    "Twitter/X": 2,
+    "Facebook": 2,
+    "Reddit": 2,
+    "LinkedIn": 1,
+}
+DEFAULT_PLATFORM_LIMIT = 2
+
+LOGIN_REQUIRED = "login_required"   # bot check / "sign in to confirm"
+PRIVATE = "private"
+NOT_FOUND = "not_found"
+UNSUPPORTED = "unsupported"
+GEO_BLOCKED = "geo_blocked"
+RATE_LIMITED = "rate_limited"
+FAILED = "failed"
+
+# Same behaviour as the old CLI flags:
+# --no-playlist --merge-output-format mp4 --recode-video mp4 -f bestvideo+bestaudio/best
+# --no-warnings --no-check-certificates --socket-timeout 30 --retries 3
+BASE_OPTIONS = {
+    "noplaylist": True,
+    "merge_output_format": "mp4",
+    "postprocessors": [{"key": "FFmpegVideoConvertor", "preferedformat": "mp4"}],
+    "format": "bestvideo+bestaudio/best",
+    "quiet": True,
+    "no_warnings": True,
+    "noprogress": True,
+    "nocheckcertificate": True,
+    "socket_timeout": 30,
+    "retries": 3,
+}
+
+
+class YtdlpError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+
+
+# ── Child process ────────────────────────────────────────────────────────────
+
+def _classify(exc: Exception) -> str:
+    from yt_dlp.utils import DownloadError, GeoRestrictedError, UnsupportedError
+
+    cause = exc.exc_info[1] if isinstance(exc, DownloadError) and exc.exc_info else exc
+    if isinstance(cause, UnsupportedError):
+        return UNSUPPORTED
+    if isinstance(cause, GeoRestrictedError):
+        return GEO_BLOCKED
+    # ExtractorError carries no finer type; the extractors' wording is stable
+    text = str(exc)
+    low = text.lower()
+    if "sign in to confirm" in low or "cookies" in low:
+        return LOGIN_REQUIRED
+    if "private" in low or "login" in low:
+        return PRIVATE
+    if "429" in text or "too many requests" in low:
+        return RATE_LIMITED
+    if "not found" in low or "404" in text or "unavailable" in low:
+        return NOT_FOUND
+    if "unsupported url" in low:
+        return UNSUPPORTED
+    return FAILED
+
+
+def _child_main(conn):
+    os.setpgrp()  # own process group: kill() takes yt-dlp's ffmpeg children along
+    import yt_dlp  # the import this pool exists to pay only once
+
+    while True:
+        try:
+            url, outtmpl, options = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        last = [0.0]
+
+        def hook(d):
+            if d.get("status") == "downloading":
+                now = time.monotonic()
+                if now - last[0] >= PROGRESS_INTERVAL:
+                    last[0] = now
+                    conn.send(("progress", {
+                        "downloaded": d.get("downloaded_bytes") or 0,
+                        "total": d.get("total_bytes") or d.get("total_bytes_estimate") or 0,
+                        "speed": d.get("speed") or 0,
+                        "eta": d.get("eta"),
+                    }))
+            elif d.get("status") == "finished":
+                conn.send(("progress", {"stage": "processing"}))
+
+        try:
+            with yt_dlp.YoutubeDL({**BASE_OPTIONS, **options, "outtmpl": outtmpl, "progress_hooks": [hook]}) as ydl:
+                info = ydl.extract_info(url, download=True)
+            downloads = info.get("requested_downloads") or [{}]
+            conn.send(("done", {
+                "filepath": downloads[-1].get("filepath") or info.get("filepath"),
+                "title": info.get("title"),
+                "duration": info.get("duration"),
+                "ext": info.get("ext"),
+                "width": info.get("width"),
+                "height": info.get("height"),
+            }))
+        except Exception as e:
+            try:
+                code = _classify(e)
+            except Exception:
+                code = FAILED
+            conn.send(("error", code, str(e)[:500]))
+
+
+class _Worker:
+    def __init__(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_child_main, args=(child,), daemon=True, name="ytdlp")
+        self.proc.start()
+        child.close()
+
+    def alive(self) -> bool:
+        return self.proc.is_alive()
+
+    async def recv(self):
+        if not self.conn.poll():
+            loop = asyncio.get_running_loop()
+            ready = loop.create_future()
+            loop.add_reader(self.conn.fileno(), lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(self.conn.fileno())
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.proc.join(1)
+            raise YtdlpError(FAILED, f"yt-dlp worker died (exit code {self.proc.exitcode})")
+
+    def kill(self):
+        # the whole group, even if the child itself is gone: an ffmpeg merge it
+        # started would keep writing into a job dir that is being deleted
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join(1)
+        self.conn.close()
+
+
+# ── Per-platform limits ──────────────────────────────────────────────────────
+
+# KEYS[1] = lease zset; ARGV = limit, token, lease seconds. 1 = slot taken.
+_SLOT_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - tonumber(ARGV[3]))
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# KEYS[1] = lease zset; ARGV = token, lease seconds. Moves a held lease to now.
+_RENEW_LUA = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 0
+end
+local t = redis.call('TIME')
+redis.call('ZADD', KEYS[1], tonumber(t[1]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_local_slots: dict[str, asyncio.Semaphore] = {}
+
+
+@asynccontextmanager
+async def platform_slot(platform: str):
+    """Hold one of PLATFORM_LIMITS[platform] download slots."""
+    from services.media_jobs import get_redis
+
+    limit = PLATFORM_LIMITS.get(platform, DEFAULT_PLATFORM_LIMIT)
+    redis = await get_redis()
+    if not redis:
+        sem = _local_slots.setdefault(platform, asyncio.Semaphore(limit))
+        async with sem:
+            yield
+        return
+
+    key, token = f"media:ytdlp:slots:{platform}", uuid.uuid4().hex
+    try:
+        while not await redis.eval(_SLOT_LUA, 1, key, limit, token, PLATFORM_LEASE):
+            await asyncio.sleep(SLOT_POLL)
+    except Exception as e:
+        logger.warning(f"Platform slot unavailable ({e}), downloading without it")
+        token = None
+    renew = asyncio.create_task(_renew_lease(redis, key, token)) if token else None
+    try:
+        yield
+    finally:
+        if renew:
+            renew.cancel()
+        if token:
+            try:
+                await redis.zrem(key, token)
+            except Exception:
+                pass
+
+
+async def _renew_lease(redis, key: str, token: str):
+    """Keep a held slot's lease fresh for as long as the download runs."""
+    while True:
+        await asyncio.sleep(LEASE_RENEW)
+        try:
+            await redis.eval(_RENEW_LUA, 1, key, token, PLATFORM_LEASE)
+        except Exception as e:
+            logger.debug(f"Platform lease renewal failed: {e}")
+
+
+# ── Pool ─────────────────────────────────────────────────────────────────────
+
+class YtdlpPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: asyncio.Queue = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(_Worker())
+
+    async def download(
+        self,
+        url: str,
+        outtmpl: str,
+        platform: str = "",
+        on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+        **options,
+    ) -> dict:
+        """Download `url` to `outtmpl`; returns filepath/title/duration/ext/width/height."""
+        async with platform_slot(platform):
+            worker = await self._idle.get()
+            healthy = False
+            try:
+                if not worker.alive():
+                    worker = _Worker()
+                worker.conn.send((url, outtmpl, options))
+                while True:
+                    msg = await worker.recv()
+                    if msg[0] == "progress":
+                        if on_progress:
+                            try:
+                                await on_progress(msg[1])
+                            except Exception as e:
+                                logger.debug(f"yt-dlp progress callback failed: {e}")
+                    elif msg[0] == "done":
+                        healthy = True
+                        return msg[1]
+                    else:
+                        healthy = True
+                        raise YtdlpError(msg[1], msg[2])
+            finally:
+                if not healthy:  # cancelled, timed out or died mid-download
+                    worker.kill()
+                    worker = _Worker()
+                self._idle.put_nowait(worker)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+
+
+_pool: Optional[YtdlpPool] = None
+
+
+def get_pool() -> YtdlpPool:
+    """This process's warm pool, started on first use."""
+    global _pool
+    if _pool is None:
+        from bot.config import settings
+        _pool = YtdlpPool(max(settings.YTDLP_POOL_SIZE, 1))
+        logger.info(f"yt-dlp pool: {_pool.size} warm worker(s)")
+    return _pool
@@ -26,18 +26,13 @@ async def schedule_delayed_video(telegram_id: int, delay_seconds: int = 1800):
     async def _send_delayed():
         await asyncio.sleep(delay_seconds)
         try:
-            from bot.config import settings
-            from aiogram import Bot
+            from bot.utils.bot_registry import get_bot
             from bot.locales import uz
-            bot = Bot(token=settings.BOT_TOKEN)
-            try:
-                await bot.send_message(
-                    chat_id=telegram_id,
-                    text=uz.DELAYED_VIDEO_TEXT if hasattr(uz, 'DELAYED_VIDEO_TEXT') else
-                         "🎬 Sizga maxsus video tayyorladik! Darslar bo'limiga o'ting 👇",
-                )
-            finally:
-                await bot.session.close()
+            await get_bot().send_message(
+                chat_id=telegram_id,
+                text=uz.DELAYED_VIDEO_TEXT if hasattr(uz, 'DELAYED_VIDEO_TEXT') else
+                     "🎬 Sizga maxsus video tayyorladik! Darslar bo'limiga o'ting 👇",
+            )
             logger.info(f"Delayed video sent to {telegram_id}")
         except Exception as e:
             logger.error(f"Failed to send delayed video to {telegram_id}: {e}")
@@ -46,8 +41,8 @@ async def schedule_delayed_video(telegram_id: int, delay_seconds: int = 1800):
     logger.info(f"Delayed video scheduled for {telegram_id} in {delay_seconds}s")
 
 
-async def schedule_broadcast(broadcast_id: int, bot_instance=None, progress_chat_id=None, progress_message_id=None):
-    """Schedule batch broadcast sending."""
+async def schedule_broadcast(broadcast_id: int, bot_instance=None, progress_chat_id=None, progress_message_id=None, retry_failed: bool = False):
+    """Schedule batch broadcast sending (retry_failed: only recipients whose delivery failed)."""
 
     async def _send_broadcast():
         await asyncio.sleep(0)  # Yield control to event loop, don't block
@@ -58,6 +53,7 @@ async def schedule_broadcast(broadcast_id: int, bot_instance=None, progress_chat
                 bot_instance=bot_instance,
                 progress_chat_id=progress_chat_id,
                 progress_message_id=progress_message_id,
+                retry_failed=retry_failed,
             )
             logger.info(f"Broadcast {broadcast_id} completed")
         except Exception as e:
@@ -72,8 +68,7 @@ async def schedule_payment_reminders(telegram_id: int):
     """Schedule smart payment reminders (24h and 72h after first interaction)."""
 
     async def _send_reminders():
-        from bot.config import settings
-        from aiogram import Bot
+        from bot.utils.bot_registry import get_bot
 
         delays = [
             (86400, "⏰ Salom! Kursga yozilishni unutmang. Chegirma tez orada tugaydi! 🔥"),
@@ -83,11 +78,7 @@ async def schedule_payment_reminders(telegram_id: int):
         for delay, text in delays:
             await asyncio.sleep(delay)
             try:
-                bot = Bot(token=settings.BOT_TOKEN)
-                try:
-                    await bot.send_message(chat_id=telegram_id, text=text)
-                finally:
-                    await bot.session.close()
+                await get_bot().send_message(chat_id=telegram_id, text=text)
                 logger.info(f"Payment reminder sent to {telegram_id}")
             except Exception as e:
                 logger.warning(f"Payment reminder failed for {telegram_id}: {e}")
@@ -100,24 +91,20 @@ async def schedule_churn_check(telegram_id: int):
     """Schedule churn prevention flow: Day 1, 3, 5, 7."""
 
     async def _churn_flow():
-        from bot.config import settings
-        from aiogram import Bot
+        from bot.utils.bot_registry import get_bot
         from bot.handlers.subscription import handle_churn
 
-        bot = Bot(token=settings.BOT_TOKEN)
-        try:
-            # Delays are ABSOLUTE from task start (not cumulative)
-            prev_delay = 0
-            for day, abs_delay in [(1, 86400), (3, 259200), (5, 432000), (7, 604800)]:
-                await asyncio.sleep(abs_delay - prev_delay)
-                prev_delay = abs_delay
-                try:
-                    await handle_churn(bot, telegram_id, day)
-                    logger.info(f"Churn day {day} sent to {telegram_id}")
-                except Exception as e:
-                    logger.warning(f"Churn day {day} failed for {telegram_id}: {e}")
-        finally:
-            await bot.session.close()
+        bot = get_bot()
+        # Delays are ABSOLUTE from task start (not cumulative)
+        prev_delay = 0
+        for day, abs_delay in [(1, 86400), (3, 259200), (5, 432000), (7, 604800)]:
+            await asyncio.sleep(abs_delay - prev_delay)
+            prev_delay = abs_delay
+            try:
+                await handle_churn(bot, telegram_id, day)
+                logger.info(f"Churn day {day} sent to {telegram_id}")
+            except Exception as e:
+                logger.warning(f"Churn day {day} failed for {telegram_id}: {e}")
 
     _fire_and_forget(_churn_flow())
     logger.info(f"Churn check scheduled for {telegram_id}")
@@ -127,27 +114,23 @@ async def schedule_warmup_sequence(telegram_id: int):
     """Schedule the 7-day warmup/progrev content sequence (pre-tripwire nurture)."""
 
     async def _warmup_flow():
-        from bot.config import settings
-        from aiogram import Bot
+        from bot.utils.bot_registry import get_bot
         from bot.handlers.warmup import handle_warmup_day
 
-        bot = Bot(token=settings.BOT_TOKEN)
-        try:
-            # Delays are ABSOLUTE from task start (not cumulative)
-            prev_delay = 0
-            for day, abs_delay in [
-                (1, 86400), (2, 172800), (3, 259200), (4, 345600),
-                (5, 432000), (6, 518400), (7, 604800),
-            ]:
-                await asyncio.sleep(abs_delay - prev_delay)
-                prev_delay = abs_delay
-                try:
-                    await handle_warmup_day(bot, telegram_id, day)
-                    logger.info(f"Warmup day {day} sent to {telegram_id}")
-                except Exception as e:
-                    logger.warning(f"Warmup day {day} failed for {telegram_id}: {e}")
-        finally:
-            await bot.session.close()
+        bot = get_bot()
+        # Delays are ABSOLUTE from task start (not cumulative)
+        prev_delay = 0
+        for day, abs_delay in [
+            (1, 86400), (2, 172800), (3, 259200), (4, 345600),
+            (5, 432000), (6, 518400), (7, 604800),
+        ]:
+            await asyncio.sleep(abs_delay - prev_delay)
+            prev_delay = abs_delay
+            try:
+                await handle_warmup_day(bot, telegram_id, day)
+                logger.info(f"Warmup day {day} sent to {telegram_id}")
+            except Exception as e:
+                logger.warning(f"Warmup day {day} failed for {telegram_id}: {e}")
 
     _fire_and_forget(_warmup_flow())
     logger.info(f"Warmup sequence scheduled for {telegram_id}")
@@ -163,7 +146,7 @@ async def schedule_masterclass_send(telegram_id: int, delay_seconds: int = None)
 
     async def _send_masterclass():
         from bot.config import settings
-        from aiogram import Bot
+        from bot.utils.bot_registry import get_bot
         from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
         from db.database import async_session
         from db.models import AdminSetting
@@ -191,7 +174,7 @@ async def schedule_masterclass_send(telegram_id: int, delay_seconds: int = None)
             [InlineKeyboardButton(text="📝 Arizani to'ldirish", callback_data="application:start")]
         ])
 
-        bot = Bot(token=settings.BOT_TOKEN)
+        bot = get_bot()
         try:
             caption = (
                 "🎬 <b>Masterclass tayyor!</b>\n\n"
@@ -205,8 +188,6 @@ async def schedule_masterclass_send(telegram_id: int, delay_seconds: int = None)
             logger.info(f"Masterclass sent to {telegram_id}")
         except Exception as e:
             logger.error(f"Failed to send masterclass to {telegram_id}: {e}")
-        finally:
-            await bot.session.close()
 
     _fire_and_forget(_send_masterclass())
     logger.info(f"Masterclass scheduled for {telegram_id}")
@@ -217,8 +198,7 @@ async def start_scheduled_message_checker():
     SCHED_CONCURRENCY = 28
 
     async def _checker_loop():
-        from bot.config import settings
-        from aiogram import Bot
+        from bot.utils.bot_registry import get_bot
         from db.database import async_session
         from db.models import ScheduledMessage, User
         from sqlalchemy import select
@@ -258,21 +238,19 @@ async def start_scheduled_message_checker():
                     counters = {"sent": 0, "failed": 0}
                     _lock = asyncio.Lock()
 
-                    bot = Bot(token=settings.BOT_TOKEN)
-                    try:
-                        async def _send(uid: int):
-                            async with sem:
-                                try:
-                                    await bot.send_message(chat_id=uid, text=msg.content, parse_mode="HTML")
-                                    async with _lock:
-                                        counters["sent"] += 1
-                                except Exception:
-                                    async with _lock:
-                                        counters["failed"] += 1
-
-                        await asyncio.gather(*[_send(uid) for uid in user_ids], return_exceptions=True)
-                    finally:
-                        await bot.session.close()
+                    bot = get_bot()
+
+                    async def _send(uid: int):
+                        async with sem:
+                            try:
+                                await bot.send_message(chat_id=uid, text=msg.content, parse_mode="HTML")
+                                async with _lock:
+                                    counters["sent"] += 1
+                            except Exception:
+                                async with _lock:
+                                    counters["failed"] += 1
+
+                    await asyncio.gather(*[_send(uid) for uid in user_ids], return_exceptions=True)
 
                     sent   = counters["sent"]
                     failed = counters["failed"]